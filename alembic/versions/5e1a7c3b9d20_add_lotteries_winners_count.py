@@ -0,0 +1,42 @@
+"""Add lotteries winners count
+
+Lotteries drawing only their first winners_count winners, NULL for the
+former full permutation draws.
+
+Revision ID: 5e1a7c3b9d20
+Revises:
+Create Date: 2026-10-17 08:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e1a7c3b9d20'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def lotteries_columns():
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table("lotteries"):
+        return None
+    return {column["name"] for column in inspector.get_columns("lotteries")}
+
+
+def upgrade() -> None:
+    columns = lotteries_columns()
+    # Already there when created by metadata.create_all
+    if columns is None or "winners_count" in columns:
+        return
+    op.add_column("lotteries", sa.Column("winners_count", sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    columns = lotteries_columns()
+    if columns is None or "winners_count" not in columns:
+        return
+    with op.batch_alter_table("lotteries") as batch_op:
+        batch_op.drop_column("winners_count")
@@ -0,0 +1,35 @@
+"""Add delegations
+
+Delegation histories of stake addresses, one row by active epoch.
+
+Revision ID: 6f2b8d4c0e31
+Revises: 5e1a7c3b9d20
+Create Date: 2026-10-17 08:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6f2b8d4c0e31'
+down_revision = '5e1a7c3b9d20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Already there when created by metadata.create_all
+    if sa.inspect(op.get_bind()).has_table("delegations"):
+        return
+    op.create_table(
+        "delegations",
+        sa.Column("address_id", sa.String(), primary_key=True),
+        sa.Column("epoch_no", sa.Integer(), primary_key=True),
+        sa.Column("pool_id", sa.String()),
+        sa.Column("amount", sa.BigInteger()),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("delegations")
@@ -0,0 +1,46 @@
+"""Add pool owners unique constraint
+
+Conflict target of the pool owners bulk upsert. Owners stored twice by
+the former inserts are removed first, the oldest row is kept.
+
+Revision ID: 7a3c9e5d1f42
+Revises: 6f2b8d4c0e31
+Create Date: 2026-10-17 08:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7a3c9e5d1f42'
+down_revision = '6f2b8d4c0e31'
+branch_labels = None
+depends_on = None
+
+CONSTRAINT_NAME = "uq_pool_owners_pool_id_address_id"
+
+
+def has_constraint():
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table("pool_owners"):
+        return None
+    return CONSTRAINT_NAME in {constraint["name"] for constraint in inspector.get_unique_constraints("pool_owners")}
+
+
+def upgrade() -> None:
+    # Already there when created by metadata.create_all
+    if has_constraint() in (None, True):
+        return
+    op.execute(
+        "DELETE FROM pool_owners WHERE id NOT IN "
+        "(SELECT min_id FROM (SELECT min(id) AS min_id FROM pool_owners GROUP BY pool_id, address_id) AS kept)")
+    with op.batch_alter_table("pool_owners") as batch_op:
+        batch_op.create_unique_constraint(CONSTRAINT_NAME, ["pool_id", "address_id"])
+
+
+def downgrade() -> None:
+    if not has_constraint():
+        return
+    with op.batch_alter_table("pool_owners") as batch_op:
+        batch_op.drop_constraint(CONSTRAINT_NAME, type_="unique")
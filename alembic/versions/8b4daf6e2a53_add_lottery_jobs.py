@@ -0,0 +1,44 @@
+"""Add lottery jobs
+
+Queue of the lottery creations, claimed by the workers of every process.
+
+Revision ID: 8b4daf6e2a53
+Revises: 7a3c9e5d1f42
+Create Date: 2026-10-17 08:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b4daf6e2a53'
+down_revision = '7a3c9e5d1f42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Already there when created by metadata.create_all
+    if sa.inspect(op.get_bind()).has_table("lottery_jobs"):
+        return
+    op.create_table(
+        "lottery_jobs",
+        sa.Column("uuid", sa.String(), primary_key=True),
+        sa.Column("lottery_details", sa.String()),
+        sa.Column("status", sa.String()),
+        sa.Column("phase", sa.String()),
+        sa.Column("progress_done", sa.Integer()),
+        sa.Column("progress_total", sa.Integer(), nullable=True),
+        sa.Column("attempts", sa.Integer()),
+        sa.Column("worker_id", sa.String(), nullable=True),
+        sa.Column("heartbeat_at", sa.DateTime(), nullable=True),
+        sa.Column("created_at", sa.DateTime()),
+        sa.Column("updated_at", sa.DateTime()),
+        sa.Column("lottery_id", sa.String(), nullable=True),
+        sa.Column("error", sa.String(), nullable=True),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("lottery_jobs")
@@ -0,0 +1,57 @@
+"""Add lottery and pool lookup indexes
+
+Tickets and winners of a lottery by page, lotteries of a pool, queued
+lottery jobs by age, and case insensitive pool search on PostgreSQL.
+Indexes already created by metadata.create_all are kept.
+
+Revision ID: a3f1c2d4e5b6
+Revises: 8b4daf6e2a53
+Create Date: 2026-10-17 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3f1c2d4e5b6'
+down_revision = '8b4daf6e2a53'
+branch_labels = None
+depends_on = None
+
+# index name, table, columns
+INDEXES = [
+    ("ix_lottery_tickets_lottery_id_id", "lottery_tickets", "lottery_id, id"),
+    ("ix_lottery_winners_lottery_id_rank", "lottery_winners", "lottery_id, rank"),
+    ("ix_lotteries_pool_id", "lotteries", "pool_id"),
+    ("ix_lottery_jobs_status_created_at", "lottery_jobs", "status, created_at"),
+]
+TRIGRAM_INDEXES = [
+    ("ix_pools_ticker_trgm", "pools", "ticker"),
+    ("ix_pools_name_trgm", "pools", "name"),
+]
+
+
+def existing_tables():
+    return set(sa.inspect(op.get_bind()).get_table_names())
+
+
+def upgrade() -> None:
+    tables = existing_tables()
+    for name, table, columns in INDEXES:
+        if table in tables:
+            op.execute("CREATE INDEX IF NOT EXISTS {} ON {} ({})".format(name, table, columns))
+
+    if op.get_bind().dialect.name == "postgresql" and "pools" in tables:
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        for name, table, column in TRIGRAM_INDEXES:
+            op.execute("CREATE INDEX IF NOT EXISTS {} ON {} USING gin ({} gin_trgm_ops)".format(name, table, column))
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == "postgresql":
+        for name, _, _ in TRIGRAM_INDEXES:
+            op.execute("DROP INDEX IF EXISTS {}".format(name))
+
+    for name, _, _ in INDEXES:
+        op.execute("DROP INDEX IF EXISTS {}".format(name))
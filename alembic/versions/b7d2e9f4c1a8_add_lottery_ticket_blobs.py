@@ -0,0 +1,34 @@
+"""Add lottery ticket blobs
+
+Tickets of a lottery stored as one compressed columnar blob.
+
+Revision ID: b7d2e9f4c1a8
+Revises: a3f1c2d4e5b6
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d2e9f4c1a8'
+down_revision = 'a3f1c2d4e5b6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Already there when created by metadata.create_all
+    if sa.inspect(op.get_bind()).has_table("lottery_ticket_blobs"):
+        return
+    op.create_table(
+        "lottery_ticket_blobs",
+        sa.Column("lottery_id", sa.String(), sa.ForeignKey("lotteries.uuid"), primary_key=True),
+        sa.Column("count_tickets", sa.Integer()),
+        sa.Column("data", sa.LargeBinary()),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("lottery_ticket_blobs")
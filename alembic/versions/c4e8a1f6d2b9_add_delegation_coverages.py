@@ -0,0 +1,34 @@
+"""Add delegation coverages
+
+Oldest epoch stored for each delegation history, NULL when stored entirely.
+
+Revision ID: c4e8a1f6d2b9
+Revises: b7d2e9f4c1a8
+Create Date: 2026-10-17 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e8a1f6d2b9'
+down_revision = 'b7d2e9f4c1a8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Already there when created by metadata.create_all
+    if sa.inspect(op.get_bind()).has_table("delegation_coverages"):
+        return
+    # No row for histories stored before : treated as stored from their first epoch only
+    op.create_table(
+        "delegation_coverages",
+        sa.Column("address_id", sa.String(), primary_key=True),
+        sa.Column("covered_from_epoch", sa.Integer(), nullable=True),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("delegation_coverages")
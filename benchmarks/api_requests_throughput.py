@@ -0,0 +1,98 @@
+"""
+Requests/s of the Flask app and of the ASGI app under concurrent clients.
+
+Both apps run against the same database and Cardano backend, e.g. :
+
+    gunicorn --config gunicorn-cfg.py --bind 0.0.0.0:5005 spolottery.entrypoints.flaskapp:app
+    uvicorn spolottery.entrypoints.asgiapp:app --port 5006
+    python benchmarks/api_requests_throughput.py --flask-url http://localhost:5005 \
+        --asgi-url http://localhost:5006 --lottery-id <lottery_id> --concurrency 50 --requests 2000
+
+Each run sends the same mix of pool searches and lottery reads (when a
+lottery id is given) to every app.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import httpx
+
+
+def make_requests(args):
+    requests = []
+    for i in range(args.requests):
+        if args.lottery_id and i % 2:
+            requests.append(("GET", "/lottery/{}".format(args.lottery_id), None))
+        else:
+            requests.append(("POST", "/pool/filter", {"pool_filter": args.pool_filters[i % len(args.pool_filters)]}))
+    return requests
+
+
+async def run_app(base_url: str, requests, concurrency: int):
+    queue = asyncio.Queue()
+    for request in requests:
+        queue.put_nowait(request)
+    latencies, errors = [], 0
+
+    async def client_loop(client):
+        nonlocal errors
+        while not queue.empty():
+            method, path, body = queue.get_nowait()
+            started = time.perf_counter()
+            try:
+                res = await client.request(method, path, json=body)
+                if res.status_code >= 400:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*[client_loop(client) for _ in range(concurrency)])
+        duration = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": round(duration, 3),
+        "requests_per_second": round(len(latencies) / duration, 2),
+        "latency_median_ms": round(statistics.median(latencies) * 1000, 2),
+        "latency_p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 2),
+    }
+
+
+async def run(args):
+    requests = make_requests(args)
+    results = {}
+    for name, base_url in (("flask", args.flask_url), ("asgi", args.asgi_url)):
+        if base_url:
+            # Warm up connections and caches before measuring
+            await run_app(base_url, requests[:args.concurrency], args.concurrency)
+            results[name] = await run_app(base_url, requests, args.concurrency)
+    if "flask" in results and "asgi" in results:
+        results["asgi_speedup"] = round(
+            results["asgi"]["requests_per_second"] / results["flask"]["requests_per_second"], 2)
+    print(json.dumps(results, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--flask-url", help="Running Flask app, e.g. http://localhost:5005")
+    parser.add_argument("--asgi-url", help="Running ASGI app, e.g. http://localhost:5006")
+    parser.add_argument("--lottery-id", help="Stored lottery, read every other request")
+    parser.add_argument("--pool-filters", nargs="+", default=["pool", "hippo", "ada", "stake"])
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+    if not args.flask_url and not args.asgi_url:
+        parser.error("--flask-url and/or --asgi-url is required")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+End-to-end create_lottery throughput against the local Blockfrost stand-in,
+offline and without using the project quota.
+
+    PYTHONPATH=src python benchmarks/create_lottery_throughput.py --pools 20 --delegators 2000 --lotteries 20
+
+The stand-in runs in the benchmark event loop by default. Start it in its own
+process (python -m spolottery.devtools.fake_blockfrost) and pass --base-url so
+its CPU time isn't counted in the lotteries throughput.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+from datetime import datetime, timedelta, timezone
+
+from aiohttp import web
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+async def run(args):
+    from spolottery.adapters import orm
+    import spolottery.config as config
+    from spolottery.devtools.fake_blockfrost import FaultInjection, SyntheticData, create_app
+    from spolottery.domain import models
+    from spolottery.service_layer import services, unit_of_work
+    from spolottery.service_layer.cardano_service import BlockFrostCardanoService
+
+    runner = None
+    if args.base_url:
+        os.environ["BLOCKFROST_API_URL"] = args.base_url
+        current_epoch = await BlockFrostCardanoService(config).get_current_epoch()
+    else:
+        data = SyntheticData(args.pools, args.delegators, args.history_epochs)
+        current_epoch = data.current_epoch
+        faults = FaultInjection(args.latency, args.jitter, args.error_rate, args.rate_limited_rate,
+                                retry_after=0, seed=0)
+        runner = web.AppRunner(create_app(data, faults))
+        await runner.setup()
+        port = free_port()
+        await web.TCPSite(runner, "localhost", port).start()
+        os.environ["BLOCKFROST_API_URL"] = f"http://localhost:{port}"
+
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    orm.metadata.create_all(engine)
+    orm.start_mappers()
+    uow = unit_of_work.SqlAlchemyUnitOfWork(sessionmaker(bind=engine))
+    cardano_service = BlockFrostCardanoService(config)
+
+    try:
+        started = time.perf_counter()
+        await services.add_pools(uow, cardano_service)
+        pools_sync_duration = time.perf_counter() - started
+
+        with uow:
+            pool_ids = sorted(uow.pools.list_ids())
+        draw_date = (datetime.now(timezone.utc) + timedelta(days=1)).isoformat()
+        count_epochs = min(args.count_epochs, args.history_epochs - 1)
+
+        async def create_lottery(i):
+            return await services.create_lottery(
+                pool_ids[i % len(pool_ids)], current_epoch, current_epoch, count_epochs, draw_date,
+                models.LotteryStrategyType.STAKE.value, True, 0, f"Benchmark lottery {i}", uow, cardano_service)
+
+        started = time.perf_counter()
+        lotteries = await asyncio.gather(*[create_lottery(i) for i in range(args.lotteries)])
+        lotteries_duration = time.perf_counter() - started
+
+        print(json.dumps({
+            "pools": len(pool_ids),
+            "pools_sync_seconds": round(pools_sync_duration, 3),
+            "lotteries": len(lotteries),
+            "lotteries_seconds": round(lotteries_duration, 3),
+            "lotteries_per_second": round(len(lotteries) / lotteries_duration, 2),
+            "tickets": sum(len(lottery.tickets) for lottery in lotteries),
+            "fake_blockfrost": runner.app["stats"] if runner else None,
+            "http": cardano_service.http_metrics(),
+            "single_flight": cardano_service.single_flight_metrics(),
+            "delegators_cache": cardano_service.delegators_cache_metrics(),
+        }, indent=2))
+    finally:
+        await cardano_service.aclose()
+        if runner:
+            await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base-url", help="Blockfrost stand-in already running, started in process otherwise")
+    parser.add_argument("--pools", type=int, default=20)
+    parser.add_argument("--delegators", type=int, default=1000, help="Delegators by pool")
+    parser.add_argument("--history-epochs", type=int, default=100)
+    parser.add_argument("--count-epochs", type=int, default=10)
+    parser.add_argument("--lotteries", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limited-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    # No quota to respect against the stand-in unless asked
+    os.environ.setdefault("BLOCKFROST_REQUESTS_PER_SECOND", "1000000")
+    os.environ.setdefault("BLOCKFROST_BURST", "1000000")
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+STAKE lottery of a large pool with the db-sync backed Cardano service,
+against a synthetic db-sync subset in SQLite.
+
+    PYTHONPATH=src python benchmarks/dbsync_stake_lottery.py --delegators 10000 --history-epochs 50
+
+Pass --dbsync-uri to read a real cardano-db-sync database instead, with --pool-id.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+
+async def run(args):
+    from spolottery.adapters import orm
+    from spolottery.devtools import dbsync_fixture
+    from spolottery.domain import models
+    from spolottery.service_layer import services, unit_of_work
+    from spolottery.service_layer.dbsync_service import DbSyncCardanoService
+
+    if args.dbsync_uri:
+        dbsync_engine = create_engine(args.dbsync_uri)
+    else:
+        dbsync_engine = create_engine("sqlite://", connect_args={"check_same_thread": False},
+                                      poolclass=StaticPool)
+        started = time.perf_counter()
+        dbsync_fixture.metadata.create_all(dbsync_engine)
+        with dbsync_engine.begin() as connection:
+            dbsync_fixture.populate_synthetic(connection, args.pools, args.delegators, args.history_epochs)
+        print("db-sync fixture built in {:.1f}s".format(time.perf_counter() - started))
+
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    orm.metadata.create_all(engine)
+    orm.start_mappers()
+    uow = unit_of_work.SqlAlchemyUnitOfWork(sessionmaker(bind=engine))
+    cardano_service = DbSyncCardanoService(dbsync_engine)
+
+    try:
+        started = time.perf_counter()
+        await services.add_pools(uow, cardano_service)
+        pools_sync_duration = time.perf_counter() - started
+
+        pool_id = args.pool_id
+        if pool_id is None:
+            with uow:
+                pool_id = sorted(uow.pools.list_ids())[0]
+        current_epoch = await cardano_service.get_current_epoch()
+        draw_date = (datetime.now(timezone.utc) + timedelta(days=1)).isoformat()
+        count_epochs = min(args.count_epochs, args.history_epochs - 1)
+
+        started = time.perf_counter()
+        lottery = await services.create_lottery(
+            pool_id, current_epoch, current_epoch, count_epochs, draw_date,
+            models.LotteryStrategyType.STAKE.value, True, 0, "Benchmark lottery", uow, cardano_service)
+        lottery_duration = time.perf_counter() - started
+
+        print(json.dumps({
+            "pool_id": pool_id,
+            "pools_sync_seconds": round(pools_sync_duration, 3),
+            "lottery_seconds": round(lottery_duration, 3),
+            "tickets": len(lottery.tickets),
+        }, indent=2))
+    finally:
+        await cardano_service.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dbsync-uri", help="cardano-db-sync database, synthetic SQLite subset otherwise")
+    parser.add_argument("--pool-id")
+    parser.add_argument("--pools", type=int, default=2)
+    parser.add_argument("--delegators", type=int, default=10000, help="Delegators by pool")
+    parser.add_argument("--history-epochs", type=int, default=50)
+    parser.add_argument("--count-epochs", type=int, default=10)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -6,4 +6,6 @@ accesslog = '-'
 loglevel = 'debug'
 capture_output = True
 enable_stdio_inheritance = True
-timeout = 0  # Set the timeout to 120 seconds
+# Lotteries are created by background jobs, requests stay short
+timeout = 120
+graceful_timeout = 60
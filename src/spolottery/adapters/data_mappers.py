@@ -1,5 +1,5 @@
 import datetime
-from typing import List
+from typing import List, Optional
 from spolottery.adapters import dto, orm
 from spolottery.domain import models
 
@@ -25,6 +25,17 @@ def lottery_tickets_entity_to_dto(tickets: List[models.LotteryTicket]) -> List[d
     ) for ticket in tickets]
 
 
+def lottery_ticket_columns_to_dto(tickets: models.LotteryTicketColumns) -> List[dto.LotteryTicketDto]:
+    return [dto.LotteryTicketDto(
+        delegator_id=delegator_id,
+        winning_likelyhood=winning_likelyhood,
+        pool_owner=pool_owner,
+        delegator_lottery_stake=delegator_lottery_stake if delegator_lottery_stake else None,
+    ) for delegator_id, winning_likelyhood, pool_owner, delegator_lottery_stake in zip(
+        tickets.delegator_ids, tickets.winning_likelyhoods.tolist(), tickets.pool_owners.tolist(),
+        tickets.delegator_lottery_stakes.tolist())]
+
+
 def lottery_winners_entity_to_dto(winners: List[models.LotteryWinner]) -> List[dto.LotteryWinnerDto]:
     return [dto.LotteryWinnerDto(
         delegator_address_id=winner.delegator_address_id,
@@ -32,14 +43,27 @@ def lottery_winners_entity_to_dto(winners: List[models.LotteryWinner]) -> List[d
     ) for winner in winners]
 
 
-def lottery_entity_to_dto(lottery: models.Lottery, detailed: bool) -> dto.LotteryDto:
+def lottery_entity_to_dto(lottery: models.Lottery, detailed: bool,
+                          lottery_tickets: Optional[models.LotteryTicketColumns] = None,
+                          winner_ids: Optional[List[str]] = None) -> dto.LotteryDto:
+    """
+    Tickets and winners are taken from lottery_tickets and winner_ids when
+    given, from the lottery relationships otherwise
+    """
     min_live_stake = lottery.min_live_stake if lottery.min_live_stake else 0
     tickets_dto = []
     winners_dto = []
     if detailed:
-        tickets_dto = lottery_tickets_entity_to_dto(lottery.lottery_tickets)
+        if lottery_tickets is None:
+            tickets_dto = lottery_tickets_entity_to_dto(lottery.lottery_tickets)
+        else:
+            tickets_dto = lottery_ticket_columns_to_dto(lottery_tickets)
         if lottery.is_lottery_result_available():
-            winners_dto = lottery_winners_entity_to_dto(lottery.winners)
+            if winner_ids is None:
+                winners_dto = lottery_winners_entity_to_dto(lottery.winners)
+            else:
+                winners_dto = [dto.LotteryWinnerDto(delegator_address_id=winner_id, rank=rank)
+                               for rank, winner_id in enumerate(winner_ids)]
     return dto.LotteryDto(
         uuid=lottery.uuid,
         pool_id=lottery.pool_id,
@@ -52,6 +76,22 @@ def lottery_entity_to_dto(lottery: models.Lottery, detailed: bool) -> dto.Lotter
         lottery_strategy_type=lottery.lottery_strategy_type,
         owners_allowed=lottery.owners_allowed,
         min_live_stake=min_live_stake,
+        winners_count=lottery.winners_count,
         winners=winners_dto,
         tickets=tickets_dto
     )
+
+
+def lottery_job_entity_to_dto(job: models.LotteryJob) -> dto.LotteryJobDto:
+    return dto.LotteryJobDto(
+        job_id=job.uuid,
+        status=job.status,
+        phase=job.phase,
+        progress_done=job.progress_done if job.progress_done else 0,
+        progress_total=job.progress_total,
+        attempts=job.attempts if job.attempts else 0,
+        created_at=job.created_at,
+        updated_at=job.updated_at,
+        lottery_id=job.lottery_id,
+        error=job.error
+    )
@@ -15,6 +15,7 @@ class LotteryInputDto(BaseModel):
     lottery_strategy_name: str
     owners_allowed: bool
     lottery_name: str
+    winners_count: Optional[int]
 
 
 class LotteryTicketDto(BaseModel):
@@ -48,8 +49,63 @@ class LotteryDto(BaseModel):
     lottery_strategy_type: str
     owners_allowed: bool
     min_live_stake: int
+    winners_count: Optional[int]
     tickets: Optional[List[LotteryTicketDto]]
     winners: Optional[List[LotteryWinnerDto]]
 
     class Config:
         allow_mutation = False
+
+
+class LotteryTicketsPageDto(BaseModel):
+    tickets: List[LotteryTicketDto]
+    # "after" of the next page, None on the last page
+    next_cursor: Optional[int]
+
+    class Config:
+        allow_mutation = False
+
+
+class LotteryWinnersPageDto(BaseModel):
+    winners: List[LotteryWinnerDto]
+    next_cursor: Optional[int]
+
+    class Config:
+        allow_mutation = False
+
+
+class LotteryJobDto(BaseModel):
+    job_id: str
+    status: str
+    phase: str
+    progress_done: int
+    progress_total: Optional[int]
+    attempts: int
+    created_at: datetime
+    updated_at: datetime
+    lottery_id: Optional[str]
+    error: Optional[str]
+
+    class Config:
+        allow_mutation = False
+
+
+class LotteryAuditTicketDto(BaseModel):
+    delegator_id: str
+    expected_frequency: float
+    observed_frequency: float
+
+    class Config:
+        allow_mutation = False
+
+
+class LotteryAuditDto(BaseModel):
+    uuid: str
+    trials: int
+    chi_square: float
+    degrees_of_freedom: int
+    p_value: float
+    tickets: List[LotteryAuditTicketDto]
+
+    class Config:
+        allow_mutation = False
@@ -0,0 +1,155 @@
+"""
+Process wide registry of SQLAlchemy engines, one by database URL.
+
+Every unit of work, app and service of a process shares the engine (and its
+connection pool) of a database. Pools are sized from config, connections are
+checked before use (pre-ping) and recycled, checkout latency and saturation
+are measured by InstrumentedQueuePool.
+"""
+import threading
+import time
+from typing import Dict, Optional
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
+
+import spolottery.config as config
+
+
+class PoolMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.checkout_seconds = 0.0
+        self.max_checkout_seconds = 0.0
+        self.saturated_checkouts = 0  # asked while every connection was checked out
+        self.checkout_timeouts = 0
+
+    def add_checkout(self, seconds: float, saturated: bool):
+        with self._lock:
+            self.checkouts += 1
+            self.checkout_seconds += seconds
+            self.max_checkout_seconds = max(self.max_checkout_seconds, seconds)
+            if saturated:
+                self.saturated_checkouts += 1
+
+    def add_timeout(self):
+        with self._lock:
+            self.checkout_timeouts += 1
+            self.saturated_checkouts += 1
+
+    def serialize(self, pool: QueuePool) -> dict:
+        capacity = pool.size() + max(pool._max_overflow, 0)
+        checked_out = pool.checkedout()
+        return {
+            'pool_size': pool.size(),
+            'max_overflow': pool._max_overflow,
+            'checked_out': checked_out,
+            'overflow': max(pool.overflow(), 0),
+            'pool_saturation': checked_out / capacity if capacity else 0.0,
+            'checkouts': self.checkouts,
+            'mean_checkout_ms': 1000 * self.checkout_seconds / self.checkouts if self.checkouts else 0.0,
+            'max_checkout_ms': 1000 * self.max_checkout_seconds,
+            'saturated_checkouts': self.saturated_checkouts,
+            'checkout_timeouts': self.checkout_timeouts,
+        }
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    QueuePool measuring how long each connection checkout waits
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def _do_get(self):
+        saturated = self._max_overflow > -1 and self.checkedout() >= self.size() + self._max_overflow
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.metrics.add_timeout()
+            raise
+        self.metrics.add_checkout(time.perf_counter() - started, saturated)
+        return connection
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+
+_engines: Dict[str, Engine] = {}
+_session_factories: Dict[str, sessionmaker] = {}
+_lock = threading.Lock()
+
+
+def is_in_memory(url: str) -> bool:
+    parsed_url = make_url(url)
+    return parsed_url.get_backend_name() == "sqlite" and parsed_url.database in (None, "", ":memory:")
+
+
+def get_engine(url: Optional[str] = None, **kwargs) -> Engine:
+    """
+    Engine of a database, the lotteries database by default, created on first use.
+    kwargs are only used when the engine is created.
+    """
+    url = url if url else config.get_postgres_uri()
+    with _lock:
+        engine = _engines.get(url)
+        if engine is None:
+            if not is_in_memory(url):
+                # An in memory SQLite database lives in its single connection
+                kwargs = dict(dict(
+                    poolclass=InstrumentedQueuePool,
+                    pool_size=config.get_db_pool_size(),
+                    max_overflow=config.get_db_max_overflow(),
+                    pool_timeout=config.get_db_pool_timeout(),
+                    pool_recycle=config.get_db_pool_recycle(),
+                    pool_pre_ping=config.get_db_pool_pre_ping(),
+                ), **kwargs)
+            engine = create_engine(url, **kwargs)
+            _engines[url] = engine
+        return engine
+
+
+def get_session_factory(url: Optional[str] = None) -> sessionmaker:
+    """
+    Session factory of the lotteries database, bound to its shared engine
+    """
+    url = url if url else config.get_postgres_uri()
+    with _lock:
+        session_factory = _session_factories.get(url)
+    if session_factory is None:
+        engine = get_engine(url)
+        if engine.dialect.name == "postgresql":
+            engine = engine.execution_options(isolation_level="REPEATABLE READ")
+        with _lock:
+            session_factory = _session_factories.setdefault(url, sessionmaker(bind=engine))
+    return session_factory
+
+
+def pool_metrics() -> Dict[str, dict]:
+    """
+    Pool metrics of each engine, by database URL without password
+    """
+    with _lock:
+        engines = list(_engines.items())
+    return {repr(make_url(url)): engine.pool.metrics.serialize(engine.pool)
+            for url, engine in engines if isinstance(engine.pool, InstrumentedQueuePool)}
+
+
+def dispose_engines():
+    """
+    Close the pooled connections of every engine, e.g. in a forked worker.
+    Engines stay usable, new connections are opened on demand.
+    """
+    with _lock:
+        engines = list(_engines.values())
+    for engine in engines:
+        engine.dispose()
@@ -1,4 +1,5 @@
-from sqlalchemy import MetaData, Table, String, Column, DateTime, ForeignKey, Integer, Float, Boolean
+from sqlalchemy import MetaData, Table, String, Column, DateTime, ForeignKey, Integer, BigInteger, Float, Boolean, \
+    UniqueConstraint, Index, DDL, LargeBinary, event
 from sqlalchemy.orm import mapper, relationship, column_property, deferred
 
 from spolottery.domain import models
@@ -17,18 +18,52 @@ pools = Table(
     Column("updated_at", DateTime),
 )
 
+# Case insensitive pool search (ILIKE '%filter%') on PostgreSQL, trigram indexes
+# aren't part of the MetaData : created only there, ignored by autogenerate
+pools_trigram_indexes = ("ix_pools_ticker_trgm", "ix_pools_name_trgm")
+event.listen(metadata, "before_create", DDL(
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"))
+for column_name in ("ticker", "name"):
+    event.listen(pools, "after_create", DDL(
+        "CREATE INDEX IF NOT EXISTS ix_pools_{0}_trgm ON pools USING gin ({0} gin_trgm_ops)".format(column_name)
+    ).execute_if(dialect="postgresql"))
+
 # delegators = Table(
 #     "delegators",
 #     metadata,
 #     Column("address_id", String, primary_key=True),
 # )
 
+# Delegation history of stake addresses, one row by active epoch
+# Not mapped : read and written in bulk by SqlAlchemyDelegationRepository
+delegations = Table(
+    "delegations",
+    metadata,
+    Column("address_id", String, primary_key=True),
+    Column("epoch_no", Integer, primary_key=True),
+    Column("pool_id", String),
+    Column("amount", BigInteger),
+)
+
+# Oldest epoch from which each stored delegation history is complete, NULL
+# when the whole history is stored. Histories without row : unknown, treated
+# as complete from their first stored epoch
+delegation_coverages = Table(
+    "delegation_coverages",
+    metadata,
+    Column("address_id", String, primary_key=True),
+    Column("covered_from_epoch", Integer, nullable=True),
+)
+
 pool_owners = Table(
     "pool_owners",
     metadata,
     Column("id", Integer, primary_key=True, autoincrement=True),
     Column("address_id", String),
     Column("pool_id", ForeignKey("pools.pool_id")),
+    # Conflict target of the pool owners bulk upsert, index of the owners of a pool
+    UniqueConstraint("pool_id", "address_id",
+                     name="uq_pool_owners_pool_id_address_id"),
 )
 
 
@@ -41,6 +76,18 @@ lottery_tickets = Table(
     Column("pool_owner", Boolean),
     Column("lottery_id", ForeignKey("lotteries.uuid")),
     Column("delegator_lottery_stake", Float, default=0),
+    # Keyset pagination of the tickets of a lottery
+    Index("ix_lottery_tickets_lottery_id_id", "lottery_id", "id"),
+)
+
+# Tickets of a lottery as one compressed columnar blob (see ticket_blob), instead
+# of lottery_tickets rows. Not mapped : read and written by SqlAlchemyLotteryRepository
+lottery_ticket_blobs = Table(
+    "lottery_ticket_blobs",
+    metadata,
+    Column("lottery_id", ForeignKey("lotteries.uuid"), primary_key=True),
+    Column("count_tickets", Integer),
+    Column("data", LargeBinary),
 )
 
 lotteries = Table(
@@ -57,6 +104,8 @@ lotteries = Table(
     Column("lottery_strategy_type", String),
     Column("owners_allowed", Boolean),
     Column("min_live_stake", Integer, default=0),
+    Column("winners_count", Integer, nullable=True),
+    Index("ix_lotteries_pool_id", "pool_id"),
 )
 
 
@@ -67,6 +116,29 @@ lottery_winners = Table(
     Column("delegator_address_id", String),
     Column("lottery_id", ForeignKey("lotteries.uuid")),
     Column("rank", Integer),
+    # Keyset pagination of the winners of a lottery
+    Index("ix_lottery_winners_lottery_id_rank", "lottery_id", "rank"),
+)
+
+# Lottery creation jobs queue, claimed by the workers of every API process
+lottery_jobs = Table(
+    "lottery_jobs",
+    metadata,
+    Column("uuid", String, primary_key=True),
+    Column("lottery_details", String),
+    Column("status", String),
+    Column("phase", String),
+    Column("progress_done", Integer, default=0),
+    Column("progress_total", Integer, nullable=True),
+    Column("attempts", Integer, default=0),
+    Column("worker_id", String, nullable=True),
+    Column("heartbeat_at", DateTime, nullable=True),
+    Column("created_at", DateTime),
+    Column("updated_at", DateTime),
+    Column("lottery_id", String, nullable=True),
+    Column("error", String, nullable=True),
+    # Oldest queued jobs first when claiming
+    Index("ix_lottery_jobs_status_created_at", "status", "created_at"),
 )
 
 
@@ -94,6 +166,8 @@ def start_mappers():
         },
     )
 
+    mapper(models.LotteryJob, lottery_jobs)
+
     pool_owners_mapper = mapper(models.PoolOwner, pool_owners)
     pool_mapper = mapper(
         models.Pool,
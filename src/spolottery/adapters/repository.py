@@ -1,6 +1,14 @@
 import abc
-from typing import List
+import csv
+import io
+from datetime import datetime
+from itertools import islice, repeat
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+import numpy as np
+from sqlalchemy import func, or_, select, update
+from spolottery.adapters import orm
 from spolottery.adapters.data_mappers import pool_model_to_entity
+from spolottery.adapters.ticket_blob import LotteryTicketBlob, encode_tickets
 from spolottery.domain import models
 
 
@@ -17,6 +25,10 @@ class AbstractPoolRepository(abc.ABC):
     def add_multiple(self, pools: List[models.Pool]):
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def upsert_multiple(self, pools: List[models.Pool]) -> int:
+        raise NotImplementedError
+
     @abc.abstractmethod
     def get(self, pool_id: str) -> models.Pool:
         raise NotImplementedError
@@ -25,8 +37,30 @@ class AbstractPoolRepository(abc.ABC):
     def list(self) -> List[models.Pool]:
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def list_ids(self) -> Set[str]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def search(self, pool_filter: str) -> List[models.Pool]:
+        """
+        Pools of id pool_filter, or whose ticker or name contains it, case insensitive
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_revision(self) -> Tuple[int, Optional[datetime]]:
+        """
+        Count of pools and latest update : changes whenever a pool is added or updated
+        """
+        raise NotImplementedError
+
 
 class SqlAlchemyPoolRepository(AbstractPoolRepository):
+    # Stay under SQLite bound parameters limit
+    chunk_size = 100
+    pool_metadata_columns = ("hex", "url", "ticker", "name", "description")
+
     def __init__(self, session):
         self.session = session
 
@@ -36,6 +70,45 @@ class SqlAlchemyPoolRepository(AbstractPoolRepository):
     def add_multiple(self, pools: List[models.Pool]):
         self.session.add_all(pools)
 
+    def upsert_multiple(self, pools: List[models.Pool]) -> int:
+        """
+        Bulk INSERT ... ON CONFLICT by batches : new pools are added, stored
+        pools are updated only when their metadata changed, owners already
+        stored are skipped. Safe to run concurrently from several workers.
+        Return the count of pools inserted or updated
+        """
+        insert = dialect_insert(self.session)
+        if insert is None:
+            for pool in pools:
+                self.session.merge(pool)
+            return len(pools)
+
+        count_pools_written = 0
+        for i in range(0, len(pools), self.chunk_size):
+            batch = pools[i:i + self.chunk_size]
+            statement = insert(orm.pools)
+            metadata_columns = [statement.excluded[name] for name in self.pool_metadata_columns]
+            statement = statement.on_conflict_do_update(
+                index_elements=[orm.pools.c.pool_id],
+                set_={name: statement.excluded[name]
+                      for name in self.pool_metadata_columns + ("updated_at",)},
+                where=or_(*[orm.pools.c[column.name].is_distinct_from(column)
+                            for column in metadata_columns]),
+            )
+            result = self.session.execute(statement, [
+                {name: getattr(pool, name) for name in ("pool_id",) + self.pool_metadata_columns + ("updated_at",)}
+                for pool in batch
+            ])
+            count_pools_written += max(result.rowcount, 0)
+
+            owners = [dict(pool_id=pool.pool_id, address_id=owner.address_id)
+                      for pool in batch for owner in pool.owners]
+            if owners:
+                self.session.execute(insert(orm.pool_owners).on_conflict_do_nothing(
+                    index_elements=[orm.pool_owners.c.pool_id, orm.pool_owners.c.address_id]), owners)
+
+        return count_pools_written
+
     def get(self, pool_id):
         try:
             return self.session.query(
@@ -49,6 +122,23 @@ class SqlAlchemyPoolRepository(AbstractPoolRepository):
         instance_pools = self.session.query(models.Pool).all()
         return [pool_model_to_entity(pool) for pool in instance_pools]
 
+    def list_ids(self):
+        return set(self.session.execute(select(orm.pools.c.pool_id)).scalars())
+
+    def search(self, pool_filter):
+        table = orm.pools
+        pattern = "%{}%".format(pool_filter.replace("/", "//").replace("%", "/%").replace("_", "/_"))
+        return self.session.query(models.Pool).filter(
+            table.c.name.isnot(None),
+            or_(table.c.pool_id == pool_filter,
+                table.c.ticker.ilike(pattern, escape="/"),
+                table.c.name.ilike(pattern, escape="/"))).all()
+
+    def get_revision(self):
+        count_pools, updated_at = self.session.execute(
+            select(func.count(), func.max(orm.pools.c.updated_at)).select_from(orm.pools)).one()
+        return count_pools, updated_at
+
 
 class AbstractDelegatorRepository(abc.ABC):
     @abc.abstractmethod
@@ -74,6 +164,122 @@ class SqlAlchemyDelegatorRepository(AbstractDelegatorRepository):
         return self.session.query(models.Delegator).all()
 
 
+def dialect_insert(session):
+    """
+    insert() construct supporting ON CONFLICT, None when the dialect has none
+    """
+    dialect_name = session.get_bind().dialect.name
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return None
+    return insert
+
+
+def insert_on_conflict_do_nothing(session, table):
+    """
+    INSERT skipping rows already stored, for PostgreSQL and SQLite
+    """
+    insert = dialect_insert(session)
+    if insert is None:
+        return table.insert()
+    return insert(table).on_conflict_do_nothing()
+
+
+def copy_rows(session, table, columns: Sequence[str], rows: List[tuple]):
+    """
+    PostgreSQL COPY of rows, as CSV, in the session transaction
+    """
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    cursor = session.connection().connection.cursor()
+    try:
+        cursor.copy_expert("COPY {} ({}) FROM STDIN WITH (FORMAT csv)".format(table.name, ", ".join(columns)), buffer)
+    finally:
+        cursor.close()
+
+
+# Delegations
+class AbstractDelegationRepository(abc.ABC):
+    @abc.abstractmethod
+    def add_multiple(self, delegations: Dict[str, Iterable[models.Delegation]]):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def add_coverages(self, coverages: Dict[str, Optional[int]]):
+        """
+        Oldest epoch from which each stored history is complete, None for whole histories
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_histories(self, address_ids: List[str]) -> Dict[str, models.DelegationHistory]:
+        raise NotImplementedError
+
+
+class SqlAlchemyDelegationRepository(AbstractDelegationRepository):
+    # Stay under SQLite bound parameters limit
+    chunk_size = 500
+
+    def __init__(self, session):
+        self.session = session
+
+    def add_multiple(self, delegations: Dict[str, Iterable[models.Delegation]]):
+        rows = [
+            dict(address_id=address_id, epoch_no=delegation.epoch_no,
+                 pool_id=delegation.pool_id, amount=int(delegation.amount))
+            for address_id, address_delegations in delegations.items()
+            for delegation in address_delegations
+        ]
+        if rows:
+            self.session.execute(
+                insert_on_conflict_do_nothing(self.session, orm.delegations), rows)
+
+    def add_coverages(self, coverages: Dict[str, Optional[int]]):
+        rows = [dict(address_id=address_id, covered_from_epoch=covered_from)
+                for address_id, covered_from in coverages.items()]
+        if not rows:
+            return
+        table = orm.delegation_coverages
+        insert = dialect_insert(self.session)
+        if insert is None:
+            self.session.execute(table.delete().where(table.c.address_id.in_(list(coverages))))
+            self.session.execute(table.insert(), rows)
+            return
+        statement = insert(table)
+        self.session.execute(statement.on_conflict_do_update(
+            index_elements=[table.c.address_id],
+            set_={"covered_from_epoch": statement.excluded.covered_from_epoch}), rows)
+
+    def get_histories(self, address_ids: List[str]) -> Dict[str, models.DelegationHistory]:
+        histories = {}
+        table = orm.delegations
+        coverages = orm.delegation_coverages
+        for i in range(0, len(address_ids), self.chunk_size):
+            chunk = address_ids[i:i + self.chunk_size]
+            rows = self.session.execute(
+                select(table.c.address_id, table.c.epoch_no, table.c.pool_id, table.c.amount)
+                .where(table.c.address_id.in_(chunk))
+                .order_by(table.c.address_id, table.c.epoch_no)
+            )
+            for address_id, epoch_no, pool_id, amount in rows:
+                histories.setdefault(address_id, models.DelegationHistory()).add(
+                    models.Delegation(pool_id=pool_id, amount=amount, epoch_no=epoch_no))
+
+            covered_from_epochs = dict(self.session.execute(
+                select(coverages.c.address_id, coverages.c.covered_from_epoch)
+                .where(coverages.c.address_id.in_(chunk))).all())
+            for address_id in chunk:
+                history = histories.get(address_id)
+                if history is not None:
+                    # Stored before coverages were : nothing known older than the first epoch
+                    history.covered_from = covered_from_epochs.get(address_id, history.first_epoch)
+        return histories
+
+
 # Pool Owner
 class AbstractPoolOwnerRepository(abc.ABC):
     @abc.abstractmethod
@@ -134,21 +340,277 @@ class AbstractLotteryRepository(abc.ABC):
     def get(self, lottery_id: str) -> models.Lottery:
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def list_tickets(self, lottery_id: str, after_id: Optional[int], limit: int) -> List[tuple]:
+        """
+        Page of tickets rows (id, delegator_id, winning_likelyhood, pool_owner,
+        delegator_lottery_stake) following the ticket after_id, by id
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def list_winners(self, lottery_id: str, after_rank: Optional[int], limit: int) -> List[tuple]:
+        """
+        Page of winners rows (rank, delegator_address_id) following after_rank, by rank
+        """
+        raise NotImplementedError
+
+    def exists(self, lottery_id: str) -> bool:
+        return any(lottery.uuid == lottery_id for lottery in self.list())
+
+    def add_bulk(self, lottery: models.Lottery, lottery_tickets: models.LotteryTicketColumns,
+                 winner_ids: List[str]):
+        """
+        Add a lottery with its tickets and its winners, by rank, given as columns
+        """
+        lottery.lottery_tickets = lottery_tickets.to_tickets(lottery.uuid)
+        lottery.winners = {models.LotteryWinner(winner_id, rank) for rank, winner_id in enumerate(winner_ids)}
+        self.add(lottery)
+
+    def get_ticket_columns(self, lottery_id: str) -> models.LotteryTicketColumns:
+        """
+        Tickets of a lottery as columns, in tickets order
+        """
+        return models.LotteryTicketColumns.from_tickets(self.get(lottery_id).lottery_tickets)
+
 
 class SqlAlchemyLotteryRepository(AbstractLotteryRepository):
-    def __init__(self, session):
+    """
+    New lotteries tickets are stored as lottery_tickets rows, or as one
+    lottery_ticket_blobs blob with the "blob" tickets storage. Tickets of
+    lotteries stored either way are read, a blob ticket id is its position.
+    """
+    # Rows by executemany or COPY statement
+    chunk_size = 10_000
+    ticket_columns = ("delegator_id", "winning_likelyhood", "pool_owner", "lottery_id", "delegator_lottery_stake")
+    winner_columns = ("delegator_address_id", "lottery_id", "rank")
+    tickets_storages = ("rows", "blob")
+
+    def __init__(self, session, tickets_storage: str = "rows"):
+        if tickets_storage not in self.tickets_storages:
+            raise ValueError("Unknown lottery tickets storage : {}".format(tickets_storage))
         self.session = session
+        self.tickets_storage = tickets_storage
 
     def add(self, lottery):
         self.session.add(lottery)
 
+    def add_bulk(self, lottery, lottery_tickets, winner_ids):
+        """
+        Tickets and winners rows are written straight from the columns, with
+        COPY on PostgreSQL and executemany otherwise, without ORM objects
+        """
+        self.session.execute(orm.lotteries.insert(), {
+            column.name: getattr(lottery, column.name) for column in orm.lotteries.columns})
+        if self.tickets_storage == "blob":
+            self.session.execute(orm.lottery_ticket_blobs.insert(), {
+                "lottery_id": lottery.uuid, "count_tickets": len(lottery_tickets),
+                "data": encode_tickets(lottery_tickets)})
+        else:
+            self._write_rows(orm.lottery_tickets, self.ticket_columns, zip(
+                lottery_tickets.delegator_ids, lottery_tickets.winning_likelyhoods.tolist(),
+                lottery_tickets.pool_owners.tolist(), repeat(lottery.uuid),
+                lottery_tickets.delegator_lottery_stakes.tolist()))
+        self._write_rows(orm.lottery_winners, self.winner_columns, zip(
+            winner_ids, repeat(lottery.uuid), range(len(winner_ids))))
+
+    def _write_rows(self, table, columns: Sequence[str], rows: Iterable[tuple]):
+        copy = self.session.get_bind().dialect.name == "postgresql"
+        rows = iter(rows)
+        while True:
+            chunk = list(islice(rows, self.chunk_size))
+            if not chunk:
+                return
+            if copy:
+                copy_rows(self.session, table, columns, chunk)
+            else:
+                self.session.execute(table.insert(), [dict(zip(columns, row)) for row in chunk])
+
     def get(self, lottery_id):
         return self.session.query(models.Lottery).filter_by(uuid=lottery_id).one()
 
+    def exists(self, lottery_id):
+        return self.session.execute(
+            select(orm.lotteries.c.uuid).where(orm.lotteries.c.uuid == lottery_id)).first() is not None
+
+    def get_ticket_blob(self, lottery_id: str) -> Optional[LotteryTicketBlob]:
+        """
+        Tickets blob of a lottery, None when its tickets are rows
+        """
+        table = orm.lottery_ticket_blobs
+        data = self.session.execute(select(table.c.data).where(table.c.lottery_id == lottery_id)).scalar()
+        return LotteryTicketBlob(data) if data is not None else None
+
+    def get_ticket_columns(self, lottery_id):
+        ticket_blob = self.get_ticket_blob(lottery_id)
+        if ticket_blob is not None:
+            return ticket_blob.columns()
+
+        table = orm.lottery_tickets
+        rows = self.session.execute(
+            select(table.c.delegator_id, table.c.winning_likelyhood, table.c.pool_owner,
+                   table.c.delegator_lottery_stake).where(table.c.lottery_id == lottery_id).order_by(table.c.id)
+        ).all()
+        return models.LotteryTicketColumns(
+            delegator_ids=[row[0] for row in rows],
+            winning_likelyhoods=np.array([row[1] for row in rows], dtype=np.float64),
+            pool_owners=np.array([bool(row[2]) for row in rows], dtype=bool),
+            delegator_lottery_stakes=np.array([row[3] if row[3] else 0 for row in rows], dtype=np.float64),
+        )
+
+    def list_tickets(self, lottery_id, after_id, limit):
+        ticket_blob = self.get_ticket_blob(lottery_id)
+        if ticket_blob is not None:
+            start = after_id + 1 if after_id is not None else 0
+            page = ticket_blob.columns(start, start + limit)
+            return list(zip(range(start, start + len(page)), page.delegator_ids, page.winning_likelyhoods.tolist(),
+                            page.pool_owners.tolist(), page.delegator_lottery_stakes.tolist()))
+
+        table = orm.lottery_tickets
+        statement = select(table.c.id, table.c.delegator_id, table.c.winning_likelyhood, table.c.pool_owner,
+                           table.c.delegator_lottery_stake).where(table.c.lottery_id == lottery_id)
+        if after_id is not None:
+            statement = statement.where(table.c.id > after_id)
+        return self.session.execute(statement.order_by(table.c.id).limit(limit)).all()
+
+    def list_winners(self, lottery_id, after_rank, limit):
+        table = orm.lottery_winners
+        statement = select(table.c.rank, table.c.delegator_address_id).where(table.c.lottery_id == lottery_id)
+        if after_rank is not None:
+            statement = statement.where(table.c.rank > after_rank)
+        return self.session.execute(statement.order_by(table.c.rank).limit(limit)).all()
+
     def list(self):
         return self.session.query(models.Lottery).all()
 
 
+# Lottery jobs
+class AbstractLotteryJobRepository(abc.ABC):
+    """
+    Queue of lottery jobs. State changes of a claimed job only apply while
+    worker_id still owns it, so a requeued job can't be updated by its former worker.
+    """
+
+    @abc.abstractmethod
+    def add(self, job: models.LotteryJob):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get(self, job_id: str) -> Optional[models.LotteryJob]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def count_queued(self) -> int:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def claim(self, worker_id: str, now: datetime) -> Optional[models.LotteryJob]:
+        """
+        Oldest queued job, now running for worker_id, None when the queue is empty
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def update_progress(self, job_id: str, worker_id: str, phase: str, done: int, total: Optional[int],
+                        now: datetime) -> bool:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def finish(self, job_id: str, worker_id: str, status: str, now: datetime,
+               lottery_id: Optional[str] = None, error: Optional[str] = None) -> bool:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def heartbeat(self, job_ids: List[str], worker_id: str, now: datetime) -> int:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def requeue_stale(self, stale_before: datetime, max_attempts: int, now: datetime) -> int:
+        """
+        Requeue the running jobs without heartbeat since stale_before, or fail
+        them after max_attempts. Count of jobs requeued or failed.
+        """
+        raise NotImplementedError
+
+
+class SqlAlchemyLotteryJobRepository(AbstractLotteryJobRepository):
+    # Queued jobs tried at each claim, others workers may win some of them
+    claim_candidates = 5
+
+    def __init__(self, session):
+        self.session = session
+
+    def add(self, job):
+        self.session.add(job)
+
+    def get(self, job_id):
+        return self.session.query(models.LotteryJob).filter_by(uuid=job_id).one_or_none()
+
+    def count_queued(self):
+        table = orm.lottery_jobs
+        return self.session.execute(
+            select(func.count()).select_from(table).where(table.c.status == models.LotteryJobStatus.QUEUED.value)
+        ).scalar_one()
+
+    def claim(self, worker_id, now):
+        table = orm.lottery_jobs
+        queued = models.LotteryJobStatus.QUEUED.value
+        candidate_ids = self.session.execute(
+            select(table.c.uuid).where(table.c.status == queued)
+            .order_by(table.c.created_at).limit(self.claim_candidates)
+            .with_for_update(skip_locked=True)
+        ).scalars().all()
+        for job_id in candidate_ids:
+            # Conditional update : only one worker moves the job out of the queue
+            result = self.session.execute(
+                update(table).where(table.c.uuid == job_id, table.c.status == queued).values(
+                    status=models.LotteryJobStatus.RUNNING.value, worker_id=worker_id, heartbeat_at=now,
+                    updated_at=now, attempts=table.c.attempts + 1))
+            if result.rowcount == 1:
+                return self.get(job_id)
+        return None
+
+    def _update_owned(self, job_id, worker_id, **values) -> bool:
+        table = orm.lottery_jobs
+        result = self.session.execute(
+            update(table).where(table.c.uuid == job_id, table.c.worker_id == worker_id,
+                                table.c.status == models.LotteryJobStatus.RUNNING.value)
+            .values(**values).execution_options(synchronize_session=False))
+        return result.rowcount == 1
+
+    def update_progress(self, job_id, worker_id, phase, done, total, now):
+        return self._update_owned(job_id, worker_id, phase=phase, progress_done=done, progress_total=total,
+                                  heartbeat_at=now, updated_at=now)
+
+    def finish(self, job_id, worker_id, status, now, lottery_id=None, error=None):
+        return self._update_owned(job_id, worker_id, status=status, phase=models.LotteryJobPhase.DONE.value,
+                                  lottery_id=lottery_id, error=error, updated_at=now)
+
+    def heartbeat(self, job_ids, worker_id, now):
+        if not job_ids:
+            return 0
+        table = orm.lottery_jobs
+        return self.session.execute(
+            update(table).where(table.c.uuid.in_(job_ids), table.c.worker_id == worker_id,
+                                table.c.status == models.LotteryJobStatus.RUNNING.value)
+            .values(heartbeat_at=now).execution_options(synchronize_session=False)).rowcount
+
+    def requeue_stale(self, stale_before, max_attempts, now):
+        table = orm.lottery_jobs
+        stale = (table.c.status == models.LotteryJobStatus.RUNNING.value) & (table.c.heartbeat_at < stale_before)
+        count_failed = self.session.execute(
+            update(table).where(stale, table.c.attempts >= max_attempts).values(
+                status=models.LotteryJobStatus.FAILED.value, phase=models.LotteryJobPhase.DONE.value,
+                error="Lottery job abandoned after {} attempts".format(max_attempts), updated_at=now)
+            .execution_options(synchronize_session=False)).rowcount
+        count_requeued = self.session.execute(
+            update(table).where(stale, table.c.attempts < max_attempts).values(
+                status=models.LotteryJobStatus.QUEUED.value, phase=models.LotteryJobPhase.QUEUED.value,
+                worker_id=None, progress_done=0, progress_total=None, updated_at=now)
+            .execution_options(synchronize_session=False)).rowcount
+        return count_failed + count_requeued
+
+
 # Lottery Winners
 class AbstractLotteryWinnerRepository(abc.ABC):
     @abc.abstractmethod
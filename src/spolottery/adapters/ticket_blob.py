@@ -0,0 +1,100 @@
+"""
+Compressed columnar storage of the tickets of a lottery, one blob by lottery.
+
+Layout, little endian, zlib compressed after the header :
+
+    header      magic "SPLT", version, count of tickets, count of delegator ids
+    offsets     uint32[count_ids + 1], delegator ids boundaries in "ids"
+    ids         sorted delegator ids, UTF-8, concatenated
+    tickets     structured array, one record by ticket in tickets order :
+                delegator (index in the ids), winning_likelyhood, pool_owner,
+                delegator_lottery_stake
+
+Delegator ids are dictionary encoded : a page of tickets only decodes the ids
+it references.
+"""
+import struct
+import zlib
+from typing import List
+
+import numpy as np
+
+from spolottery.domain import models
+
+MAGIC = b"SPLT"
+VERSION = 1
+HEADER = struct.Struct("<4sBII")
+TICKET_DTYPE = np.dtype([
+    ("delegator", "<u4"),
+    ("winning_likelyhood", "<f8"),
+    ("pool_owner", "?"),
+    ("delegator_lottery_stake", "<f8"),
+])
+
+
+class TicketBlobError(Exception):
+    pass
+
+
+def encode_tickets(lottery_tickets: models.LotteryTicketColumns, level: int = 6) -> bytes:
+    ids, codes = np.unique(np.array(lottery_tickets.delegator_ids, dtype=object), return_inverse=True)
+    encoded_ids = [delegator_id.encode("utf-8") for delegator_id in ids.tolist()]
+    offsets = np.zeros(len(encoded_ids) + 1, dtype="<u4")
+    np.cumsum([len(encoded_id) for encoded_id in encoded_ids], out=offsets[1:])
+
+    records = np.empty(len(lottery_tickets), dtype=TICKET_DTYPE)
+    records["delegator"] = codes
+    records["winning_likelyhood"] = lottery_tickets.winning_likelyhoods
+    records["pool_owner"] = lottery_tickets.pool_owners
+    records["delegator_lottery_stake"] = lottery_tickets.delegator_lottery_stakes
+
+    header = HEADER.pack(MAGIC, VERSION, len(records), len(encoded_ids))
+    body = offsets.tobytes() + b"".join(encoded_ids) + records.tobytes()
+    return header + zlib.compress(body, level)
+
+
+class LotteryTicketBlob:
+    """
+    Tickets of a stored blob, decompressed on first access, delegator ids
+    decoded only for the tickets asked for
+    """
+
+    def __init__(self, data: bytes):
+        magic, version, self.count_tickets, self.count_ids = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise TicketBlobError("Unknown lottery tickets blob : {!r} version {}".format(magic, version))
+        self._data = data
+        self._body = None
+
+    def __len__(self):
+        return self.count_tickets
+
+    def _decompress(self):
+        if self._body is None:
+            body = zlib.decompress(self._data[HEADER.size:])
+            offsets_size = (self.count_ids + 1) * 4
+            self._offsets = np.frombuffer(body, dtype="<u4", count=self.count_ids + 1)
+            ids_size = int(self._offsets[-1])
+            self._ids = body[offsets_size:offsets_size + ids_size]
+            self._records = np.frombuffer(body, dtype=TICKET_DTYPE, count=self.count_tickets,
+                                          offset=offsets_size + ids_size)
+            self._body = body
+        return self._records
+
+    @property
+    def winning_likelyhoods(self) -> np.ndarray:
+        return self._decompress()["winning_likelyhood"]
+
+    def delegator_ids(self, start: int = 0, stop: int = None) -> List[str]:
+        codes = self._decompress()["delegator"][start:stop].tolist()
+        offsets = self._offsets
+        return [self._ids[offsets[code]:offsets[code + 1]].decode("utf-8") for code in codes]
+
+    def columns(self, start: int = 0, stop: int = None) -> models.LotteryTicketColumns:
+        records = self._decompress()[start:stop]
+        return models.LotteryTicketColumns(
+            delegator_ids=self.delegator_ids(start, stop),
+            winning_likelyhoods=records["winning_likelyhood"].astype(np.float64),
+            pool_owners=records["pool_owner"].astype(bool),
+            delegator_lottery_stakes=records["delegator_lottery_stake"].astype(np.float64),
+        )
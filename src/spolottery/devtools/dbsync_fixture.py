@@ -0,0 +1,172 @@
+"""
+Subset of the cardano-db-sync schema read by DbSyncCardanoService, to build
+small local fixture databases (SQLite or PostgreSQL).
+Only the columns used by the queries are declared.
+"""
+import random
+
+from sqlalchemy import BigInteger, Column, Integer, LargeBinary, MetaData, String, Table, Text
+
+metadata = MetaData()
+
+epoch = Table(
+    "epoch", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("no", Integer),
+)
+
+pool_hash = Table(
+    "pool_hash", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("hash_raw", LargeBinary),
+    Column("view", String),
+)
+
+stake_address = Table(
+    "stake_address", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("hash_raw", LargeBinary),
+    Column("view", String, index=True),
+)
+
+delegation = Table(
+    "delegation", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("addr_id", Integer, index=True),
+    Column("pool_hash_id", Integer, index=True),
+    Column("active_epoch_no", Integer),
+    Column("tx_id", Integer),
+)
+
+stake_deregistration = Table(
+    "stake_deregistration", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("addr_id", Integer, index=True),
+    Column("tx_id", Integer),
+    Column("epoch_no", Integer),
+)
+
+epoch_stake = Table(
+    "epoch_stake", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("addr_id", Integer, index=True),
+    Column("pool_id", Integer),
+    Column("amount", BigInteger),
+    Column("epoch_no", Integer),
+)
+
+tx_out = Table(
+    "tx_out", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("tx_id", Integer),
+    Column("index", Integer),
+    Column("stake_address_id", Integer, index=True),
+    Column("value", BigInteger),
+)
+
+tx_in = Table(
+    "tx_in", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("tx_in_id", Integer),
+    Column("tx_out_id", Integer),
+    Column("tx_out_index", Integer),
+)
+
+reward = Table(
+    "reward", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("addr_id", Integer, index=True),
+    Column("type", String),
+    Column("amount", BigInteger),
+    Column("spendable_epoch", Integer),
+    Column("pool_id", Integer),
+)
+
+withdrawal = Table(
+    "withdrawal", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("addr_id", Integer, index=True),
+    Column("amount", BigInteger),
+    Column("tx_id", Integer),
+)
+
+pool_update = Table(
+    "pool_update", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("hash_id", Integer),
+    Column("active_epoch_no", Integer),
+)
+
+pool_owner = Table(
+    "pool_owner", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("addr_id", Integer),
+    Column("pool_update_id", Integer),
+)
+
+pool_metadata_ref = Table(
+    "pool_metadata_ref", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("pool_id", Integer),
+    Column("url", String),
+)
+
+off_chain_pool_data = Table(
+    "off_chain_pool_data", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("pool_id", Integer),
+    Column("ticker_name", String),
+    Column("json", Text),
+    Column("pmr_id", Integer),
+)
+
+
+def populate_synthetic(connection, count_pools: int = 2, count_delegators: int = 100, history_epochs: int = 50,
+                       current_epoch: int = 400, seed: int = 0):
+    """
+    Pools of "count_delegators" delegators each, with an epoch_stake row by
+    epoch and one unspent output by delegator. Stake address ids and pool ids
+    follow spolottery.devtools.fake_blockfrost synthetic data naming.
+    """
+    rng = random.Random(seed)
+    first_epoch = current_epoch - history_epochs + 1
+
+    connection.execute(epoch.insert(), [{"id": no, "no": no} for no in range(first_epoch, current_epoch + 1)])
+    connection.execute(pool_hash.insert(), [
+        {"id": i + 1, "hash_raw": i.to_bytes(28, "big"), "view": f"pool1fake{i:047d}"} for i in range(count_pools)])
+    connection.execute(pool_update.insert(), [
+        {"id": i + 1, "hash_id": i + 1, "active_epoch_no": first_epoch} for i in range(count_pools)])
+    connection.execute(pool_metadata_ref.insert(), [
+        {"id": i + 1, "pool_id": i + 1, "url": f"https://fake-{i}.pool/"} for i in range(count_pools)])
+    connection.execute(off_chain_pool_data.insert(), [
+        {"id": i + 1, "pool_id": i + 1, "ticker_name": f"F{i:04d}", "pmr_id": i + 1,
+         "json": f'{{"name": "Fake Pool {i}", "ticker": "F{i:04d}", "description": "Synthetic pool"}}'}
+        for i in range(count_pools)])
+
+    addr_id = 0
+    for pool_index in range(count_pools):
+        pool_id = pool_index + 1
+        addresses, delegations, epoch_stakes, outputs = [], [], [], []
+        for delegator_index in range(count_delegators):
+            addr_id += 1
+            addresses.append({"id": addr_id, "hash_raw": addr_id.to_bytes(28, "big"),
+                              "view": f"stake1ufake{pool_index:06d}{delegator_index:042d}"})
+            # Some delegators came from the next pool during the history
+            switch_epoch = rng.randint(first_epoch, current_epoch) if rng.random() < 0.3 else first_epoch
+            if switch_epoch > first_epoch:
+                delegations.append({"addr_id": addr_id, "pool_hash_id": (pool_index + 1) % count_pools + 1,
+                                    "active_epoch_no": first_epoch, "tx_id": addr_id})
+            delegations.append({"addr_id": addr_id, "pool_hash_id": pool_id,
+                                "active_epoch_no": switch_epoch, "tx_id": 10 ** 7 + addr_id})
+            amount = rng.randint(1, 10 ** 6) * 10 ** 6
+            for epoch_no in range(first_epoch, current_epoch + 1):
+                amount = max(0, amount + rng.randint(-10, 10) * 10 ** 6)
+                epoch_stakes.append({"addr_id": addr_id, "epoch_no": epoch_no, "amount": amount,
+                                     "pool_id": pool_id if epoch_no >= switch_epoch else
+                                     (pool_index + 1) % count_pools + 1})
+            outputs.append({"tx_id": addr_id, "index": 0, "stake_address_id": addr_id, "value": amount})
+
+        connection.execute(stake_address.insert(), addresses)
+        connection.execute(delegation.insert(), delegations)
+        connection.execute(epoch_stake.insert(), epoch_stakes)
+        connection.execute(tx_out.insert(), outputs)
@@ -0,0 +1,287 @@
+"""
+Local stand-in for the Blockfrost API, to load test the Cardano service
+without using the project quota.
+
+Serves the endpoints used by BlockFrostCardanoService from synthetic data or
+from a recorded JSON fixture, with optional latency, errors and 429 answers.
+Point the service at it with BLOCKFROST_API_URL=http://<host>:<port>
+
+    python -m spolottery.devtools.fake_blockfrost --pools 300 --delegators 2000 --latency 0.05
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+from typing import List, Optional
+
+from aiohttp import web
+
+import spolottery.config as config
+from spolottery.service_layer.epoch_clock import EpochClock
+
+log = logging.getLogger(__name__)
+
+MAX_PAGE_SIZE = 100
+
+
+class RecordedData:
+    """
+    Blockfrost answers read from a JSON fixture :
+    {"epoch": 400,
+     "pools": {pool_id: {"metadata": {...}, "owners": [...], "delegators": [{"address", "live_stake"}]}},
+     "accounts": {address: [{"active_epoch", "amount", "pool_id"}, ...]}}
+    Account histories are sorted by epoch, oldest first, as Blockfrost does.
+    """
+
+    def __init__(self, fixture: dict):
+        self.current_epoch = fixture["epoch"]
+        self._pools = fixture["pools"]
+        self._accounts = fixture.get("accounts", {})
+
+    @classmethod
+    def from_file(cls, path: str) -> "RecordedData":
+        with open(path) as fixture_file:
+            return cls(json.load(fixture_file))
+
+    def pool_ids(self) -> List[str]:
+        return list(self._pools)
+
+    def pool_metadata(self, pool_id: str) -> Optional[dict]:
+        pool = self._pools.get(pool_id)
+        return None if pool is None else pool.get("metadata", {})
+
+    def pool_owners(self, pool_id: str) -> Optional[List[str]]:
+        pool = self._pools.get(pool_id)
+        return None if pool is None else pool.get("owners", [])
+
+    def pool_delegators(self, pool_id: str) -> Optional[List[dict]]:
+        pool = self._pools.get(pool_id)
+        return None if pool is None else pool.get("delegators", [])
+
+    def account_history(self, address_id: str) -> Optional[List[dict]]:
+        return self._accounts.get(address_id)
+
+
+class SyntheticData:
+    """
+    Deterministic generated registry : "count_pools" pools with
+    "count_delegators" delegators each. Histories are generated on request
+    from the address so large pools don't have to be kept in memory.
+    """
+
+    def __init__(self, count_pools: int = 100, count_delegators: int = 500, history_epochs: int = 100,
+                 current_epoch: Optional[int] = None, seed: int = 0):
+        self.count_pools = count_pools
+        self.count_delegators = count_delegators
+        self.history_epochs = history_epochs
+        self.current_epoch = current_epoch if current_epoch is not None else \
+            EpochClock.from_config(config).current_epoch()
+        self.seed = seed
+        self._pool_ids = [self._pool_id(i) for i in range(count_pools)]
+        self._pool_indexes = {pool_id: i for i, pool_id in enumerate(self._pool_ids)}
+
+    @staticmethod
+    def _pool_id(pool_index: int) -> str:
+        return f"pool1fake{pool_index:047d}"
+
+    @staticmethod
+    def _address_id(pool_index: int, delegator_index: int) -> str:
+        return f"stake1ufake{pool_index:06d}{delegator_index:042d}"
+
+    def _address_indexes(self, address_id: str):
+        if not address_id.startswith("stake1ufake"):
+            return None
+        pool_index, delegator_index = int(address_id[11:17]), int(address_id[17:])
+        if pool_index >= self.count_pools or delegator_index >= self.count_delegators:
+            return None
+        return pool_index, delegator_index
+
+    def pool_ids(self) -> List[str]:
+        return self._pool_ids
+
+    def pool_metadata(self, pool_id: str) -> Optional[dict]:
+        pool_index = self._pool_indexes.get(pool_id)
+        if pool_index is None:
+            return None
+        # One pool out of twenty never registered metadata
+        if pool_index % 20 == 19:
+            return {}
+        return {"pool_id": pool_id, "hex": f"{pool_index:056x}", "url": f"https://fake-{pool_index}.pool/",
+                "hash": None, "ticker": f"F{pool_index:04d}", "name": f"Fake Pool {pool_index}",
+                "description": "Synthetic pool", "homepage": f"https://fake-{pool_index}.pool/"}
+
+    def pool_owners(self, pool_id: str) -> Optional[List[str]]:
+        pool_index = self._pool_indexes.get(pool_id)
+        return None if pool_index is None else [self._address_id(pool_index, 0)]
+
+    def pool_delegators(self, pool_id: str) -> Optional[List[dict]]:
+        pool_index = self._pool_indexes.get(pool_id)
+        if pool_index is None:
+            return None
+        rng = random.Random(f"{self.seed}-{pool_id}")
+        return [{"address": self._address_id(pool_index, i), "live_stake": str(rng.randint(1, 10 ** 6) * 10 ** 6)}
+                for i in range(self.count_delegators)]
+
+    def account_history(self, address_id: str) -> Optional[List[dict]]:
+        indexes = self._address_indexes(address_id)
+        if indexes is None:
+            return None
+        pool_index, _ = indexes
+        rng = random.Random(f"{self.seed}-{address_id}")
+        # Some delegators came from another pool during the history
+        first_epoch = self.current_epoch - self.history_epochs + 1
+        switch_epoch = rng.randint(first_epoch, self.current_epoch) if rng.random() < 0.3 else first_epoch
+        previous_pool_id = self._pool_id((pool_index + 1) % self.count_pools)
+        amount = rng.randint(1, 10 ** 6) * 10 ** 6
+        history = []
+        for epoch in range(first_epoch, self.current_epoch + 1):
+            amount = max(0, amount + rng.randint(-10, 10) * 10 ** 6)
+            history.append({"active_epoch": epoch, "amount": str(amount),
+                            "pool_id": self._pool_id(pool_index) if epoch >= switch_epoch else previous_pool_id})
+        return history
+
+    def to_fixture(self, with_accounts: bool = True) -> dict:
+        """
+        Same data as a RecordedData fixture, to edit it or replay it elsewhere
+        """
+        pools = {pool_id: {"metadata": self.pool_metadata(pool_id), "owners": self.pool_owners(pool_id),
+                           "delegators": self.pool_delegators(pool_id)} for pool_id in self._pool_ids}
+        accounts = {}
+        if with_accounts:
+            accounts = {delegator["address"]: self.account_history(delegator["address"])
+                        for pool in pools.values() for delegator in pool["delegators"]}
+        return {"epoch": self.current_epoch, "pools": pools, "accounts": accounts}
+
+
+class FaultInjection:
+    """
+    Latency, server errors and rate limiting applied to every request
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 rate_limited_rate: float = 0.0, retry_after: int = 1, seed: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limited_rate = rate_limited_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+
+    @web.middleware
+    async def middleware(self, request: web.Request, handler):
+        request.app["stats"]["requests_count"] += 1
+        delay = self.latency + self.random.uniform(0, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        draw = self.random.random()
+        if draw < self.rate_limited_rate:
+            request.app["stats"]["rate_limited_count"] += 1
+            return web.json_response(
+                {"status_code": 429, "error": "Project Over Limit", "message": "Usage is over limit."},
+                status=429, headers={"Retry-After": str(self.retry_after)})
+        if draw < self.rate_limited_rate + self.error_rate:
+            request.app["stats"]["errors_count"] += 1
+            return web.json_response(
+                {"status_code": 500, "error": "Internal Server Error", "message": "Injected error."}, status=500)
+
+        return await handler(request)
+
+
+def _page(request: web.Request, items: list) -> list:
+    count = min(int(request.query.get("count", MAX_PAGE_SIZE)), MAX_PAGE_SIZE)
+    page = int(request.query.get("page", 1))
+    if request.query.get("order", "asc") == "desc":
+        items = items[::-1]
+    return items[(page - 1) * count:page * count]
+
+
+def _not_found():
+    return web.json_response(
+        {"status_code": 404, "error": "Not Found", "message": "The requested component has not been found."},
+        status=404)
+
+
+def create_app(data, faults: Optional[FaultInjection] = None) -> web.Application:
+    faults = faults if faults else FaultInjection()
+    app = web.Application(middlewares=[faults.middleware])
+    app["data"] = data
+    app["stats"] = {"requests_count": 0, "rate_limited_count": 0, "errors_count": 0}
+
+    async def epoch_latest(request):
+        return web.json_response({"epoch": data.current_epoch})
+
+    async def pools(request):
+        return web.json_response(_page(request, data.pool_ids()))
+
+    async def pool(request):
+        pool_id = request.match_info["pool_id"]
+        owners = data.pool_owners(pool_id)
+        if owners is None:
+            return _not_found()
+        return web.json_response({"pool_id": pool_id, "owners": owners})
+
+    async def pool_metadata(request):
+        metadata = data.pool_metadata(request.match_info["pool_id"])
+        if metadata is None:
+            return _not_found()
+        return web.json_response(metadata)
+
+    async def pool_delegators(request):
+        delegators = data.pool_delegators(request.match_info["pool_id"])
+        if delegators is None:
+            return _not_found()
+        return web.json_response(_page(request, delegators))
+
+    async def account_history(request):
+        history = data.account_history(request.match_info["address_id"])
+        if history is None:
+            return _not_found()
+        return web.json_response(_page(request, history))
+
+    async def stats(request):
+        return web.json_response(app["stats"])
+
+    app.router.add_get("/v0/epochs/latest", epoch_latest)
+    app.router.add_get("/v0/pools", pools)
+    app.router.add_get("/v0/pools/{pool_id}", pool)
+    app.router.add_get("/v0/pools/{pool_id}/metadata", pool_metadata)
+    app.router.add_get("/v0/pools/{pool_id}/delegators", pool_delegators)
+    app.router.add_get("/v0/accounts/{address_id}/history", account_history)
+    app.router.add_get("/stats", stats)
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="fake_blockfrost")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--fixture", help="Recorded JSON fixture, synthetic data otherwise")
+    parser.add_argument("--pools", type=int, default=100)
+    parser.add_argument("--delegators", type=int, default=500, help="Delegators by pool")
+    parser.add_argument("--history-epochs", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every answer")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random extra latency, up to this many seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of 500 answers")
+    parser.add_argument("--rate-limited-rate", type=float, default=0.0, help="Share of 429 answers")
+    parser.add_argument("--retry-after", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    if args.fixture:
+        data = RecordedData.from_file(args.fixture)
+    else:
+        data = SyntheticData(args.pools, args.delegators,
+                             args.history_epochs, seed=args.seed)
+    faults = FaultInjection(args.latency, args.jitter, args.error_rate,
+                            args.rate_limited_rate, args.retry_after, seed=args.seed)
+    log.info("Fake Blockfrost : {} pools - epoch {}".format(len(data.pool_ids()), data.current_epoch))
+    web.run_app(create_app(data, faults), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+# Pool ids are interned process wide: a history only stores a small int by delegation
+_pool_ids: List[str] = []
+_pool_index: Dict[str, int] = {}
+_intern_lock = threading.Lock()
+
+
+def intern_pool_id(pool_id: str) -> int:
+    index = _pool_index.get(pool_id)
+    if index is None:
+        # Histories are built by several threads (lottery jobs, ASGI thread pool)
+        with _intern_lock:
+            index = _pool_index.get(pool_id)
+            if index is None:
+                index = len(_pool_ids)
+                _pool_ids.append(pool_id)
+                _pool_index[pool_id] = index
+    return index
+
+
+def interned_pool_index(pool_id: str) -> int:
+    """
+    Interned index of pool_id, -1 if it was never interned
+    """
+    return _pool_index.get(pool_id, -1)
+
+
+def interned_pool_ids() -> List[str]:
+    """
+    Interned pool ids, position is the pool index stored in the histories
+    """
+    return _pool_ids
+
+
+@dataclass(unsafe_hash=True)
+class Delegation:
+    __slots__ = ("pool_id", "amount", "epoch_no")
+
+    # address_id: str  # Stake address id
+    pool_id: str  # Pool id
+    amount: float
+    epoch_no: int
+
+    def __gt__(self, other):
+        if self.epoch_no is None:
+            return False
+        if other.epoch_no is None:
+            return True
+        return self.epoch_no > other.epoch_no
+
+
+class DelegationHistory:
+    """
+    Delegations of one stake address, kept sorted by epoch in compact arrays
+    (epoch, interned pool index, lovelace amount) instead of a set of objects.
+    Epoch window queries are O(log n) with bisect.
+
+    covered_from is the oldest epoch from which the history is complete when
+    only its newest part was fetched, None when it holds the whole history.
+    """
+
+    __slots__ = ("epochs", "pools", "amounts", "covered_from")
+
+    def __init__(self, delegations: Optional[Iterable[Delegation]] = None):
+        self.epochs = array("i")
+        self.pools = array("i")
+        self.amounts = array("q")
+        self.covered_from: Optional[int] = None
+        if delegations:
+            self.update(delegations)
+
+    def add(self, delegation: Delegation):
+        epoch_no = int(delegation.epoch_no)
+        pool = intern_pool_id(delegation.pool_id)
+        amount = int(delegation.amount)
+
+        lo = bisect_left(self.epochs, epoch_no)
+        hi = bisect_right(self.epochs, epoch_no, lo)
+        # Same semantic as the former set : no duplicated delegation
+        for i in range(lo, hi):
+            if self.pools[i] == pool and self.amounts[i] == amount:
+                return
+
+        self.epochs.insert(hi, epoch_no)
+        self.pools.insert(hi, pool)
+        self.amounts.insert(hi, amount)
+
+    def update(self, delegations: Iterable[Delegation]):
+        for delegation in delegations:
+            self.add(delegation)
+
+    def _delegation(self, i: int) -> Delegation:
+        return Delegation(pool_id=_pool_ids[self.pools[i]], amount=self.amounts[i], epoch_no=self.epochs[i])
+
+    def __len__(self):
+        return len(self.epochs)
+
+    def __iter__(self) -> Iterator[Delegation]:
+        """
+        Oldest epoch first
+        """
+        return (self._delegation(i) for i in range(len(self.epochs)))
+
+    def __reversed__(self) -> Iterator[Delegation]:
+        """
+        Newest epoch first
+        """
+        return (self._delegation(i) for i in reversed(range(len(self.epochs))))
+
+    def __contains__(self, delegation) -> bool:
+        return any(d == delegation for d in self.window(delegation.epoch_no, delegation.epoch_no))
+
+    def __eq__(self, other):
+        if not isinstance(other, DelegationHistory):
+            return False
+        return (self.epochs, self.pools, self.amounts) == (other.epochs, other.pools, other.amounts)
+
+    def __repr__(self):
+        return f"<DelegationHistory {len(self)} delegations>"
+
+    @property
+    def last_epoch(self) -> Optional[int]:
+        return self.epochs[-1] if self.epochs else None
+
+    @property
+    def first_epoch(self) -> Optional[int]:
+        return self.epochs[0] if self.epochs else None
+
+    def window(self, min_epoch: int, max_epoch: int) -> Iterator[Delegation]:
+        """
+        Delegations with min_epoch <= epoch_no <= max_epoch, oldest epoch first
+        """
+        lo = bisect_left(self.epochs, min_epoch)
+        hi = bisect_right(self.epochs, max_epoch, lo)
+        return (self._delegation(i) for i in range(lo, hi))
+
+    def since(self, epoch_no: Optional[int]) -> Iterator[Delegation]:
+        """
+        Delegations strictly newer than epoch_no (all of them if None)
+        """
+        lo = 0 if epoch_no is None else bisect_right(self.epochs, epoch_no)
+        return (self._delegation(i) for i in range(lo, len(self.epochs)))
+
+    def columns(self) -> Tuple[array, array, array]:
+        """
+        Raw (epochs, pool indexes, amounts) arrays, see interned_pool_ids
+        """
+        return self.epochs, self.pools, self.amounts
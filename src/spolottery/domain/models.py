@@ -3,11 +3,14 @@ import json
 import uuid
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
-from typing import Optional, List
+from typing import FrozenSet, Iterable, Optional, List
 from datetime import datetime, timezone
 
 import numpy as np
 
+from spolottery.domain.delegations import Delegation, DelegationHistory
+from spolottery.domain.stake_engine import DelegationColumns
+
 
 class OutOfDelegator(Exception):
     pass
@@ -17,33 +20,27 @@ class OutOfEpoch(Exception):
     pass
 
 
-@dataclass(unsafe_hash=True)
-class Delegation:
-   # address_id: str  # Stake address id
-    pool_id: str  # Pool id
-    amount: float
-    epoch_no: int
-
-    def __gt__(self, other):
-        if self.epoch_no is None:
-            return False
-        if other.epoch_no is None:
-            return True
-        return self.epoch_no > other.epoch_no
-
-
 class Delegator:
+    __slots__ = ("address_id", "live_stake", "_delegation_history")
+
     # Stake address id
-    def __init__(self, address_id: str, live_stake: int = 0, delegation_history: set[Delegation] = None):
+    def __init__(self, address_id: str, live_stake: int = 0, delegation_history: Iterable[Delegation] = None):
         self.address_id = address_id
         self.live_stake = live_stake  # lovelace
-        # type Set[Delegation] List of Deletation(s)
-        self.delegation_history = set()
-        if delegation_history:
-            self.delegation_history = delegation_history
+        self.delegation_history = delegation_history
+
+    @property
+    def delegation_history(self) -> DelegationHistory:
+        return self._delegation_history
+
+    @delegation_history.setter
+    def delegation_history(self, delegation_history: Iterable[Delegation]):
+        if not isinstance(delegation_history, DelegationHistory):
+            delegation_history = DelegationHistory(delegation_history)
+        self._delegation_history = delegation_history
 
     def add_delegation_history(self, delegation: Delegation):
-        self.delegation_history.add(delegation)
+        self._delegation_history.add(delegation)
 
     def __repr__(self):
         return f"<Delegator {self.address_id}>"
@@ -92,13 +89,28 @@ class Pool:
         self.description = description
         self.updated_at = updated_at
         self._owners = set()  # type Set[PoolOwner] List of stake address
+        self._owner_addresses = None
 
     @property
     def owners(self):
         return self._owners
 
+    @property
+    def owner_addresses(self) -> FrozenSet[str]:
+        """
+        Stake addresses of the owners, built once and reset by add_pool_owner
+        """
+        # Not set when the pool is loaded by the ORM (no __init__ call)
+        owner_addresses = getattr(self, "_owner_addresses", None)
+        if owner_addresses is None:
+            owner_addresses = frozenset(
+                owner.address_id for owner in self._owners)
+            self._owner_addresses = owner_addresses
+        return owner_addresses
+
     def add_pool_owner(self, owner: PoolOwner):
         self._owners.add(owner)
+        self._owner_addresses = None
 
     def __repr__(self):
         return f"<Pool {self.pool_id}>"
@@ -142,8 +154,8 @@ def is_eligible(delegator: Delegator, target_pool_id: str, current_epoch: int, m
 
     delegator_eligible_status = True
 
-    for delegation in sorted(delegator.delegation_history, reverse=True):
-        if min_epoch <= delegation.epoch_no <= current_epoch and delegation.pool_id != target_pool_id:
+    for delegation in delegator.delegation_history.window(min_epoch, current_epoch):
+        if delegation.pool_id != target_pool_id:
             delegator_eligible_status = False
             break
 
@@ -161,7 +173,7 @@ def first_delegation_amount(delegator: Delegator, target_pool_id: str, count_epo
     """
     i = count_epochs
     first_delegation_amount = 0
-    for dh in sorted(delegator.delegation_history, reverse=True):
+    for dh in reversed(delegator.delegation_history):
         if dh.pool_id == target_pool_id:
             count_epochs = count_epochs - 1
         if count_epochs == 0:
@@ -175,7 +187,40 @@ def get_live_stake(delegator: Delegator, target_pool_id: str) -> int:
     Get current active stake on target_pool_id
     """
 
-    return next(int(dh.amount) for dh in sorted(delegator.delegation_history, reverse=True) if dh.pool_id == target_pool_id)
+    return next(int(dh.amount) for dh in reversed(delegator.delegation_history) if dh.pool_id == target_pool_id)
+
+
+@dataclass(frozen=True)
+class HistoryWindow:
+    """
+    Oldest part of the delegation histories a lottery needs :
+    the eligibility window and the count_epochs th delegation to the pool
+    """
+    pool_id: str
+    min_epoch: int
+    count_epochs: int
+
+    @classmethod
+    def for_lottery(cls, pool_id: str, start_epoch: int, count_epochs: int) -> "HistoryWindow":
+        return cls(pool_id=pool_id, min_epoch=start_epoch - count_epochs, count_epochs=count_epochs)
+
+    def is_covered(self, delegations_desc: List[Delegation]) -> bool:
+        """
+        Are the newest delegations "delegations_desc" (newest first) enough for
+        is_eligible and first_delegation_amount, whatever older delegations are
+        """
+        if not delegations_desc or delegations_desc[-1].epoch_no >= self.min_epoch:
+            return False
+        # first_delegation_amount stops changing after the next delegation to the pool
+        count_pool_delegations = sum(
+            1 for delegation in delegations_desc if delegation.pool_id == self.pool_id)
+        return count_pool_delegations > self.count_epochs
+
+    def is_answered_by(self, history: DelegationHistory) -> bool:
+        """
+        Is "history" enough for this window : whole, or its newest part covers it
+        """
+        return history.covered_from is None or self.is_covered(list(reversed(history)))
 
 
 class LotteryTicket:
@@ -196,6 +241,42 @@ class LotteryTicket:
         self.delegator_lottery_stake = delegator_lottery_stake if delegator_lottery_stake else 0
 
 
+@dataclass
+class LotteryTicketColumns:
+    """
+    Lottery tickets as columns, one row by ticket, in tickets order
+    """
+    delegator_ids: List[str]
+    winning_likelyhoods: np.ndarray
+    pool_owners: np.ndarray
+    delegator_lottery_stakes: np.ndarray
+
+    def __len__(self):
+        return len(self.delegator_ids)
+
+    @classmethod
+    def from_tickets(cls, lottery_tickets: List[LotteryTicket]) -> "LotteryTicketColumns":
+        count_tickets = len(lottery_tickets)
+        return cls(
+            delegator_ids=[lt.delegator_id for lt in lottery_tickets],
+            winning_likelyhoods=np.fromiter(
+                (lt.winning_likelyhood for lt in lottery_tickets), dtype=np.float64, count=count_tickets),
+            pool_owners=np.fromiter((bool(lt.pool_owner) for lt in lottery_tickets), dtype=bool, count=count_tickets),
+            delegator_lottery_stakes=np.fromiter(
+                (lt.delegator_lottery_stake if lt.delegator_lottery_stake else 0 for lt in lottery_tickets),
+                dtype=np.float64, count=count_tickets),
+        )
+
+    def to_tickets(self, lottery_id: Optional[str]) -> List[LotteryTicket]:
+        return [
+            LotteryTicket(delegator_id=delegator_id, winning_likelyhood=winning_likelyhood, pool_owner=pool_owner,
+                          lottery_id=lottery_id, delegator_lottery_stake=delegator_lottery_stake)
+            for delegator_id, winning_likelyhood, pool_owner, delegator_lottery_stake in zip(
+                self.delegator_ids, self.winning_likelyhoods.tolist(), self.pool_owners.tolist(),
+                self.delegator_lottery_stakes.tolist())
+        ]
+
+
 def get_lottery_ticket_likelyhood(lottery_ticket: LotteryTicket, target_pool_id: str) -> int:
     """
     Calculate likelyhood of a lottery ticket based on delegator history
@@ -215,7 +296,8 @@ class LotteryStrategy(ABC):
         self.min_live_stake = min_live_stake if min_live_stake else 0
 
     def init_strategy(
-        self, delegators: List[Delegator], owners_allowed: bool, lottery_id: str, pool: Pool, count_epochs: int
+        self, delegators: List[Delegator], owners_allowed: bool, lottery_id: str, pool: Pool, count_epochs: int,
+        delegation_columns: Optional[DelegationColumns] = None, first_amounts: Optional[np.ndarray] = None
     ):
         self.delegators = delegators
         self.owners_allowed = owners_allowed
@@ -223,15 +305,36 @@ class LotteryStrategy(ABC):
         self.pool = pool
         self.count_epochs = count_epochs
         self.lottery_tickets = []
+        self.delegation_columns = delegation_columns
+        self.first_amounts = first_amounts
 
     @abstractmethod
     def prepare_lottery(self):
         raise NotImplementedError
 
     @abstractmethod
-    def calculate_likelyhood(self) -> List[LotteryTicket]:
+    def calculate_likelyhood_columns(self) -> LotteryTicketColumns:
         raise NotImplementedError
 
+    def calculate_likelyhood(self) -> List[LotteryTicket]:
+        self.lottery_tickets = self.calculate_likelyhood_columns().to_tickets(self.lottery_id)
+        return self.lottery_tickets
+
+    def tickets_columns(self, delegators: List[Delegator], winning_likelyhoods: np.ndarray,
+                        delegator_lottery_stakes: np.ndarray) -> LotteryTicketColumns:
+        """
+        Tickets of the delegators, without the pool owners unless they are allowed
+        """
+        pool_owners = np.fromiter((is_delegator_pool_owner(delegator, self.pool) for delegator in delegators),
+                                  dtype=bool, count=len(delegators))
+        kept = np.ones(len(delegators), dtype=bool) if self.owners_allowed else ~pool_owners
+        return LotteryTicketColumns(
+            delegator_ids=[delegators[i].address_id for i in np.flatnonzero(kept)],
+            winning_likelyhoods=winning_likelyhoods[kept],
+            pool_owners=pool_owners[kept],
+            delegator_lottery_stakes=delegator_lottery_stakes[kept],
+        )
+
 
 class FixedLotteryStrategy(LotteryStrategy):
     def prepare_lottery(self):
@@ -246,25 +349,12 @@ class FixedLotteryStrategy(LotteryStrategy):
             raise OutOfEpoch(
                 f"Count epochs should be >= 1 for lottery  {self.lottery_id}")
 
-    def calculate_likelyhood(self):
-
+    def calculate_likelyhood_columns(self):
         count_delegators = len(self.delegators)
 
         winning_likelyhood = 1 / count_delegators
-        for delegator in self.delegators:
-            is_pool_owner = is_delegator_pool_owner(delegator, self.pool)
-            if not (is_pool_owner and not self.owners_allowed):
-                self.lottery_tickets.append(
-                    LotteryTicket(
-                        delegator_id=delegator.address_id,
-                        winning_likelyhood=winning_likelyhood,
-                        pool_owner=is_pool_owner,
-                        lottery_id=self.lottery_id,
-                        delegator_lottery_stake=None
-                    )
-                )
-
-        return self.lottery_tickets
+        return self.tickets_columns(self.delegators, np.full(count_delegators, winning_likelyhood),
+                                    np.zeros(count_delegators))
 
 
 class StakeLotteryStrategy(LotteryStrategy):
@@ -286,40 +376,24 @@ class StakeLotteryStrategy(LotteryStrategy):
             raise OutOfEpoch(
                 f"Count epochs should be >= 1 for lottery  {self.lottery_id}")
 
-        for delegator in self.delegators:
-            current_live_stake = delegator.live_stake
-            if self.count_epochs == 1:
-                mean_delegation_by_epoch = current_live_stake
-            else:
-                first_stake_amount = first_delegation_amount(
-                    delegator, self.pool.pool_id, self.count_epochs)
-                mean_delegation_by_epoch = round(
-                    abs(int(first_stake_amount) +
-                        int(current_live_stake)) / (self.count_epochs), 2
-                )
-
-                self.delegators_stake.append(
-                    (delegator, mean_delegation_by_epoch))
+        if self.delegation_columns is None:
+            self.delegation_columns = DelegationColumns.from_delegators(
+                self.delegators)
 
-            self.total_mean_stake += mean_delegation_by_epoch
+        mean_stakes = self.delegation_columns.mean_stakes(
+            self.pool.pool_id, self.count_epochs, self.first_amounts).tolist()
 
-    def calculate_likelyhood(self):
-
-        for delegator_stake in self.delegators_stake:
-            delegator, mean_delegation_by_epoch = delegator_stake
-            winning_likelyhood = mean_delegation_by_epoch / self.total_mean_stake
-            is_pool_owner = is_delegator_pool_owner(delegator, self.pool)
-            if not (is_pool_owner and not self.owners_allowed):
-                lottery_ticket = LotteryTicket(
-                    delegator_id=delegator.address_id,
-                    winning_likelyhood=winning_likelyhood,
-                    pool_owner=is_pool_owner,
-                    lottery_id=self.lottery_id,
-                    delegator_lottery_stake=mean_delegation_by_epoch
-                )
-                self.lottery_tickets.append(lottery_ticket)
+        if self.count_epochs > 1:
+            self.delegators_stake = list(zip(self.delegators, mean_stakes))
 
-        return self.lottery_tickets
+        # Sequential sum, same float rounding as accumulating delegator by delegator
+        for mean_delegation_by_epoch in mean_stakes:
+            self.total_mean_stake += mean_delegation_by_epoch
+
+    def calculate_likelyhood_columns(self):
+        delegators = [delegator for delegator, _ in self.delegators_stake]
+        mean_stakes = np.array([mean_stake for _, mean_stake in self.delegators_stake], dtype=np.float64)
+        return self.tickets_columns(delegators, mean_stakes / self.total_mean_stake, mean_stakes)
 
 # class syntax
 
@@ -370,7 +444,8 @@ class Lottery:
         owners_allowed: bool,
         min_live_stake: int,
         lottery_tickets: List[LotteryTicket] = None,
-        winners: Optional[set[LotteryWinner]] = None
+        winners: Optional[set[LotteryWinner]] = None,
+        winners_count: Optional[int] = None
     ):
         self.uuid = uuid
         self.winners = set()
@@ -388,6 +463,8 @@ class Lottery:
         self.draw_date = draw_date
         self.created_at = created_at
         self.lottery_tickets = lottery_tickets
+        # None : every ticket is ranked (lotteries created before winners_count)
+        self.winners_count = winners_count
 
     def __repr__(self):
         return f"<Lottery {self.uuid}>"
@@ -401,38 +478,199 @@ class Lottery:
         return hash(self.uuid)
 
     def is_lottery_result_available(self):
-        return self.draw_date <= datetime.now(timezone.utc)
+        draw_date = self.draw_date
+        # Stored draw dates are naive UTC datetimes
+        if draw_date.tzinfo is None:
+            draw_date = draw_date.replace(tzinfo=timezone.utc)
+        return draw_date <= datetime.now(timezone.utc)
 
-    def raffle_draw(self):
+    def draw_seed(self) -> int:
         # Default seed with lottery uuid to keep the same results if same parameters
-        rng = np.random.default_rng(
-            int("".join(filter(str.isdigit, self.uuid))))
-        delegator_keys = [lt.delegator_id for lt in self.lottery_tickets]
-        delegator_winning_likelyhoods = [
-            lt.winning_likelyhood for lt in self.lottery_tickets]
+        return int("".join(filter(str.isdigit, self.uuid)))
+
+    def draw_winners(self, lottery_tickets: Optional[LotteryTicketColumns] = None) -> List[str]:
+        """
+        Delegator ids of the winners, by rank, from the lottery tickets by default
+        """
+        if lottery_tickets is None:
+            lottery_tickets = LotteryTicketColumns.from_tickets(self.lottery_tickets)
+        rng = np.random.default_rng(self.draw_seed())
+        delegator_keys = lottery_tickets.delegator_ids
         # normalize probabilities for numpy tolerance (know issues)
-        delegator_winning_likelyhoods = np.array(delegator_winning_likelyhoods)
+        delegator_winning_likelyhoods = np.array(lottery_tickets.winning_likelyhoods, dtype=np.float64)
         delegator_winning_likelyhoods /= delegator_winning_likelyhoods.sum()
-        winners_count = len(delegator_keys)
-        winners = rng.choice(
-            delegator_keys, winners_count, replace=False, p=delegator_winning_likelyhoods
-        ).tolist()
 
-        for i, winner in enumerate(winners):
+        if self.winners_count is None:
+            # Full weighted permutation, kept to reproduce former lotteries draws
+            winners_count = len(delegator_keys)
+            return rng.choice(
+                delegator_keys, winners_count, replace=False, p=delegator_winning_likelyhoods
+            ).tolist()
+
+        # Tickets without winning likelyhood can't win
+        winners_count = min(self.winners_count, np.count_nonzero(delegator_winning_likelyhoods > 0))
+        return [delegator_keys[i] for i in weighted_sample_without_replacement(
+            rng, delegator_winning_likelyhoods, winners_count)]
+
+    def raffle_draw(self):
+        for i, winner in enumerate(self.draw_winners()):
             self.winners.add(LotteryWinner(winner, i))
 
     def toJson(self):
         return json.dumps(self, default=lambda o: o.__dict__)
 
 
+class LotteryJobStatus(Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+
+class LotteryJobPhase(Enum):
+    QUEUED = "queued"
+    FETCHING_DELEGATORS = "fetching_delegators"
+    PREPARING_TICKETS = "preparing_tickets"
+    DRAWING_WINNERS = "drawing_winners"
+    SAVING = "saving"
+    DONE = "done"
+
+
+class LotteryJob:
+    """
+    Lottery creation requested through the API and run by a background worker.
+    lottery_details is the JSON of the lottery input, progress_done counts the
+    delegators or tickets handled in the current phase.
+    """
+
+    def __init__(
+        self,
+        uuid: str,
+        lottery_details: str,
+        created_at: datetime,
+        status: str = LotteryJobStatus.QUEUED.value,
+        phase: str = LotteryJobPhase.QUEUED.value,
+        progress_done: int = 0,
+        progress_total: Optional[int] = None,
+        attempts: int = 0,
+        worker_id: Optional[str] = None,
+        heartbeat_at: Optional[datetime] = None,
+        updated_at: Optional[datetime] = None,
+        lottery_id: Optional[str] = None,
+        error: Optional[str] = None,
+    ):
+        self.uuid = uuid
+        self.lottery_details = lottery_details
+        self.created_at = created_at
+        self.status = status
+        self.phase = phase
+        self.progress_done = progress_done
+        self.progress_total = progress_total
+        self.attempts = attempts
+        self.worker_id = worker_id
+        self.heartbeat_at = heartbeat_at
+        self.updated_at = updated_at if updated_at else created_at
+        self.lottery_id = lottery_id
+        self.error = error
+
+    def __repr__(self):
+        return f"<LotteryJob {self.uuid} {self.status}>"
+
+    def __eq__(self, other):
+        if not isinstance(other, LotteryJob):
+            return False
+        return other.uuid == self.uuid
+
+    def __hash__(self):
+        return hash(self.uuid)
+
+
+def efraimidis_spirakis_keys(rng: np.random.Generator, weights: np.ndarray,
+                             trials: Optional[int] = None) -> np.ndarray:
+    """
+    Random keys log(u) / w of each weight, the best keys win the draw.
+    One row of keys by trial when "trials" is given
+    """
+    shape = len(weights) if trials is None else (trials, len(weights))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.log(rng.random(shape)) / weights
+
+
+def weighted_sample_without_replacement(rng: np.random.Generator, weights: np.ndarray, k: int) -> np.ndarray:
+    """
+    Draw k ranked indexes without replacement, weighted by "weights"
+    Efraimidis-Spirakis keys (log(u) / w), only the k best keys are sorted.
+    Zero weights (key -inf) are never drawn, fewer than k indexes are drawn then
+    """
+    k = min(k, np.count_nonzero(weights > 0))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+
+    keys = efraimidis_spirakis_keys(rng, weights)
+    candidates = np.flatnonzero(keys > -np.inf)
+    keys = keys[candidates]
+
+    if k < len(keys):
+        top_k = np.argpartition(-keys, k - 1)[:k]
+    else:
+        top_k = np.arange(len(keys))
+
+    return candidates[top_k[np.argsort(-keys[top_k], kind="stable")]]
+
+
 def is_delegator_pool_owner(delegator: Delegator, pool: Pool):
     """
     Is "delegator" an owner of the "pool"
     """
-    for pool_owner in pool.owners:
-        if delegator.address_id in pool_owner.address_id:
-            return True
-    return False
+    return delegator.address_id in pool.owner_addresses
+
+
+class LotteryTicketsBuilder:
+    """
+    Prepare the lottery tickets from batches of delegators.
+
+    Each batch is reduced as soon as it is added : only its eligible
+    delegators are kept, stripped of their delegation history, along with
+    their live stake and first delegation amount. Memory stays bounded by
+    the batch size whatever the count of delegators of the pool.
+    """
+
+    def __init__(self, lottery: Lottery):
+        self.lottery = lottery
+        self.count_delegators = 0
+        self._eligible_delegators: List[Delegator] = []
+        self._live_stakes: List[np.ndarray] = []
+        self._first_amounts: List[np.ndarray] = []
+
+    def add_batch(self, delegators: List[Delegator]):
+        lottery = self.lottery
+        delegation_columns = DelegationColumns.from_delegators(delegators)
+        eligible_mask = delegation_columns.eligibility_mask(
+            lottery.pool_id, lottery.start_epoch, lottery.count_epochs)
+        eligible_mask &= delegation_columns.live_stake_mask(
+            lottery.lottery_strategy.min_live_stake)
+
+        eligible_columns = delegation_columns.take(eligible_mask)
+        self._eligible_delegators.extend(
+            Delegator(delegators[i].address_id, delegators[i].live_stake) for i in np.flatnonzero(eligible_mask))
+        self._live_stakes.append(eligible_columns.live_stake)
+        self._first_amounts.append(eligible_columns.first_delegation_amounts(
+            lottery.pool_id, lottery.count_epochs))
+        self.count_delegators += len(delegators)
+
+    def build(self, pool: Pool) -> List[LotteryTicket]:
+        return self.build_columns(pool).to_tickets(self.lottery.uuid)
+
+    def build_columns(self, pool: Pool) -> LotteryTicketColumns:
+        lottery = self.lottery
+        live_stake = np.concatenate(self._live_stakes) if self._live_stakes else np.zeros(0, dtype=np.int64)
+        first_amounts = np.concatenate(self._first_amounts) if self._first_amounts else np.zeros(0, dtype=np.int64)
+
+        lottery.lottery_strategy.init_strategy(
+            self._eligible_delegators, lottery.owners_allowed, lottery.uuid, pool, lottery.count_epochs,
+            delegation_columns=DelegationColumns.without_history(live_stake), first_amounts=first_amounts)
+        lottery.lottery_strategy.prepare_lottery()
+        return lottery.lottery_strategy.calculate_likelyhood_columns()
 
 
 def prepare_lottery_tickets_list(delegators: List[Delegator], lottery: Lottery, pool: Pool) -> List[LotteryTicket]:
@@ -442,21 +680,9 @@ def prepare_lottery_tickets_list(delegators: List[Delegator], lottery: Lottery,
     Get mean stake accros epochs by delegator
     :rtype: object
     """
-
-    eligible_delegators = [
-        delegator
-        for delegator in delegators
-        if is_eligible(delegator, pool.pool_id, lottery.start_epoch, lottery.count_epochs) and
-        is_live_stake_enough(delegator, pool.pool_id,
-                             lottery.lottery_strategy.min_live_stake)
-    ]
-
-    lottery.lottery_strategy.init_strategy(
-        eligible_delegators, lottery.owners_allowed, lottery.uuid, pool, lottery.count_epochs)
-    lottery.lottery_strategy.prepare_lottery()
-    lottery_tickets = lottery.lottery_strategy.calculate_likelyhood()
-
-    return lottery_tickets
+    lottery_tickets_builder = LotteryTicketsBuilder(lottery)
+    lottery_tickets_builder.add_batch(delegators)
+    return lottery_tickets_builder.build(pool)
 
 
 def create_lottery(lottery_tickets: List[LotteryTicket], target_pool_id: str) -> Lottery:
@@ -1,6 +1,18 @@
 from flask import Flask
 
+from spolottery.service_layer.cardano_service import AbstractCardanoService, BlockFrostCardanoService
+from spolottery.service_layer.dbsync_service import DbSyncCardanoService
+
 
 def create_app():
     app = Flask(__name__)
     return app
+
+
+def create_cardano_service(config) -> AbstractCardanoService:
+    """
+    Cardano service of the configured backend, one for the whole process
+    """
+    if config.get_cardano_backend() == "dbsync":
+        return DbSyncCardanoService.from_config(config)
+    return BlockFrostCardanoService(config)
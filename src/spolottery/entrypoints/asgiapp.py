@@ -0,0 +1,232 @@
+"""
+ASGI entrypoint, same routes as the Flask app on the same services.
+
+Requests are served concurrently on one event loop, which shares the
+Cardano service HTTP client. Blocking calls (database, audit, search) are
+offloaded to a bounded thread pool.
+
+    uvicorn spolottery.entrypoints.asgiapp:app --host 0.0.0.0 --port 5005
+"""
+import contextlib
+import json
+import logging
+from datetime import date
+from typing import Optional
+
+import anyio
+import bleach
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+from werkzeug.http import http_date
+
+import spolottery.config as config
+from spolottery.adapters import dto, engines, orm
+from spolottery.entrypoints import create_cardano_service
+from spolottery.service_layer import services, unit_of_work
+from spolottery.service_layer.cardano_service import AbstractCardanoService, BlockFrostCardanoService
+from spolottery.service_layer.lottery_jobs import LotteryJobWorkerPool
+from spolottery.service_layer.pool_search import PoolSearchIndex
+
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+class PoolsResponse(JSONResponse):
+    """
+    Dates rendered like the Flask app does
+    """
+
+    def render(self, content) -> bytes:
+        return json.dumps(content, default=self.render_date, separators=(",", ":")).encode("utf-8")
+
+    @staticmethod
+    def render_date(value):
+        if isinstance(value, date):
+            return http_date(value)
+        raise TypeError("Object of type {} is not JSON serializable".format(type(value).__name__))
+
+
+def json_response(model, status_code: int = 200, headers: Optional[dict] = None) -> Response:
+    return Response(model.json(), status_code=status_code, headers=headers, media_type="application/json")
+
+
+def error_response(message: str, status_code: int = 400) -> JSONResponse:
+    return JSONResponse({"message": message}, status_code=status_code)
+
+
+def create_asgi_app(session_factory=None, cardano_service: Optional[AbstractCardanoService] = None,
+                    start_workers: bool = True) -> Starlette:
+    """
+    App on the configured database and Cardano backend by default.
+    Mappers are only started when the app uses the configured database.
+    """
+    owns_database = session_factory is None
+    if owns_database:
+        session_factory = engines.get_session_factory()
+
+    def uow_factory() -> unit_of_work.SqlAlchemyUnitOfWork:
+        return unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+
+    state = {}
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        anyio.to_thread.current_default_thread_limiter().total_tokens = config.get_asgi_threadpool_size()
+        if owns_database:
+            orm.start_mappers()
+            await run_in_threadpool(orm.metadata.create_all, engines.get_engine())
+
+        state["cardano_service"] = cardano_service if cardano_service else create_cardano_service(config)
+        state["pool_search_index"] = PoolSearchIndex()
+        await run_in_threadpool(services.build_pool_search_index, uow_factory(), state["pool_search_index"])
+
+        lottery_job_workers = LotteryJobWorkerPool.from_config(config, uow_factory, state["cardano_service"])
+        if start_workers:
+            lottery_job_workers.start()
+        state["lottery_job_workers"] = lottery_job_workers
+        try:
+            yield
+        finally:
+            await run_in_threadpool(lottery_job_workers.stop)
+            if cardano_service is None:
+                await state["cardano_service"].aclose()
+
+    async def filter_pool(request: Request):
+        """
+        Search a pool
+        """
+        try:
+            pool_filter = bleach.clean((await request.json())["pool_filter"])
+            await run_in_threadpool(services.refresh_pool_search_index, uow_factory(), state["pool_search_index"],
+                                    config.pool_search_refresh_interval)
+            pools = await run_in_threadpool(
+                services.search_pool_index, pool_filter, state["pool_search_index"], config.pool_search_limit)
+        except Exception as e:
+            logger.exception(e)
+            return error_response(str(e))
+
+        return PoolsResponse({"pools": [p.serialize() for p in pools]})
+
+    async def create_lottery(request: Request):
+        """
+        Queue the creation of a lottery, its progress is at /lottery/jobs/<job_id>
+        """
+        logger.info("Create lottery")
+        try:
+            lottery_details = (await request.json())["lottery_details"]
+            # Sanitize input
+            lottery_details = {k: bleach.clean(v) if isinstance(v, str) else v
+                               for k, v in lottery_details.items()}
+
+            lottery_input_dto = dto.LotteryInputDto(**lottery_details)
+            lottery_job_dto = await run_in_threadpool(services.submit_lottery_job, lottery_input_dto, uow_factory())
+        except services.TooManyLotteryJobs as e:
+            logger.warning(e)
+            return error_response(str(e), 503)
+        except Exception as e:
+            logger.exception(e)
+            return error_response(str(e))
+
+        state["lottery_job_workers"].notify()
+        job_url = "/lottery/jobs/{}".format(lottery_job_dto.job_id)
+        return json_response(lottery_job_dto, 202, headers={"Location": job_url})
+
+    async def get_lottery_job(request: Request):
+        """
+        Phase and progress of a lottery creation, lottery_id once it succeeded
+        """
+        try:
+            lottery_job_dto = await run_in_threadpool(
+                services.get_lottery_job, request.path_params["job_id"], uow_factory())
+        except services.LotteryJobNotFound as e:
+            return error_response(str(e), 404)
+        except Exception as e:
+            logger.exception(e)
+            return error_response(str(e))
+
+        return json_response(lottery_job_dto)
+
+    async def get_lottery(request: Request):
+        """
+        Get a lottery, without its tickets and winners (see /tickets and /winners)
+        """
+        lottery_id = request.path_params["lottery_id"]
+        try:
+            logger.info("Get lottery : {}".format(lottery_id))
+            lottery_dto = await run_in_threadpool(services.get_lottery, lottery_id, uow_factory(), False)
+        except Exception as e:
+            logger.exception(e)
+            return error_response("No Lottery found")
+
+        return json_response(lottery_dto)
+
+    def lottery_page(get_page):
+        async def page(request: Request):
+            """
+            Page of a lottery tickets or winners : ?after=<next_cursor>&limit=1000
+            """
+            try:
+                after = request.query_params.get("after")
+                after = int(after) if after is not None else None
+                limit = min(int(request.query_params.get("limit", config.lottery_page_size)),
+                            config.max_lottery_page_size)
+                page_dto = await run_in_threadpool(
+                    get_page, request.path_params["lottery_id"], uow_factory(), after, limit)
+            except (ValueError, services.InvalidLottery) as e:
+                return error_response(str(e))
+            except Exception as e:
+                logger.exception(e)
+                return error_response("No Lottery found")
+
+            return json_response(page_dto)
+        return page
+
+    async def audit_lottery(request: Request):
+        """
+        Monte Carlo fairness audit of a lottery
+        """
+        lottery_id = request.path_params["lottery_id"]
+        try:
+            logger.info("Audit lottery : {}".format(lottery_id))
+            trials = min(int(request.query_params.get("trials", config.max_audit_trials_api)),
+                         config.max_audit_trials_api)
+            lottery_audit_dto = await run_in_threadpool(
+                services.audit_lottery, lottery_id, uow_factory(), trials, max_workers=1)
+        except Exception as e:
+            logger.exception(e)
+            return error_response(str(e))
+
+        return json_response(lottery_audit_dto)
+
+    def blockfrost_metrics(metrics_name: str):
+        async def metrics(request: Request):
+            service = state["cardano_service"]
+            if not isinstance(service, BlockFrostCardanoService):
+                return error_response("Not available with this Cardano backend", 404)
+            return JSONResponse(getattr(service, metrics_name)())
+        return metrics
+
+    async def db_pool_metrics(request: Request):
+        return JSONResponse(engines.pool_metrics())
+
+    routes = [
+        Route("/pool/filter", filter_pool, methods=["POST"]),
+        Route("/lottery", create_lottery, methods=["POST"]),
+        Route("/lottery/jobs/{job_id}", get_lottery_job, methods=["GET"]),
+        Route("/lottery/{lottery_id}", get_lottery, methods=["GET"]),
+        Route("/lottery/{lottery_id}/tickets", lottery_page(services.get_lottery_tickets), methods=["GET"]),
+        Route("/lottery/{lottery_id}/winners", lottery_page(services.get_lottery_winners), methods=["GET"]),
+        Route("/lottery/{lottery_id}/audit", audit_lottery, methods=["GET"]),
+        Route("/metrics/http", blockfrost_metrics("http_metrics"), methods=["GET"]),
+        Route("/metrics/single_flight", blockfrost_metrics("single_flight_metrics"), methods=["GET"]),
+        Route("/metrics/delegators_cache", blockfrost_metrics("delegators_cache_metrics"), methods=["GET"]),
+        Route("/metrics/db_pool", db_pool_metrics, methods=["GET"]),
+    ]
+    return Starlette(routes=routes, lifespan=lifespan)
+
+
+app = create_asgi_app()
@@ -0,0 +1,110 @@
+import argparse
+import asyncio
+import logging
+import signal
+from datetime import datetime, timedelta, timezone
+
+import spolottery.config as config
+from spolottery.adapters import orm
+from spolottery.domain import models
+from spolottery.entrypoints import create_cardano_service
+from spolottery.service_layer import services, unit_of_work
+from spolottery.service_layer.lottery_jobs import LotteryJobWorkerPool
+from spolottery.service_layer.snapshot_service import SnapshotCardanoService
+
+
+def audit(args):
+    lottery_audit_dto = services.audit_lottery(
+        args.lottery_id,
+        unit_of_work.SqlAlchemyUnitOfWork(),
+        args.trials,
+        batch_size=args.batch_size,
+        max_workers=args.workers,
+    )
+    print(lottery_audit_dto.json(indent=2))
+
+
+async def _snapshot_lottery(args, uow_factory=unit_of_work.SqlAlchemyUnitOfWork):
+    cardano_service = SnapshotCardanoService.from_file(args.snapshot, args.format, mainnet=not args.testnet)
+    # The database may never have been synced from Blockfrost : pools of the snapshot, without metadata
+    await services.add_pools(uow_factory(), cardano_service)
+    start_epoch = args.start_epoch
+    if start_epoch is None:
+        start_epoch = await cardano_service.get_current_epoch()
+    draw_date = args.draw_date or (datetime.now(timezone.utc) + timedelta(days=1)).isoformat()
+    return await services.create_lottery(
+        args.pool_id, start_epoch, start_epoch, args.count_epochs, draw_date, args.strategy,
+        args.owners_allowed, args.min_live_stake, args.name, uow_factory(),
+        cardano_service, winners_count=args.winners)
+
+
+def snapshot_lottery(args):
+    lottery_dto = asyncio.run(_snapshot_lottery(args))
+    print(lottery_dto.json(indent=2))
+
+
+def lottery_worker(args):
+    cardano_service = create_cardano_service(config)
+    worker_pool = LotteryJobWorkerPool.from_config(config, unit_of_work.SqlAlchemyUnitOfWork, cardano_service)
+    worker_pool.workers = args.workers
+    # Blocked before the threads start so only sigwait receives them
+    stop_signals = {signal.SIGINT, signal.SIGTERM}
+    signal.pthread_sigmask(signal.SIG_BLOCK, stop_signals)
+    worker_pool.start()
+    try:
+        signal.sigwait(stop_signals)
+    finally:
+        # Running jobs are finished, the queued ones are left to the next worker
+        worker_pool.stop()
+        cardano_service.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="spolottery")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    audit_parser = subparsers.add_parser(
+        "audit", help="Monte Carlo fairness audit of a stored lottery")
+    audit_parser.add_argument("lottery_id")
+    audit_parser.add_argument("--trials", type=int, default=1_000_000)
+    audit_parser.add_argument("--batch-size", type=int, default=1_000_000)
+    audit_parser.add_argument("--workers", type=int, default=None,
+                              help="Processes used for the draws (default: CPU count)")
+    audit_parser.set_defaults(func=audit)
+
+    snapshot_parser = subparsers.add_parser(
+        "snapshot-lottery", help="Create a lottery from a stake snapshot file instead of Blockfrost")
+    snapshot_parser.add_argument("snapshot", help="CSV, JSON Lines or ledger-state JSON, optionally .gz")
+    snapshot_parser.add_argument("pool_id")
+    snapshot_parser.add_argument("--format", choices=["csv", "jsonl", "ledger-state"], default=None,
+                                 help="Snapshot format (default: guessed from the file extension)")
+    snapshot_parser.add_argument("--testnet", action="store_true",
+                                 help="Ledger state stake addresses are testnet ones")
+    snapshot_parser.add_argument("--name", default="Snapshot lottery")
+    snapshot_parser.add_argument("--strategy", default=models.LotteryStrategyType.STAKE.value,
+                                 choices=[strategy.value for strategy in models.LotteryStrategyType])
+    snapshot_parser.add_argument("--start-epoch", type=int, default=None,
+                                 help="Default: latest epoch of the snapshot")
+    snapshot_parser.add_argument("--count-epochs", type=int, default=1)
+    snapshot_parser.add_argument("--draw-date", default=None, help="ISO format (default: in one day)")
+    snapshot_parser.add_argument("--winners", type=int, default=None)
+    snapshot_parser.add_argument("--min-live-stake", type=int, default=0)
+    snapshot_parser.add_argument("--owners-allowed", action="store_true")
+    snapshot_parser.set_defaults(func=snapshot_lottery)
+
+    worker_parser = subparsers.add_parser(
+        "lottery-worker", help="Create the queued lotteries, until SIGINT or SIGTERM")
+    worker_parser.add_argument("--workers", type=int, default=config.get_lottery_job_workers() or 2,
+                               help="Lotteries created at once")
+    worker_parser.set_defaults(func=lottery_worker)
+
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    orm.start_mappers()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,30 +1,60 @@
+import atexit
 import json
 import logging
 import traceback
+from typing import Optional
+
 import bleach
 from flask import request, jsonify
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from spolottery.entrypoints import create_app
+from spolottery.entrypoints import create_app, create_cardano_service
 
 import spolottery.config as config
-from spolottery.adapters import dto, orm
-from spolottery.adapters import repository
+from spolottery.adapters import dto, engines, orm
 from spolottery.service_layer import services, unit_of_work
 # from tests.conftest import wait_for_postgres_to_come_up
-from spolottery.service_layer.cardano_service import BlockFrostCardanoService
+from spolottery.service_layer.cardano_service import AbstractCardanoService, BlockFrostCardanoService
+from spolottery.service_layer.lottery_jobs import LotteryJobWorkerPool
+from spolottery.service_layer.pool_search import PoolSearchIndex
 
 orm.start_mappers()
-get_session = sessionmaker(bind=create_engine(config.get_postgres_uri()))
-engine = create_engine(config.get_postgres_uri())
-# wait_for_postgres_to_come_up(engine)
-orm.metadata.create_all(engine)
 app = create_app()
 
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Set by start_app in the serving process : threads started and connections
+# opened at import would stay in the master process of a pre-forking server
+cardano_service = None  # type: Optional[AbstractCardanoService]
+lottery_job_workers = None  # type: Optional[LotteryJobWorkerPool]
+pool_search_index = None  # type: Optional[PoolSearchIndex]
+
+
+@app.before_first_request
+def start_app():
+    """
+    Database schema, Cardano service, lottery jobs workers and pools search
+    index of this process
+    """
+    global cardano_service, lottery_job_workers, pool_search_index
+    engine = engines.get_engine()
+    # wait_for_postgres_to_come_up(engine)
+    orm.metadata.create_all(engine)
+
+    # One cardano service (and pooled HTTP client or engine) for the whole process
+    cardano_service = create_cardano_service(config)
+    atexit.register(cardano_service.close)
+
+    # Lotteries are created in the background, the queue is shared by every process
+    lottery_job_workers = LotteryJobWorkerPool.from_config(
+        config, unit_of_work.SqlAlchemyUnitOfWork, cardano_service)
+    lottery_job_workers.start()
+    atexit.register(lottery_job_workers.stop)
+
+    pool_search_index = PoolSearchIndex()
+    services.build_pool_search_index(
+        unit_of_work.SqlAlchemyUnitOfWork(), pool_search_index)
+
 
 @app.route("/pool/filter", methods=["POST"])
 def filter_pool():
@@ -36,9 +66,15 @@ def filter_pool():
 
     try:
         pool_filter = bleach.clean(request.json["pool_filter"])
-        pools = services.search_pool(
+        services.refresh_pool_search_index(
+            unit_of_work.SqlAlchemyUnitOfWork(),
+            pool_search_index,
+            config.pool_search_refresh_interval
+        )
+        pools = services.search_pool_index(
             pool_filter,
-            unit_of_work.SqlAlchemyUnitOfWork()
+            pool_search_index,
+            config.pool_search_limit
         )
     except Exception as e:
         logger.exception(e)
@@ -48,13 +84,12 @@ def filter_pool():
 
 
 @app.route("/lottery", methods=["POST"])
-async def create_lottery():
+def create_lottery():
     """
-    Create a lottery
+    Queue the creation of a lottery, its progress is at /lottery/jobs/<job_id>
     """
     logger.info("Create lottery")
     uow = unit_of_work.SqlAlchemyUnitOfWork()
-    cardano_service = BlockFrostCardanoService(config)
     try:
 
         lottery_details = request.json["lottery_details"]
@@ -63,39 +98,144 @@ async def create_lottery():
                            for k, v in lottery_details.items()}
 
         lottery_input_dto = dto.LotteryInputDto(**lottery_details)
-        pool_id = lottery_input_dto.pool_id
-        start_epoch = lottery_input_dto.start_epoch
-        end_epoch = lottery_input_dto.end_epoch
-        count_epochs = lottery_input_dto.count_epochs
-        draw_date = lottery_input_dto.draw_date
-        lottery_strategy_name = lottery_input_dto.lottery_strategy_name
-        owners_allowed = lottery_input_dto.owners_allowed
-        lottery_name = lottery_input_dto.lottery_name
-        min_live_stake = lottery_input_dto.min_live_stake
-
-        lottery_dto = await services.create_lottery(pool_id, start_epoch, end_epoch, count_epochs,
-                                                    draw_date, lottery_strategy_name, owners_allowed, min_live_stake,
-                                                    lottery_name, uow, cardano_service)
+        lottery_job_dto = services.submit_lottery_job(lottery_input_dto, uow)
+    except services.TooManyLotteryJobs as e:
+        logger.warning(e)
+        return {"message": str(e)}, 503
     except Exception as e:
         logger.exception(e)
         return {"message": str(e)}, 400
 
-    return lottery_dto.json(), 201
+    lottery_job_workers.notify()
+    job_url = "/lottery/jobs/{}".format(lottery_job_dto.job_id)
+    return lottery_job_dto.json(), 202, {"Location": job_url}
+
+
+@app.route("/lottery/jobs/<string:job_id>", methods=["GET"])
+def get_lottery_job(job_id):
+    """
+    Phase and progress of a lottery creation, lottery_id once it succeeded
+    """
+    try:
+        lottery_job_dto = services.get_lottery_job(job_id, unit_of_work.SqlAlchemyUnitOfWork())
+    except services.LotteryJobNotFound as e:
+        return {"message": str(e)}, 404
+    except Exception as e:
+        logger.exception(e)
+        return {"message": str(e)}, 400
+
+    return lottery_job_dto.json(), 200
 
 
 @app.route("/lottery/<string:lottery_id>", methods=["GET"])
-async def get_lottery(lottery_id):
+def get_lottery(lottery_id):
     """
-    Get a lottery
+    Get a lottery, without its tickets and winners (see /tickets and /winners)
     """
-    lottery = ""
     try:
         logger.info("Get lottery : {}".format(lottery_id))
-        session = get_session()
-        lottery_repo = repository.SqlAlchemyLotteryRepository(session)
-        lottery_dto = await services.get_lottery(lottery_id, lottery_repo, True)
+        lottery_dto = services.get_lottery(
+            lottery_id, unit_of_work.SqlAlchemyUnitOfWork(), False)
     except Exception as e:
         logger.exception(e)
         return {"message": "No Lottery found"}, 400
 
     return lottery_dto.json(), 200
+
+
+def page_args():
+    after = request.args.get("after", type=int)
+    limit = min(request.args.get("limit", config.lottery_page_size, type=int), config.max_lottery_page_size)
+    return after, limit
+
+
+@app.route("/lottery/<string:lottery_id>/tickets", methods=["GET"])
+def get_lottery_tickets(lottery_id):
+    """
+    Tickets of a lottery by pages : ?after=<next_cursor>&limit=1000
+    """
+    try:
+        after, limit = page_args()
+        tickets_page_dto = services.get_lottery_tickets(
+            lottery_id, unit_of_work.SqlAlchemyUnitOfWork(), after, limit)
+    except services.InvalidLottery as e:
+        return {"message": str(e)}, 400
+    except Exception as e:
+        logger.exception(e)
+        return {"message": "No Lottery found"}, 400
+
+    return tickets_page_dto.json(), 200
+
+
+@app.route("/lottery/<string:lottery_id>/winners", methods=["GET"])
+def get_lottery_winners(lottery_id):
+    """
+    Winners of a lottery by rank and by pages : ?after=<next_cursor>&limit=1000
+    """
+    try:
+        after, limit = page_args()
+        winners_page_dto = services.get_lottery_winners(
+            lottery_id, unit_of_work.SqlAlchemyUnitOfWork(), after, limit)
+    except services.InvalidLottery as e:
+        return {"message": str(e)}, 400
+    except Exception as e:
+        logger.exception(e)
+        return {"message": "No Lottery found"}, 400
+
+    return winners_page_dto.json(), 200
+
+
+@app.route("/lottery/<string:lottery_id>/audit", methods=["GET"])
+def audit_lottery(lottery_id):
+    """
+    Monte Carlo fairness audit of a lottery
+    """
+    try:
+        logger.info("Audit lottery : {}".format(lottery_id))
+        trials = min(int(request.args.get("trials", config.max_audit_trials_api)),
+                     config.max_audit_trials_api)
+        lottery_audit_dto = services.audit_lottery(
+            lottery_id, unit_of_work.SqlAlchemyUnitOfWork(), trials, max_workers=1)
+    except Exception as e:
+        logger.exception(e)
+        return {"message": str(e)}, 400
+
+    return lottery_audit_dto.json(), 200
+
+
+@app.route("/metrics/http", methods=["GET"])
+def http_metrics():
+    """
+    Cardano service HTTP connection pool metrics
+    """
+    if not isinstance(cardano_service, BlockFrostCardanoService):
+        return {"message": "Not available with this Cardano backend"}, 404
+    return jsonify(cardano_service.http_metrics())
+
+
+@app.route("/metrics/single_flight", methods=["GET"])
+def single_flight_metrics():
+    """
+    Cardano service coalesced requests metrics
+    """
+    if not isinstance(cardano_service, BlockFrostCardanoService):
+        return {"message": "Not available with this Cardano backend"}, 404
+    return jsonify(cardano_service.single_flight_metrics())
+
+
+@app.route("/metrics/delegators_cache", methods=["GET"])
+def delegators_cache_metrics():
+    """
+    Cardano service delegators snapshots cache metrics
+    """
+    if not isinstance(cardano_service, BlockFrostCardanoService):
+        return {"message": "Not available with this Cardano backend"}, 404
+    return jsonify(cardano_service.delegators_cache_metrics())
+
+
+@app.route("/metrics/db_pool", methods=["GET"])
+def db_pool_metrics():
+    """
+    Database connection pools metrics
+    """
+    return jsonify(engines.pool_metrics())
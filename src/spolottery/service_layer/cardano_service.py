@@ -2,14 +2,19 @@ from http import HTTPStatus
 import abc
 import asyncio
 import datetime
-from functools import wraps
+from functools import partial, wraps
 import logging
 import pprint
-from typing import Coroutine, List, Sequence
+from typing import AsyncIterator, Callable, Coroutine, Dict, List, Optional, Sequence, Set
 from spolottery.domain import models
-from blockfrost import BlockFrostApi, ApiUrls, ApiError
+from blockfrost import BlockFrostApi
 from aiohttp import ClientSession
 import httpx
+from spolottery.service_layer.http_client import HttpClientManager
+from spolottery.service_layer.rate_limiter import TokenBucket, backoff_delay, parse_retry_after
+from spolottery.service_layer.single_flight import SingleFlight
+from spolottery.service_layer.epoch_clock import EpochClock
+from spolottery.service_layer.delegators_cache import DelegatorsSnapshot, DelegatorsSnapshotCache
 
 log = logging.getLogger(__name__)
 
@@ -18,73 +23,231 @@ class MaxPoolDelegators(Exception):
     pass
 
 
-async def make_one_request(url: str, num: int, headers: dict, params: dict, limit, id, client) -> dict:
+async def make_one_request(url: str, num: int, headers: dict, params: dict, rate_limiter: TokenBucket, id, client,
+                           max_retries: int = 5) -> dict:
 
-    # No more than 3 concurrent workers will be able to make
-    # get request at the same time.
-    async with limit:
-        log.info(f"Making request {num}")
+    for attempt in range(max_retries + 1):
+        # Every request, whatever its path, takes a token of the shared bucket
+        await rate_limiter.acquire()
+        log.debug(f"Making request {num}")
 
         r = await client.get(url, params=params, headers=headers)
 
-        # When workers hit the limit, they'll wait for a second
-        # before making more requests.
-        if limit.locked():
-            log.info("Concurrency limit reached, waiting ...")
-            await asyncio.sleep(1)
-
         if r.status_code == HTTPStatus.OK:
             return {"result": r, "id": id}
 
+        if r.status_code != HTTPStatus.TOO_MANY_REQUESTS or attempt == max_retries:
+            break
+
+        # Over quota : every fetch path backs off, not only this request
+        delay = backoff_delay(
+            attempt, parse_retry_after(r.headers.get("Retry-After")))
+        log.info(f"Rate limited on request {num}, retrying in {delay:.2f}s")
+        rate_limiter.pause(delay)
+
     raise ValueError(
         f"Unexpected Status: Http status code is {r.status_code}.",
     )
 
 
-async def prepare_delegators_requests(url: str, delegators: List[models.Delegator], headers: dict, params: dict) -> list[httpx.Response]:
+async def fetch_account_history(url: str, address_id: str, headers: dict, client: HttpClientManager,
+                                rate_limiter: TokenBucket, since_epoch: Optional[int] = None,
+                                window: Optional[models.HistoryWindow] = None, page_size: int = 100) -> dict:
+    """
+    Page through one account history, newest epoch first.
+    Stops at the last page, at since_epoch (already known), or, without
+    since_epoch, as soon as the lottery window is covered : "complete" is then
+    False, the delegations only hold the history from their oldest epoch.
+    The first page is always read entirely.
+    """
+    delegations = []
+    page = 1
+    while True:
+        params = {'count': page_size, 'page': page, 'order': 'desc'}
+        response = await make_one_request(url, page, headers, params, rate_limiter, address_id, client)
+        history_page = response['result'].json()
+
+        for history in history_page:
+            if since_epoch is not None and history['active_epoch'] <= since_epoch:
+                return {"result": delegations, "id": address_id, "complete": True}
+            delegations.append(models.Delegation(pool_id=history['pool_id'], amount=history['amount'],
+                                                 epoch_no=history['active_epoch']))
+
+        if len(history_page) < page_size:
+            return {"result": delegations, "id": address_id, "complete": True}
+        # Newer epochs than a stored history are all needed : no gap before since_epoch
+        if since_epoch is None and window is not None and window.is_covered(delegations):
+            return {"result": delegations, "id": address_id, "complete": False}
+        page += 1
+
+
+async def prepare_delegators_requests(url: str, delegators: List[models.Delegator], headers: dict,
+                                      client: HttpClientManager, rate_limiter: TokenBucket,
+                                      since_epochs: Dict[str, int],
+                                      window: Optional[models.HistoryWindow],
+                                      single_flight: Optional[SingleFlight] = None,
+                                      epoch: Optional[int] = None) -> list[dict]:
     tasks = []
-    i = 0
-    limit = asyncio.Semaphore(25)
-    transport = httpx.AsyncHTTPTransport(retries=3)
-    client = httpx.AsyncClient(transport=transport)
     for delegator in delegators:
-        i = i + 1
         url_delegator = f"{url}{delegator.address_id}/history"
-        task = asyncio.create_task(make_one_request(
-            url_delegator, i, headers, params, limit, delegator.address_id, client))
+        since_epoch = since_epochs.get(delegator.address_id)
+        fetch = partial(fetch_account_history, url_delegator, delegator.address_id, headers, client,
+                        rate_limiter, since_epoch, window)
+        if single_flight is None:
+            task = asyncio.create_task(fetch())
+        else:
+            # Lotteries on the same pool at the same epoch share the history requests
+            key = ("history", delegator.address_id, epoch, since_epoch, window)
+            task = asyncio.create_task(single_flight.do(key, fetch))
         tasks.append(task)
 
-    results = await asyncio.gather(*tasks)
+    results = await asyncio.gather(*tasks, return_exceptions=True)
 
     return results
 
 
-async def prepare_pool_metadata_requests(url: str, pools: List[models.Pool], headers: dict, params: dict) -> list[httpx.Response]:
-    tasks = []
-    i = 0
-    limit = asyncio.Semaphore(10)
-    client = httpx.AsyncClient()
-    for pool_id in pools:
-        i = i + 1
-        url_delegator = f"{url}/pools/{pool_id}/metadata"
-        task = asyncio.create_task(make_one_request(
-            url_delegator, i, headers, params, limit, pool_id, client))
-        tasks.append(task)
+async def iter_pages(url: str, headers: dict, client: HttpClientManager, rate_limiter: TokenBucket,
+                     page_size: int = 100, concurrent_pages: int = 10,
+                     single_flight: Optional[SingleFlight] = None, key: tuple = ()) -> AsyncIterator[list]:
+    """
+    Yield the pages of a paginated endpoint in order, pages requested by
+    groups of "concurrent_pages", until a short page.
+    With a single flight, concurrent requests of the same key + page are coalesced.
+    """
+    async def fetch_page(page: int) -> list:
+        response = await make_one_request(url, page, headers, {'count': page_size, 'page': page},
+                                          rate_limiter, page, client)
+        return response['result'].json()
+
+    def request_page(page: int):
+        if single_flight is None:
+            return fetch_page(page)
+        return single_flight.do(key + (page,), partial(fetch_page, page))
+
+    page = 1
+    while True:
+        pages = range(page, page + concurrent_pages)
+        pages_items = await asyncio.gather(*[request_page(p) for p in pages])
+        for items in pages_items:
+            if items:
+                yield items
+            if len(items) < page_size:
+                return
+        page += concurrent_pages
+
+
+async def fetch_pool_ids(url: str, headers: dict, client: HttpClientManager, rate_limiter: TokenBucket,
+                         page_size: int = 100, concurrent_pages: int = 10) -> List[str]:
+    """
+    Every registered pool id
+    """
+    pool_ids = []
+    async for pool_ids_page in iter_pages(f"{url}/pools", headers, client, rate_limiter, page_size, concurrent_pages):
+        pool_ids.extend(pool_ids_page)
+    return pool_ids
+
+
+async def fetch_pool(url: str, pool_id: str, headers: dict, client: HttpClientManager,
+                     rate_limiter: TokenBucket) -> Optional[models.Pool]:
+    """
+    Pool metadata then owners, None for pools without metadata
+    """
+    response = await make_one_request(f"{url}/pools/{pool_id}/metadata", pool_id, headers, {}, rate_limiter,
+                                      pool_id, client)
+    pm = response['result'].json()
+    if "pool_id" not in pm:
+        log.info("No metada for this pool : {}".format(pool_id))
+        return None
+
+    pool = models.Pool(pool_id=pm["pool_id"], hex=pm["hex"], url=pm["url"],
+                       ticker=pm["ticker"], name=pm["name"], description=pm["description"],
+                       updated_at=datetime.datetime.utcnow())
+
+    response = await make_one_request(f"{url}/pools/{pool_id}", pool_id, headers, {}, rate_limiter, pool_id, client)
+    for owner in response['result'].json().get("owners", []):
+        pool.add_pool_owner(models.PoolOwner(address_id=owner, pool_id=pool.pool_id))
+
+    return pool
+
+
+async def fetch_pools(url: str, pool_ids: List[str], headers: dict, client: HttpClientManager,
+                      rate_limiter: TokenBucket, workers: int,
+                      progress: Optional[Callable[[int, int], None]] = None) -> List[models.Pool]:
+    """
+    Bounded pipeline : "workers" coroutines share the pool ids and handle
+    each pool as soon as its responses arrive
+    """
+    pools = []
+    count_done = 0
+    pending_pool_ids = iter(pool_ids)
+
+    async def worker():
+        nonlocal count_done
+        for pool_id in pending_pool_ids:
+            try:
+                pool = await fetch_pool(url, pool_id, headers, client, rate_limiter)
+                if pool is not None:
+                    pools.append(pool)
+            except Exception as e:
+                log.error("Pool {} not synchronized : {}".format(pool_id, e))
+            count_done += 1
+            if progress is not None:
+                progress(count_done, len(pool_ids))
 
-    results = await asyncio.gather(*tasks)
+    await asyncio.gather(*[worker() for _ in range(min(workers, len(pool_ids)))])
 
-    return results
+    return pools
+
+
+def log_progress(count_done: int, count_total: int):
+    if count_done == count_total or count_done % 100 == 0:
+        log.info("{}/{} pools synchronized".format(count_done, count_total))
 
 
 class AbstractCardanoService(abc.ABC):
     @abc.abstractmethod
-    async def get_all_pools(self, pool_stored: List[models.Pool]) -> List[models.Pool]:
+    async def get_all_pools(self, pool_ids_stored: Set[str],
+                            progress: Optional[Callable[[int, int], None]] = None) -> List[models.Pool]:
+        """
+        Pools not in pool_ids_stored, progress(count_done, count_total) is called as pools are handled
+        """
         raise NotImplementedError
 
     async def get_pool_delegators(self, pool_id: str) -> List[models.Delegator]:
         raise NotImplementedError
 
-    async def get_delegators_history(self, delegators: List[models.Delegator]) -> List[models.Delegator]:
+    async def iter_pool_delegators(self, pool_id: str, batch_size: int) -> AsyncIterator[List[models.Delegator]]:
+        """
+        Delegators of the pool by batches of at most batch_size.
+        Default : batches of get_pool_delegators, services able to page
+        through the delegators should stream them instead.
+        """
+        delegators = await self.get_pool_delegators(pool_id)
+        for i in range(0, len(delegators), batch_size):
+            yield delegators[i:i + batch_size]
+
+    async def iter_delegators_history(self, delegators_batches: AsyncIterator[List[models.Delegator]],
+                                      since_epochs: Optional[Dict[str, int]] = None,
+                                      window: Optional[models.HistoryWindow] = None
+                                      ) -> AsyncIterator[List[models.Delegator]]:
+        """
+        Yield each batch of delegators as soon as their histories are attached,
+        see get_delegators_history. since_epochs may be filled while batches are consumed.
+        """
+        async for delegators in delegators_batches:
+            yield await self.get_delegators_history(delegators, since_epochs, window)
+
+    async def get_delegators_history(self, delegators: List[models.Delegator],
+                                     since_epochs: Optional[Dict[str, int]] = None,
+                                     window: Optional[models.HistoryWindow] = None) -> List[models.Delegator]:
+        """
+        Add to each delegator history the delegations newer than since_epochs[address_id]
+        (the whole history for addresses missing from since_epochs, or only what
+        the lottery window needs)
+        """
+        raise NotImplementedError
+
+    async def get_current_epoch(self) -> int:
         raise NotImplementedError
 
 
@@ -92,76 +255,61 @@ class BlockFrostCardanoService(AbstractCardanoService):
 
     counter = 0
 
-    def __init__(self, config):
+    def __init__(self, config, http_client: Optional[HttpClientManager] = None,
+                 rate_limiter: Optional[TokenBucket] = None, single_flight: Optional[SingleFlight] = None,
+                 epoch_clock: Optional[EpochClock] = None,
+                 delegators_cache: Optional[DelegatorsSnapshotCache] = None):
+        self.http_client = http_client if http_client else HttpClientManager.from_config(
+            config)
+        self.rate_limiter = rate_limiter if rate_limiter else TokenBucket(
+            config.get_blockfrost_requests_per_second(), config.get_blockfrost_burst())
+        self.single_flight = single_flight if single_flight else SingleFlight()
+        self.epoch_clock = epoch_clock if epoch_clock else EpochClock.from_config(
+            config)
+        self.delegators_cache = delegators_cache if delegators_cache else DelegatorsSnapshotCache(
+            self.epoch_clock, config.get_delegators_cache_max_bytes())
         self.api = BlockFrostApi(
             project_id=config.get_blockfrost_project_id(),
             # or export environment variable BLOCKFROST_PROJECT_ID
-            # optional: pass base_url or export BLOCKFROST_API_URL to use testnet, defaults to ApiUrls.mainnet.value
-            base_url=ApiUrls.mainnet.value,
+            # BLOCKFROST_API_URL to use testnet or a local stand-in, defaults to mainnet
+            base_url=config.get_blockfrost_api_url(),
         )
-        self.api_account_url = ApiUrls.mainnet.value + "/v0/accounts/"
-        self.api_pool_metadata_url = ApiUrls.mainnet.value + "/v0/"
+        self.api_url = config.get_blockfrost_api_url() + "/v0"
+        self.api_account_url = self.api_url + "/accounts/"
         self.max_delegators_allowed = config.max_delegators_allowed
 
-    async def get_all_pools(self, pool_stored: List[models.Pool]) -> List[models.Pool]:
-        pools = []
-        try:
-
-            pools_ids = self.api.pools(page=1, gather_pages=True)
-            i = 0
-
-            # Delete pools id already stored
-            pool_ids_stored = [pool.pool_id for pool in pool_stored]
-
-            count_fresh_pool_ids = len(pools_ids)
-            pools_ids = [
-                pool_id for pool_id in pools_ids if pool_id not in pool_ids_stored]
-            log.info("{} pools already encoded".format(
-                count_fresh_pool_ids - len(pools_ids)))
+    async def aclose(self):
+        await self.http_client.aclose()
 
-            blockfrost_url = self.api_pool_metadata_url
-            default_headers = {'project_id': self.api.project_id,
-                               'User-Agent': 'blockfrost-python 0.3.0'}
-            query_parameters = {'count': 50, "order": "desc"}
+    def close(self):
+        self.http_client.close()
 
-            pools_metadata = await prepare_pool_metadata_requests(blockfrost_url, pools_ids,
-                                                                  default_headers, query_parameters)
-            log.info("{} pools metadata found".format(len(pools_metadata)))
+    def http_metrics(self) -> dict:
+        return self.http_client.serialize_metrics()
 
-            # for pool_metadata in pools_metadata:
-            #     pm = pool_metadata['result'].json()
-            #     if "pool_id" in pm:
-            #         p = models.Pool(pool_id=pm["pool_id"], hex=pm["hex"], url=pm["url"],
-            #                         ticker=pm["ticker"], name=pm["name"], description=pm["description"],
-            #                         updated_at=datetime.datetime.utcnow())
+    def single_flight_metrics(self) -> dict:
+        return self.single_flight.serialize_metrics()
 
-            for pool_metadata in pools_metadata:
-                pm = pool_metadata['result'].json()
+    def delegators_cache_metrics(self) -> dict:
+        return self.delegators_cache.serialize_metrics()
 
-                if "pool_id" in pm:
-                    p = models.Pool(pool_id=pm["pool_id"], hex=pm["hex"], url=pm["url"],
-                                    ticker=pm["ticker"], name=pm["name"], description=pm["description"],
-                                    updated_at=datetime.datetime.utcnow())
-
-                    pool_with_owners = self.api.pool(
-                        pool_id=pm["pool_id"], page=1, gather_pages=True)
-
-                    owners = []
-
-                    if hasattr(pool_with_owners, "pool_id") and hasattr(pool_with_owners, "owners"):
-                        for po in pool_with_owners.owners:
-                            p.add_pool_owner(models.PoolOwner(
-                                address_id=po, pool_id=pool_with_owners.pool_id))
+    async def get_all_pools(self, pool_ids_stored: Set[str],
+                            progress: Optional[Callable[[int, int], None]] = log_progress) -> List[models.Pool]:
+        default_headers = {'project_id': self.api.project_id,
+                           'User-Agent': 'blockfrost-python 0.3.0'}
 
-                    pools.append(p)
-                else:
-                    log.info("No metada for this pool : {}".format(
-                        pool_metadata['id']))
+        pools_ids = await fetch_pool_ids(self.api_url, default_headers, self.http_client, self.rate_limiter)
 
-                i = i+1
+        # Delete pools id already stored
+        count_fresh_pool_ids = len(pools_ids)
+        pools_ids = [
+            pool_id for pool_id in pools_ids if pool_id not in pool_ids_stored]
+        log.info("{} pools already encoded".format(
+            count_fresh_pool_ids - len(pools_ids)))
 
-        except ApiError as e:
-            log.exception(e)
+        pools = await fetch_pools(self.api_url, pools_ids, default_headers, self.http_client, self.rate_limiter,
+                                  workers=self.http_client.max_connections, progress=progress)
+        log.info("{} pools metadata found".format(len(pools)))
 
         return pools
 
@@ -169,44 +317,88 @@ class BlockFrostCardanoService(AbstractCardanoService):
         delegators = []
 
         try:
-
-            pool_delegators = self.api.pool_delegators(
-                pool_id, page=1, gather_pages=True)
-            count_delegators = len(pool_delegators)
-            if count_delegators > self.max_delegators_allowed:
-                raise MaxPoolDelegators(
-                    "The maximum numbers of delegators has been reached : {} - {}".format(count_delegators, pool_id))
-            for delegator in pool_delegators:
-                delegators.append(models.Delegator(
-                    address_id=delegator.address, live_stake=int(delegator.live_stake)))
-
-        except ApiError as e:
+            async for delegators_batch in self.iter_pool_delegators(pool_id, self.max_delegators_allowed + 1):
+                delegators.extend(delegators_batch)
+                count_delegators = len(delegators)
+                if count_delegators > self.max_delegators_allowed:
+                    raise MaxPoolDelegators(
+                        "The maximum numbers of delegators has been reached : {} - {}".format(count_delegators, pool_id))
+
+        except ValueError as e:
             log.exception(e)
+            delegators = []
 
         return delegators
 
-    async def get_delegators_history(self, delegators: List[models.Delegator]) -> List[models.Delegator]:
-        blockfrost_url = self.api_account_url
+    async def iter_pool_delegators(self, pool_id: str, batch_size: int) -> AsyncIterator[List[models.Delegator]]:
+        # Delegators and live stakes only change at epoch boundaries
+        snapshot = self.delegators_cache.get(pool_id)
+        if snapshot is not None:
+            for delegators in snapshot.batches(batch_size):
+                yield delegators
+            return
+
         default_headers = {'project_id': self.api.project_id,
                            'User-Agent': 'blockfrost-python 0.3.0'}
-        query_parameters = {'count': 50, "order": "desc"}
 
-        account_delegations_histories = await prepare_delegators_requests(blockfrost_url, delegators,
-                                                                          default_headers, query_parameters)
+        # Lotteries created at the same time on the same pool share the pages
+        current_epoch = await self.get_current_epoch()
+        snapshot = DelegatorsSnapshot()
+        delegators = []
+        async for delegators_page in iter_pages(f"{self.api_url}/pools/{pool_id}/delegators", default_headers,
+                                                self.http_client, self.rate_limiter, single_flight=self.single_flight,
+                                                key=("delegators", pool_id, current_epoch)):
+            page_delegators = [models.Delegator(address_id=delegator["address"], live_stake=int(delegator["live_stake"]))
+                               for delegator in delegators_page]
+            if snapshot is not None:
+                snapshot.extend(page_delegators)
+                # Too large to be cached, don't keep it in memory
+                if snapshot.size > self.delegators_cache.max_bytes:
+                    snapshot = None
+            delegators.extend(page_delegators)
+            while len(delegators) >= batch_size:
+                yield delegators[:batch_size]
+                delegators = delegators[batch_size:]
+
+        if delegators:
+            yield delegators
+
+        if snapshot is not None:
+            self.delegators_cache.put(pool_id, current_epoch, snapshot)
+
+    async def get_current_epoch(self) -> int:
+        return self.epoch_clock.current_epoch()
+
+    async def get_delegators_history(self, delegators: List[models.Delegator],
+                                     since_epochs: Optional[Dict[str, int]] = None,
+                                     window: Optional[models.HistoryWindow] = None) -> List[models.Delegator]:
+        since_epochs = since_epochs if since_epochs else {}
+        blockfrost_url = self.api_account_url
+        default_headers = {'project_id': self.api.project_id,
+                           'User-Agent': 'blockfrost-python 0.3.0'}
 
-        for account_delegation_history in account_delegations_histories:
-            try:
-                account_history_raw = account_delegation_history['result'].json(
-                )
-                account_history = set()
-                for history in account_history_raw:
-
-                    account_history.add(models.Delegation(pool_id=history['pool_id'], amount=history['amount'],
-                                        epoch_no=history['active_epoch']))  # No need of the pool id in the delegation
-                delegator = next(
-                    x for x in delegators if x.address_id == account_delegation_history['id'])
-                delegator.delegation_history = account_history
-            except Exception as e:
-                print(e)
+        # Histories already stored up to the current epoch don't need any request
+        current_epoch = await self.get_current_epoch()
+        delegators_to_refresh = [
+            delegator for delegator in delegators
+            if since_epochs.get(delegator.address_id) is None or since_epochs[delegator.address_id] < current_epoch
+        ]
+        log.info("{} delegators history to refresh - {} up to date".format(
+            len(delegators_to_refresh), len(delegators) - len(delegators_to_refresh)))
+
+        account_delegations_histories = await prepare_delegators_requests(blockfrost_url, delegators_to_refresh,
+                                                                          default_headers, self.http_client,
+                                                                          self.rate_limiter, since_epochs, window,
+                                                                          self.single_flight, current_epoch)
+
+        for delegator, account_delegation_history in zip(delegators_to_refresh, account_delegations_histories):
+            if isinstance(account_delegation_history, Exception):
+                log.error("No history for {} : {}".format(
+                    delegator.address_id, account_delegation_history))
+                continue
+            delegator.delegation_history.update(
+                account_delegation_history['result'])
+            if not account_delegation_history['complete']:
+                delegator.delegation_history.covered_from = delegator.delegation_history.first_epoch
 
-            return delegators
+        return delegators
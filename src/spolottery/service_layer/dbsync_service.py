@@ -0,0 +1,212 @@
+import asyncio
+import datetime
+import json
+import logging
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy import bindparam, text
+
+from spolottery.adapters import engines
+from spolottery.domain import models
+from spolottery.service_layer.cardano_service import AbstractCardanoService
+
+log = logging.getLogger(__name__)
+
+
+# Latest delegation certificate of each address delegated to the pool,
+# not followed by a stake key deregistration
+POOL_DELEGATORS_QUERY = text("""
+WITH delegators AS (
+    SELECT d.addr_id
+    FROM delegation d
+    WHERE d.pool_hash_id = (SELECT id FROM pool_hash WHERE view = :pool_id)
+    AND NOT EXISTS (SELECT 1 FROM delegation d2 WHERE d2.addr_id = d.addr_id AND d2.id > d.id)
+    AND NOT EXISTS (SELECT 1 FROM stake_deregistration sd WHERE sd.addr_id = d.addr_id AND sd.tx_id > d.tx_id)
+),
+utxo AS (
+    SELECT txo.stake_address_id AS addr_id, SUM(txo.value) AS amount
+    FROM tx_out txo
+    JOIN delegators ON delegators.addr_id = txo.stake_address_id
+    WHERE NOT EXISTS (SELECT 1 FROM tx_in txi WHERE txi.tx_out_id = txo.tx_id AND txi.tx_out_index = txo."index")
+    GROUP BY txo.stake_address_id
+),
+rewards AS (
+    SELECT r.addr_id, SUM(r.amount) AS amount
+    FROM reward r
+    JOIN delegators ON delegators.addr_id = r.addr_id
+    WHERE r.spendable_epoch <= :current_epoch
+    GROUP BY r.addr_id
+),
+withdrawals AS (
+    SELECT w.addr_id, SUM(w.amount) AS amount
+    FROM withdrawal w
+    JOIN delegators ON delegators.addr_id = w.addr_id
+    GROUP BY w.addr_id
+)
+SELECT sa.view,
+       COALESCE(utxo.amount, 0) + COALESCE(rewards.amount, 0) - COALESCE(withdrawals.amount, 0) AS live_stake
+FROM delegators
+JOIN stake_address sa ON sa.id = delegators.addr_id
+LEFT JOIN utxo ON utxo.addr_id = delegators.addr_id
+LEFT JOIN rewards ON rewards.addr_id = delegators.addr_id
+LEFT JOIN withdrawals ON withdrawals.addr_id = delegators.addr_id
+ORDER BY sa.view
+""")
+
+# Active stake by epoch, what Blockfrost serves as account history
+DELEGATIONS_HISTORY_QUERY = text("""
+SELECT sa.view, es.epoch_no, ph.view, es.amount
+FROM stake_address sa
+JOIN epoch_stake es ON es.addr_id = sa.id
+JOIN pool_hash ph ON ph.id = es.pool_id
+WHERE sa.view IN :address_ids AND es.epoch_no > :min_epoch
+ORDER BY sa.view, es.epoch_no
+""").bindparams(bindparam("address_ids", expanding=True))
+
+# Latest off chain metadata of each pool
+POOLS_QUERY = text("""
+SELECT ph.view, ph.hash_raw, pmr.url, ocpd.ticker_name, ocpd.json
+FROM pool_hash ph
+JOIN {metadata_table} ocpd ON ocpd.pool_id = ph.id
+JOIN pool_metadata_ref pmr ON pmr.id = ocpd.pmr_id
+WHERE NOT EXISTS (SELECT 1 FROM {metadata_table} o2 WHERE o2.pool_id = ocpd.pool_id AND o2.id > ocpd.id)
+""")
+
+# Owners declared by the latest registration certificate of each pool
+POOL_OWNERS_QUERY = text("""
+SELECT ph.view, sa.view
+FROM pool_owner po
+JOIN pool_update pu ON pu.id = po.pool_update_id
+JOIN pool_hash ph ON ph.id = pu.hash_id
+JOIN stake_address sa ON sa.id = po.addr_id
+WHERE NOT EXISTS (SELECT 1 FROM pool_update pu2 WHERE pu2.hash_id = pu.hash_id AND pu2.id > pu.id)
+""")
+
+CURRENT_EPOCH_QUERY = text("SELECT MAX(no) FROM epoch")
+
+
+class DbSyncCardanoService(AbstractCardanoService):
+    """
+    Cardano service reading a cardano-db-sync database : delegators, live
+    stakes and delegation histories of a whole pool come from a few set based
+    queries instead of thousands of Blockfrost requests.
+    Queries are blocking, they run in a thread to keep the event loop free.
+    """
+
+    # Stay under SQLite bound parameters limit
+    chunk_size = 500
+    # pool_offline_data before db-sync 13.2
+    pool_metadata_table = "off_chain_pool_data"
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    @classmethod
+    def from_config(cls, config) -> "DbSyncCardanoService":
+        return cls(engines.get_engine(config.get_dbsync_uri()))
+
+    def close(self):
+        self.engine.dispose()
+
+    async def aclose(self):
+        await asyncio.to_thread(self.close)
+
+    def _fetch_all(self, query, **params) -> list:
+        with self.engine.connect() as connection:
+            return connection.execute(query, params).fetchall()
+
+    def _current_epoch(self) -> int:
+        return self._fetch_all(CURRENT_EPOCH_QUERY)[0][0]
+
+    async def get_current_epoch(self) -> int:
+        return await asyncio.to_thread(self._current_epoch)
+
+    def _all_pools(self, pool_ids_stored: Set[str]) -> List[models.Pool]:
+        pools = {}
+        updated_at = datetime.datetime.utcnow()
+        for pool_id, hash_raw, url, ticker, metadata in self._fetch_all(
+                text(POOLS_QUERY.text.format(metadata_table=self.pool_metadata_table))):
+            if pool_id in pool_ids_stored:
+                continue
+            # jsonb with PostgreSQL, text with SQLite
+            metadata = json.loads(metadata) if isinstance(metadata, str) else (metadata or {})
+            pools[pool_id] = models.Pool(pool_id=pool_id, hex=bytes(hash_raw).hex(), url=url,
+                                         ticker=ticker or metadata.get("ticker"), name=metadata.get("name"),
+                                         description=metadata.get("description"), updated_at=updated_at)
+
+        for pool_id, address_id in self._fetch_all(POOL_OWNERS_QUERY):
+            pool = pools.get(pool_id)
+            if pool is not None:
+                pool.add_pool_owner(models.PoolOwner(address_id=address_id, pool_id=pool_id))
+
+        return list(pools.values())
+
+    async def get_all_pools(self, pool_ids_stored: Set[str], progress=None) -> List[models.Pool]:
+        pools = await asyncio.to_thread(self._all_pools, pool_ids_stored)
+        if progress is not None:
+            progress(len(pools), len(pools))
+        log.info("{} pools metadata found".format(len(pools)))
+        return pools
+
+    def _pool_delegators(self, pool_id: str) -> List[models.Delegator]:
+        rows = self._fetch_all(POOL_DELEGATORS_QUERY, pool_id=pool_id, current_epoch=self._current_epoch())
+        return [models.Delegator(address_id=address_id, live_stake=int(live_stake))
+                for address_id, live_stake in rows]
+
+    async def get_pool_delegators(self, pool_id: str) -> List[models.Delegator]:
+        return await asyncio.to_thread(self._pool_delegators, pool_id)
+
+    def _delegations(self, address_ids: List[str], min_epoch: int) -> Dict[str, List[models.Delegation]]:
+        """
+        Delegations newer than min_epoch of each address, oldest first
+        """
+        delegations = {}
+        for i in range(0, len(address_ids), self.chunk_size):
+            for address_id, epoch_no, pool_id, amount in self._fetch_all(
+                    DELEGATIONS_HISTORY_QUERY, address_ids=address_ids[i:i + self.chunk_size], min_epoch=min_epoch):
+                delegations.setdefault(address_id, []).append(
+                    models.Delegation(pool_id=pool_id, amount=int(amount), epoch_no=epoch_no))
+        return delegations
+
+    def _delegators_history(self, delegators: List[models.Delegator], since_epochs: Dict[str, int],
+                            window: Optional[models.HistoryWindow]) -> List[models.Delegator]:
+        address_ids = [delegator.address_id for delegator in delegators]
+        # Epochs before the window are only read for the addresses which need them
+        min_epoch = -1
+        if window is not None:
+            min_epoch = window.min_epoch - 2
+        if address_ids and all(address_id in since_epochs for address_id in address_ids):
+            min_epoch = max(min_epoch, min(since_epochs[address_id] for address_id in address_ids))
+
+        delegations = self._delegations(address_ids, min_epoch)
+        # Addresses whose history is only read after min_epoch
+        partial_address_ids = set()
+        if min_epoch >= 0:
+            uncovered_address_ids = []
+            for address_id in address_ids:
+                since_epoch = since_epochs.get(address_id)
+                if since_epoch is not None:
+                    # Every epoch newer than the stored history is needed : no gap before since_epoch
+                    if since_epoch < min_epoch:
+                        uncovered_address_ids.append(address_id)
+                elif window is not None and window.is_covered(delegations.get(address_id, [])[::-1]):
+                    partial_address_ids.add(address_id)
+                else:
+                    uncovered_address_ids.append(address_id)
+            for address_id, older_delegations in self._delegations(uncovered_address_ids, -1).items():
+                delegations[address_id] = older_delegations
+
+        for delegator in delegators:
+            since_epoch = since_epochs.get(delegator.address_id)
+            delegator.delegation_history.update(
+                delegation for delegation in delegations.get(delegator.address_id, [])
+                if since_epoch is None or delegation.epoch_no > since_epoch)
+            if delegator.address_id in partial_address_ids:
+                delegator.delegation_history.covered_from = min_epoch + 1
+
+        return delegators
+
+    async def get_delegators_history(self, delegators: List[models.Delegator],
+                                     since_epochs: Optional[Dict[str, int]] = None,
+                                     window: Optional[models.HistoryWindow] = None) -> List[models.Delegator]:
+        return await asyncio.to_thread(self._delegators_history, delegators, since_epochs or {}, window)
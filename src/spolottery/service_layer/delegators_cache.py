@@ -0,0 +1,122 @@
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Tuple
+
+from spolottery.domain import models
+from spolottery.service_layer.epoch_clock import EpochClock
+
+
+class DelegatorsSnapshot:
+    """
+    Delegators of a pool at one epoch : address ids and live stakes only,
+    new Delegator objects are built for each reader
+    """
+
+    def __init__(self):
+        self.address_ids: List[str] = []
+        self.live_stakes = array("q")
+        self.size = sys.getsizeof(self.address_ids) + sys.getsizeof(self.live_stakes)
+
+    def __len__(self):
+        return len(self.address_ids)
+
+    def extend(self, delegators: Iterable[models.Delegator]):
+        for delegator in delegators:
+            self.address_ids.append(delegator.address_id)
+            self.live_stakes.append(int(delegator.live_stake))
+            # String, list slot and live stake
+            self.size += sys.getsizeof(delegator.address_id) + 16
+
+    def batches(self, batch_size: int):
+        for i in range(0, len(self.address_ids), batch_size):
+            yield [models.Delegator(address_id=address_id, live_stake=live_stake)
+                   for address_id, live_stake in zip(self.address_ids[i:i + batch_size],
+                                                      self.live_stakes[i:i + batch_size])]
+
+
+class DelegatorsCacheMetrics:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0  # snapshots dropped because the epoch advanced
+
+    def serialize(self, entries: int, size: int, max_size: int) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'entries': entries,
+            'bytes': size,
+            'max_bytes': max_size,
+        }
+
+
+class DelegatorsSnapshotCache:
+    """
+    LRU cache of pool delegators snapshots keyed by (pool_id, epoch).
+
+    Delegators and live stakes used for eligibility only change at epoch
+    boundaries : snapshots of past epochs are dropped as soon as the epoch
+    clock advances, least recently used snapshots are evicted to stay under
+    max_bytes.
+    """
+
+    def __init__(self, epoch_clock: EpochClock, max_bytes: int):
+        self.epoch_clock = epoch_clock
+        self.max_bytes = max_bytes
+        self.metrics = DelegatorsCacheMetrics()
+        self._lock = threading.Lock()
+        self._snapshots: "OrderedDict[Tuple[str, int], DelegatorsSnapshot]" = OrderedDict()
+        self._size = 0
+        self._epoch = None
+
+    def __len__(self):
+        return len(self._snapshots)
+
+    def get(self, pool_id: str) -> Optional[DelegatorsSnapshot]:
+        with self._lock:
+            key = (pool_id, self._invalidate_past_epochs())
+            snapshot = self._snapshots.get(key)
+            if snapshot is None:
+                self.metrics.misses += 1
+                return None
+            self._snapshots.move_to_end(key)
+            self.metrics.hits += 1
+            return snapshot
+
+    def put(self, pool_id: str, epoch: int, snapshot: DelegatorsSnapshot):
+        """
+        Store the snapshot of the delegators read during "epoch", ignored when
+        the epoch is already over or when the snapshot alone is over the budget
+        """
+        with self._lock:
+            if epoch != self._invalidate_past_epochs() or snapshot.size > self.max_bytes:
+                return
+            key = (pool_id, epoch)
+            previous_snapshot = self._snapshots.pop(key, None)
+            if previous_snapshot is not None:
+                self._size -= previous_snapshot.size
+            self._snapshots[key] = snapshot
+            self._size += snapshot.size
+
+            while self._size > self.max_bytes:
+                _, evicted_snapshot = self._snapshots.popitem(last=False)
+                self._size -= evicted_snapshot.size
+                self.metrics.evictions += 1
+
+    def _invalidate_past_epochs(self) -> int:
+        current_epoch = self.epoch_clock.current_epoch()
+        if current_epoch != self._epoch:
+            self._epoch = current_epoch
+            for key in [key for key in self._snapshots if key[1] != current_epoch]:
+                self._size -= self._snapshots.pop(key).size
+                self.metrics.invalidations += 1
+        return current_epoch
+
+    def serialize_metrics(self) -> dict:
+        with self._lock:
+            return self.metrics.serialize(len(self._snapshots), self._size, self.max_bytes)
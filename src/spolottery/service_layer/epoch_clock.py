@@ -0,0 +1,38 @@
+import time
+from datetime import datetime
+
+
+class EpochClock:
+    """
+    Current epoch computed from the Shelley genesis parameters, without
+    asking the API : epochs have a fixed length since the first Shelley epoch.
+    """
+
+    def __init__(self, shelley_start_time: datetime, shelley_start_epoch: int, epoch_length: int,
+                 clock=time.time):
+        self.shelley_start = shelley_start_time.timestamp()
+        self.shelley_start_epoch = shelley_start_epoch
+        self.epoch_length = epoch_length
+        self.clock = clock
+
+    @classmethod
+    def from_config(cls, config) -> "EpochClock":
+        return cls(
+            shelley_start_time=datetime.fromisoformat(
+                config.get_shelley_start_time()),
+            shelley_start_epoch=config.get_shelley_start_epoch(),
+            epoch_length=config.get_epoch_length(),
+        )
+
+    def current_epoch(self) -> int:
+        elapsed = self.clock() - self.shelley_start
+        return self.shelley_start_epoch + int(elapsed // self.epoch_length)
+
+    def epoch_start(self, epoch: int) -> float:
+        """
+        Start of "epoch" as a POSIX timestamp
+        """
+        return self.shelley_start + (epoch - self.shelley_start_epoch) * self.epoch_length
+
+    def seconds_to_next_epoch(self) -> float:
+        return self.epoch_start(self.current_epoch() + 1) - self.clock()
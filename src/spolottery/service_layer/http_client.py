@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import threading
+from typing import Dict
+
+import httpx
+
+log = logging.getLogger(__name__)
+
+
+class HttpClientMetrics:
+    def __init__(self):
+        # Updated by the loops of several threads (app, lottery jobs workers)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections_opened = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.pool_saturated_requests = 0  # started while every connection was busy
+        self.clients_created = 0
+
+    def start_request(self, max_connections: int):
+        with self._lock:
+            self.requests += 1
+            if self.in_flight >= max_connections:
+                self.pool_saturated_requests += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def end_request(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def add_connection(self):
+        with self._lock:
+            self.connections_opened += 1
+
+    def add_client(self):
+        with self._lock:
+            self.clients_created += 1
+
+    def serialize(self, max_connections: int) -> dict:
+        with self._lock:
+            return self._serialize(max_connections)
+
+    def _serialize(self, max_connections: int) -> dict:
+        return {
+            'requests': self.requests,
+            'connections_opened': self.connections_opened,
+            'connection_reuse_ratio': (1 - self.connections_opened / self.requests) if self.requests else 0.0,
+            'in_flight': self.in_flight,
+            'peak_in_flight': self.peak_in_flight,
+            'pool_saturation': self.in_flight / max_connections,
+            'pool_saturated_requests': self.pool_saturated_requests,
+            'clients_created': self.clients_created,
+        }
+
+
+class HttpClientManager:
+    """
+    Process wide pooled httpx.AsyncClient.
+
+    One client (and its connection pool) is kept by event loop : connections
+    are reused by every request made from the same loop instead of paying a
+    TLS handshake for each lottery.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 25,
+        max_keepalive_connections: int = 25,
+        keepalive_expiry: float = 30.0,
+        http2: bool = False,
+        retries: int = 3,
+        timeout: float = 30.0,
+    ):
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.http2 = http2 and self._is_http2_available()
+        self.retries = retries
+        self.timeout = timeout
+        self.metrics = HttpClientMetrics()
+        self._clients: Dict[asyncio.AbstractEventLoop, httpx.AsyncClient] = {}
+        self._clients_lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config) -> "HttpClientManager":
+        return cls(
+            max_connections=config.get_http_max_connections(),
+            max_keepalive_connections=config.get_http_max_keepalive_connections(),
+            keepalive_expiry=config.get_http_keepalive_expiry(),
+            http2=config.get_http2_enabled(),
+        )
+
+    @staticmethod
+    def _is_http2_available() -> bool:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            log.warning("HTTP/2 disabled : the h2 package is not installed")
+            return False
+        return True
+
+    def get_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            with self._clients_lock:
+                client = self._clients.get(loop)
+                if client is None:
+                    client = self._create_client(loop)
+        return client
+
+    def _create_client(self, loop: asyncio.AbstractEventLoop) -> httpx.AsyncClient:
+        # Clients of closed loops can't be used anymore
+        for closed_loop in [lo for lo in self._clients if lo.is_closed()]:
+            del self._clients[closed_loop]
+
+        client = httpx.AsyncClient(
+            transport=httpx.AsyncHTTPTransport(
+                retries=self.retries,
+                http2=self.http2,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive_connections,
+                    keepalive_expiry=self.keepalive_expiry,
+                ),
+            ),
+            timeout=self.timeout,
+        )
+        self._clients[loop] = client
+        self.metrics.add_client()
+        return client
+
+    async def _trace(self, event_name: str, info: dict):
+        if event_name == "connection.connect_tcp.complete":
+            self.metrics.add_connection()
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        client = self.get_client()
+        self.metrics.start_request(self.max_connections)
+        try:
+            return await client.request(method, url, extensions={"trace": self._trace}, **kwargs)
+        finally:
+            self.metrics.end_request()
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def aclose(self):
+        """
+        Close the client of the running loop
+        """
+        with self._clients_lock:
+            client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+    def close(self):
+        """
+        Shutdown hook : close every client whose loop is still usable
+        """
+        with self._clients_lock:
+            clients = list(self._clients.items())
+            self._clients.clear()
+        for loop, client in clients:
+            try:
+                if loop.is_closed():
+                    continue
+                if loop.is_running():
+                    asyncio.run_coroutine_threadsafe(
+                        client.aclose(), loop).result(timeout=self.timeout)
+                else:
+                    loop.run_until_complete(client.aclose())
+            except Exception as e:
+                log.exception(e)
+
+    def serialize_metrics(self) -> dict:
+        metrics = self.metrics.serialize(self.max_connections)
+        with self._clients_lock:
+            metrics['clients'] = len(self._clients)
+        return metrics
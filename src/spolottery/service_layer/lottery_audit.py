@@ -0,0 +1,111 @@
+import math
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+
+import numpy as np
+
+from spolottery.domain import models
+
+# Keys computed at once by a trials x tickets block (float64 : 32 MiB)
+block_size = 1 << 22
+
+
+def _draw_first_places(weights: np.ndarray, seed_sequence: np.random.SeedSequence, trials: int,
+                       full_permutation: bool = False) -> np.ndarray:
+    """
+    First place of "trials" independent draws, as counts by ticket, drawn the
+    way Lottery.draw_winners draws : the best Efraimidis-Spirakis key of each
+    trial, or numpy weighted choice for the full permutation draws
+    """
+    rng = np.random.default_rng(seed_sequence)
+    if full_permutation:
+        first_places = rng.choice(len(weights), trials, p=weights / weights.sum())
+        return np.bincount(first_places, minlength=len(weights))
+
+    observed = np.zeros(len(weights), dtype=np.int64)
+    block_trials = max(1, block_size // len(weights))
+    for start in range(0, trials, block_trials):
+        keys = models.efraimidis_spirakis_keys(rng, weights, min(block_trials, trials - start))
+        observed += np.bincount(keys.argmax(axis=1), minlength=len(weights))
+    return observed
+
+
+def simulate_first_places(winning_likelyhoods: np.ndarray, trials: int, seed: int,
+                          batch_size: int = 1_000_000, max_workers: Optional[int] = None,
+                          full_permutation: bool = False) -> np.ndarray:
+    """
+    Run "trials" draws in batches, each batch with its own seed derived from
+    "seed", spread across a process pool when max_workers != 1
+    """
+    weights = np.asarray(winning_likelyhoods, dtype=np.float64)
+    batches = [min(batch_size, trials - start)
+               for start in range(0, trials, batch_size)]
+    seed_sequences = np.random.SeedSequence(seed).spawn(len(batches))
+
+    observed = np.zeros(len(weights), dtype=np.int64)
+    if max_workers == 1 or len(batches) == 1:
+        for seed_sequence, batch_trials in zip(seed_sequences, batches):
+            observed += _draw_first_places(weights, seed_sequence, batch_trials, full_permutation)
+        return observed
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for counts in executor.map(_draw_first_places, [weights] * len(batches), seed_sequences, batches,
+                                   [full_permutation] * len(batches)):
+            observed += counts
+    return observed
+
+
+def chi_square_test(observed: np.ndarray, expected_frequencies: np.ndarray) -> Tuple[float, int, float]:
+    """
+    Pearson chi-square goodness of fit : (statistic, degrees of freedom, p-value)
+    Tickets with a zero expected frequency are left out
+    """
+    trials = observed.sum()
+    tested = expected_frequencies > 0
+    expected = expected_frequencies[tested] * trials
+    statistic = float((((observed[tested] - expected) ** 2) / expected).sum())
+    degrees_of_freedom = max(int(tested.sum()) - 1, 1)
+    return statistic, degrees_of_freedom, chi_square_survival(statistic, degrees_of_freedom)
+
+
+def chi_square_survival(statistic: float, degrees_of_freedom: int) -> float:
+    """
+    P(X >= statistic) for a chi-square distribution : regularized upper
+    incomplete gamma function Q(k/2, x/2)
+    """
+    a, x = degrees_of_freedom / 2, statistic / 2
+    if x <= 0:
+        return 1.0
+    log_prefactor = a * math.log(x) - x - math.lgamma(a)
+
+    if x < a + 1:
+        # Series for the lower function P, Q = 1 - P
+        term = total = 1 / a
+        n = a
+        while abs(term) > abs(total) * 1e-15:
+            n += 1
+            term *= x / n
+            total += term
+        return max(0.0, 1 - total * math.exp(log_prefactor))
+
+    # Lentz continued fraction for Q
+    tiny = 1e-300
+    b = x + 1 - a
+    c = 1 / tiny
+    d = 1 / b
+    h = d
+    i = 0
+    while True:
+        i += 1
+        an = -i * (i - a)
+        b += 2
+        d = an * d + b
+        d = tiny if abs(d) < tiny else d
+        c = b + an / c
+        c = tiny if abs(c) < tiny else c
+        d = 1 / d
+        delta = d * c
+        h *= delta
+        if abs(delta - 1) < 1e-15:
+            break
+    return min(1.0, math.exp(log_prefactor) * h)
@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Optional, Set
+
+from spolottery.service_layer import services, unit_of_work
+from spolottery.service_layer.cardano_service import AbstractCardanoService
+
+log = logging.getLogger(__name__)
+
+
+class LotteryJobWorkerPool:
+    """
+    Bounded pool of threads creating the queued lotteries.
+
+    Jobs are claimed from the lottery_jobs table, so every process running a
+    pool shares the same queue. A monitor thread keeps the heartbeat of the
+    running jobs and requeues the jobs whose worker died (no heartbeat for
+    stale_after seconds), up to max_attempts runs.
+    Each worker thread keeps its own event loop.
+    """
+
+    def __init__(self, uow_factory: Callable[[], unit_of_work.AbstractUnitOfWork],
+                 cardano_service: AbstractCardanoService, workers: int, poll_interval: float = 1.0,
+                 heartbeat_interval: float = 15.0, stale_after: float = 120.0, max_attempts: int = 3):
+        self.uow_factory = uow_factory
+        self.cardano_service = cardano_service
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_after = stale_after
+        self.max_attempts = max_attempts
+        self.worker_id = "{}-{}-{}".format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+        self._running_job_ids: Set[str] = set()
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._wake_up = threading.Condition()
+        self._threads = []
+
+    @classmethod
+    def from_config(cls, config, uow_factory, cardano_service) -> "LotteryJobWorkerPool":
+        return cls(uow_factory, cardano_service, config.get_lottery_job_workers(),
+                   heartbeat_interval=config.get_lottery_job_heartbeat_interval(),
+                   stale_after=config.get_lottery_job_stale_after(),
+                   max_attempts=config.lottery_job_max_attempts)
+
+    def start(self):
+        if self._threads or self.workers < 1:
+            return
+        self._stopping.clear()
+        self._threads = [threading.Thread(target=self._work, name="lottery-job-worker-{}".format(i), daemon=True)
+                         for i in range(self.workers)]
+        self._threads.append(threading.Thread(target=self._monitor, name="lottery-job-monitor", daemon=True))
+        for thread in self._threads:
+            thread.start()
+        log.info("{} lottery job workers started : {}".format(self.workers, self.worker_id))
+
+    def stop(self, timeout: Optional[float] = None):
+        """
+        Stop claiming jobs and wait for the running ones
+        """
+        self._stopping.set()
+        with self._wake_up:
+            self._wake_up.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def notify(self):
+        """
+        Wake up an idle worker, a job was just queued
+        """
+        with self._wake_up:
+            self._wake_up.notify()
+
+    def running_job_ids(self) -> Set[str]:
+        with self._lock:
+            return set(self._running_job_ids)
+
+    def run_next(self, loop: asyncio.AbstractEventLoop) -> bool:
+        """
+        Claim and run one queued job, False when the queue is empty
+        """
+        with self.uow_factory() as uow:
+            job = uow.jobs.claim(self.worker_id, datetime.utcnow())
+            uow.commit()
+            if job is None:
+                return False
+            job_id, lottery_details = job.uuid, job.lottery_details
+
+        log.info("Lottery job {} claimed by {}".format(job_id, self.worker_id))
+        with self._lock:
+            self._running_job_ids.add(job_id)
+        try:
+            loop.run_until_complete(services.run_lottery_job(
+                job_id, lottery_details, self.worker_id, self.uow_factory(), self.uow_factory(),
+                self.cardano_service))
+        finally:
+            with self._lock:
+                self._running_job_ids.discard(job_id)
+        return True
+
+    def _work(self):
+        loop = asyncio.new_event_loop()
+        try:
+            while not self._stopping.is_set():
+                try:
+                    if self.run_next(loop):
+                        continue
+                except Exception as e:
+                    log.exception(e)
+                with self._wake_up:
+                    self._wake_up.wait(self.poll_interval)
+        finally:
+            loop.close()
+
+    def keep_alive(self) -> int:
+        """
+        Heartbeat of the running jobs, then requeue of the stale ones of any process
+        """
+        now = datetime.utcnow()
+        with self.uow_factory() as uow:
+            uow.jobs.heartbeat(sorted(self.running_job_ids()), self.worker_id, now)
+            count_stale = uow.jobs.requeue_stale(now - timedelta(seconds=self.stale_after), self.max_attempts, now)
+            uow.commit()
+        if count_stale:
+            log.warning("{} stale lottery jobs requeued or failed".format(count_stale))
+        return count_stale
+
+    def _monitor(self):
+        while not self._stopping.is_set():
+            try:
+                self.keep_alive()
+            except Exception as e:
+                log.exception(e)
+            self._stopping.wait(self.heartbeat_interval)
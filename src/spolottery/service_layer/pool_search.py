@@ -0,0 +1,140 @@
+import threading
+import time
+from typing import Dict, Hashable, Iterable, List, Optional, Set
+
+from spolottery.domain import models
+
+
+class PoolSearchIndex:
+    """
+    Process local search index over pool id, ticker and name.
+
+    Same matching rules as models.Pool.is_pool_a_match (exact pool id, or
+    case insensitive substring of the ticker or the name) answered from
+    - an exact pool id map
+    - a prefix map (ticker and name words prefixes), used for ranking
+    - an n-gram index (every substring up to ngram_size characters)
+    instead of loading and scanning every pool of the database.
+    """
+
+    def __init__(self, ngram_size: int = 3):
+        self.ngram_size = ngram_size
+        self._lock = threading.Lock()
+        self._pools: Dict[str, models.Pool] = {}
+        self._texts: Dict[str, tuple] = {}  # pool_id -> (ticker, name) casefolded
+        self._prefixes: Dict[str, Set[str]] = {}
+        self._ngrams: Dict[str, Set[str]] = {}
+        self.revision: Optional[Hashable] = None  # of the pools indexed by build
+        self._checked_at: Optional[float] = None
+
+    def __len__(self):
+        return len(self._pools)
+
+    def build(self, pools: Iterable[models.Pool], revision: Optional[Hashable] = None):
+        """
+        Replace the whole index content
+        """
+        with self._lock:
+            self._pools, self._texts, self._prefixes, self._ngrams = {}, {}, {}, {}
+            for pool in pools:
+                self._index_pool(pool)
+            self.revision = revision
+            self._checked_at = time.monotonic()
+
+    def claim_refresh_check(self, interval: float) -> bool:
+        """
+        True for a single caller every interval seconds : the one checking
+        whether the stored pools changed since the index was built
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._checked_at is not None and now - self._checked_at < interval:
+                return False
+            self._checked_at = now
+            return True
+
+    def add(self, pools: Iterable[models.Pool]):
+        """
+        Add new pools or refresh the ones already indexed
+        """
+        with self._lock:
+            for pool in pools:
+                if pool.pool_id in self._pools:
+                    self._unindex_pool(pool.pool_id)
+                self._index_pool(pool)
+
+    def search(self, pool_filter: str, limit: int = 50) -> List[models.Pool]:
+        """
+        Matching pools, best first : pool id, ticker, ticker prefix, name prefix, substring
+        """
+        query = pool_filter.casefold()
+        if not query:
+            return []
+
+        with self._lock:
+            candidates = self._substring_candidates(query)
+            if pool_filter in self._texts:
+                candidates.add(pool_filter)
+            prefix_matches = self._prefixes.get(query, ())
+
+            ranked = []
+            for pool_id in candidates:
+                ticker, name = self._texts[pool_id]
+                if pool_id == pool_filter:
+                    rank = 0
+                elif ticker == query:
+                    rank = 1
+                elif pool_id in prefix_matches:
+                    rank = 2 if ticker.startswith(query) else 3
+                else:
+                    rank = 4
+                ranked.append((rank, ticker, pool_id))
+
+            ranked.sort()
+            return [self._pools[pool_id] for _, _, pool_id in ranked[:limit]]
+
+    def _substring_candidates(self, query: str) -> Set[str]:
+        if len(query) <= self.ngram_size:
+            return set(self._ngrams.get(query, ()))
+
+        # Every n-gram of the query has to be in the pool, then check the whole query
+        postings = sorted((self._ngrams.get(query[i:i + self.ngram_size], set())
+                           for i in range(len(query) - self.ngram_size + 1)), key=len)
+        candidates = set(postings[0]).intersection(*postings[1:])
+        return {pool_id for pool_id in candidates
+                if any(query in text for text in self._texts[pool_id])}
+
+    def _keys(self, ticker: str, name: str):
+        ngrams, prefixes = set(), set()
+        for text in (ticker, name):
+            for size in range(1, self.ngram_size + 1):
+                ngrams.update(text[i:i + size]
+                              for i in range(len(text) - size + 1))
+            for word in [text] + text.split():
+                prefixes.update(word[:i] for i in range(1, len(word) + 1))
+        return ngrams, prefixes
+
+    def _index_pool(self, pool: models.Pool):
+        # Pools without name are never matched, see Pool.is_pool_a_match
+        if pool.name is None:
+            return
+        ticker = (pool.ticker or "").casefold()
+        name = pool.name.casefold()
+
+        self._pools[pool.pool_id] = pool
+        self._texts[pool.pool_id] = (ticker, name)
+        ngrams, prefixes = self._keys(ticker, name)
+        for ngram in ngrams:
+            self._ngrams.setdefault(ngram, set()).add(pool.pool_id)
+        for prefix in prefixes:
+            self._prefixes.setdefault(prefix, set()).add(pool.pool_id)
+
+    def _unindex_pool(self, pool_id: str):
+        del self._pools[pool_id]
+        ngrams, prefixes = self._keys(*self._texts.pop(pool_id))
+        for keys, index in ((ngrams, self._ngrams), (prefixes, self._prefixes)):
+            for key in keys:
+                pool_ids = index[key]
+                pool_ids.discard(pool_id)
+                if not pool_ids:
+                    del index[key]
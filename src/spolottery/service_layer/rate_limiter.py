@@ -0,0 +1,71 @@
+import asyncio
+import random
+import threading
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter : "rate" requests per second on average,
+    up to "burst" requests at once after an idle period.
+
+    Tokens are reserved before sleeping, so concurrent callers are served
+    in order without a lock held across an await.
+    """
+
+    def __init__(self, rate: float, burst: int, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self._tokens = float(burst)
+        self._updated_at = clock()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """
+        Take a token, return how long the caller has to wait before using it
+        """
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(self.burst, self._tokens +
+                               (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            return max(wait, self._blocked_until - now)
+
+    async def acquire(self):
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def pause(self, delay: float):
+        """
+        Hold every caller for "delay" seconds (upstream asked us to slow down)
+        """
+        with self._lock:
+            now = self.clock()
+            self._blocked_until = max(self._blocked_until, now + delay)
+            # Nothing was sent while paused, don't hand a full burst back
+            self._tokens = min(self._tokens, 0.0)
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None,
+                  base: float = 0.5, cap: float = 30.0) -> float:
+    """
+    Exponential backoff with jitter, never shorter than the Retry-After asked
+    """
+    backoff = min(cap, base * 2 ** attempt)
+    return max(retry_after or 0.0, backoff) + random.uniform(0, backoff)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        # HTTP date format isn't used by Blockfrost
+        return None
@@ -2,16 +2,19 @@ import asyncio
 from collections import namedtuple
 from datetime import datetime, timezone
 import logging
-from typing import Set, List
+from typing import AsyncIterator, Callable, Dict, Optional, Set, List
+from sqlalchemy.exc import OperationalError, SQLAlchemyError
+import spolottery.config as config
 from spolottery.adapters import data_mappers
-from spolottery.adapters.data_mappers import pool_model_to_entity
 from spolottery.adapters import dto
 
 from spolottery.domain import models
 from spolottery.adapters.repository import AbstractPoolRepository, AbstractLotteryRepository, PoolDoesntExist
 
-from spolottery.service_layer import unit_of_work
+from spolottery.service_layer import lottery_audit, unit_of_work
 from spolottery.service_layer.cardano_service import AbstractCardanoService
+from spolottery.service_layer.pool_search import PoolSearchIndex
+from spolottery.service_layer.rate_limiter import backoff_delay
 
 
 logger = logging.getLogger(__name__)
@@ -25,32 +28,80 @@ class InvalidLottery(Exception):
     pass
 
 
-async def add_pools(uow: unit_of_work.AbstractUnitOfWork, cardano_service: AbstractCardanoService):
+class LotteryJobNotFound(Exception):
+    pass
+
+
+class TooManyLotteryJobs(Exception):
+    pass
+
+
+# progress(phase, count_done, count_total) of a lottery creation
+LotteryProgress = Callable[[models.LotteryJobPhase, int, Optional[int]], None]
 
+
+async def add_pools(uow: unit_of_work.AbstractUnitOfWork, cardano_service: AbstractCardanoService,
+                    search_index: Optional[PoolSearchIndex] = None, refresh_stored: bool = False):
+    """
+    Store the pools not stored yet, or every registered pool with refresh_stored
+    so changed metadata is updated too
+    """
     with uow:
-        pools_stored = uow.pools.list()
-        fresh_pools = await cardano_service.get_all_pools(pools_stored)
-        uow.pools.add_multiple(fresh_pools)
+        pool_ids_stored = set() if refresh_stored else uow.pools.list_ids()
+
+    # No session held while the registry is fetched
+    fresh_pools = list(await cardano_service.get_all_pools(pool_ids_stored))
+
+    with uow:
+        count_pools_written = uow.pools.upsert_multiple(fresh_pools)
         uow.commit()
-        logger.info("{} new pools stored".format(len(fresh_pools)))
-    pass
+        logger.info("{} pools fetched - {} pools inserted or updated".format(
+            len(fresh_pools), count_pools_written))
+
+    if search_index is not None:
+        search_index.add(fresh_pools)
 
 
 def search_pool(pool_filter: str, uow: unit_of_work.AbstractUnitOfWork) -> Set[models.Pool]:
-    list_matched_pools = set()
     with uow:
-        pools = uow.pools.list()
+        return set(uow.pools.search(pool_filter))
+
+
+def build_pool_search_index(uow: unit_of_work.AbstractUnitOfWork, search_index: PoolSearchIndex):
+    with uow:
+        revision = uow.pools.get_revision()
+        search_index.build(uow.pools.list(), revision)
+    logger.info("{} pools indexed for search".format(len(search_index)))
+
+
+def refresh_pool_search_index(uow: unit_of_work.AbstractUnitOfWork, search_index: PoolSearchIndex,
+                              interval: float) -> bool:
+    """
+    Rebuild the index when pools were added or updated in the database since
+    it was built, e.g. by another process. Checked at most every interval seconds.
+    Return whether the index was rebuilt
+    """
+    if not search_index.claim_refresh_check(interval):
+        return False
+    with uow:
+        revision = uow.pools.get_revision()
+        if revision == search_index.revision:
+            return False
+        search_index.build(uow.pools.list(), revision)
+    logger.info("{} pools indexed for search after pools changed".format(len(search_index)))
+    return True
 
-        for pool in pools:
-            if pool.is_pool_a_match(pool_filter):
-                list_matched_pools.add(pool)
 
-    return list_matched_pools
+def search_pool_index(pool_filter: str, search_index: PoolSearchIndex, limit: int) -> List[models.Pool]:
+    return search_index.search(pool_filter, limit=limit)
 
 
 async def create_lottery(pool_id: str, start_epoch: int, end_epoch: int, count_epochs: int,
                          draw_date: str, lottery_strategy_name: str, owners_allowed: bool,
-                         min_live_stake: int, lottery_name: str, uow: unit_of_work.AbstractUnitOfWork, cardano_service: AbstractCardanoService) -> dto.LotteryDto:
+                         min_live_stake: int, lottery_name: str, uow: unit_of_work.AbstractUnitOfWork, cardano_service: AbstractCardanoService,
+                         winners_count: Optional[int] = None,
+                         progress: Optional[LotteryProgress] = None,
+                         lottery_id: Optional[str] = None) -> dto.LotteryDto:
 
     # Create lottery
     utc_now = datetime.utcnow()
@@ -68,12 +119,18 @@ async def create_lottery(pool_id: str, start_epoch: int, end_epoch: int, count_e
         raise InvalidDrawDate(
             "The draw date format is not correct {}".format(draw_date))
 
+    if winners_count is None:
+        winners_count = config.default_winners_count
+    if winners_count < 1:
+        raise InvalidLottery(
+            "The winners count should be >= 1 : {}".format(winners_count))
+
     lottery_strategy_factory = models.LotteryStrategyFactory()
     lottery_strategy = lottery_strategy_factory.createLotteryStrategy(
         lottery_strategy_name, min_live_stake)
 
     lottery = models.Lottery(
-        uuid=models.generate_uuid(),
+        uuid=lottery_id if lottery_id else models.generate_uuid(),
         pool_id=pool_id,
         name=lottery_name,
         lottery_tickets=[],
@@ -85,18 +142,24 @@ async def create_lottery(pool_id: str, start_epoch: int, end_epoch: int, count_e
         lottery_strategy_type=lottery_strategy_name,
         lottery_strategy=lottery_strategy,
         owners_allowed=owners_allowed,
-        min_live_stake=min_live_stake
+        min_live_stake=min_live_stake,
+        winners_count=winners_count
     )
 
-    # Get delegators with history
-    delegators = await cardano_service.get_pool_delegators(pool_id)
-    logger.info("{} delegators for lottery : {}".format(
-        len(delegators), lottery.uuid))
-
-    logger.info("Get delegators history for lottery : {}".format(lottery.uuid))
-    # Get delegators history
+    # Get delegators with history, by batches reduced to tickets as they come
+    history_window = None
     if lottery_strategy_name == models.LotteryStrategyType.STAKE.value:
-        delegators = await cardano_service.get_delegators_history(delegators)
+        history_window = models.HistoryWindow.for_lottery(
+            pool_id, start_epoch, count_epochs)
+    lottery_tickets_builder = models.LotteryTicketsBuilder(lottery)
+    async for delegators in iter_delegators_with_history(pool_id, uow, cardano_service, history_window,
+                                                         config.delegators_batch_size):
+        lottery_tickets_builder.add_batch(delegators)
+        if progress is not None:
+            progress(models.LotteryJobPhase.FETCHING_DELEGATORS,
+                     lottery_tickets_builder.count_delegators, None)
+    logger.info("{} delegators for lottery : {}".format(
+        lottery_tickets_builder.count_delegators, lottery.uuid))
 
     # Get pool
     with uow:
@@ -111,22 +174,31 @@ async def create_lottery(pool_id: str, start_epoch: int, end_epoch: int, count_e
                 "Prepare lottery tickets - for lottery : {}".format(lottery.uuid))
 
             # Prepare lottery tickets
-            lottery.lottery_tickets = models.prepare_lottery_tickets_list(
-                delegators, lottery, pool)
+            if progress is not None:
+                progress(models.LotteryJobPhase.PREPARING_TICKETS, 0,
+                         lottery_tickets_builder.count_delegators)
+            lottery_tickets = lottery_tickets_builder.build_columns(pool)
 
             logger.info("Winners draw - for lottery : {}".format(lottery.uuid))
 
             # Run lottery
-            lottery.raffle_draw()
+            if progress is not None:
+                progress(models.LotteryJobPhase.DRAWING_WINNERS, 0,
+                         len(lottery_tickets))
+            winner_ids = lottery.draw_winners(lottery_tickets)
 
             logger.info(
-                "{} Winners - for lottery : {}".format(len(lottery.winners), lottery.uuid))
+                "{} Winners - for lottery : {}".format(len(winner_ids), lottery.uuid))
 
-            # Save lottery
-            uow.lottery.add(lottery)
+            # Save lottery, tickets and winners in bulk
+            if progress is not None:
+                progress(models.LotteryJobPhase.SAVING, 0,
+                         len(lottery_tickets))
+            uow.lottery.add_bulk(lottery, lottery_tickets, winner_ids)
 
             lottery_dto = data_mappers.lottery_entity_to_dto(
-                lottery, detailed=True)
+                lottery, detailed=True, lottery_tickets=lottery_tickets, winner_ids=winner_ids)
+            uow.commit()
 
         except PoolDoesntExist as e:
             raise e
@@ -139,8 +211,271 @@ async def create_lottery(pool_id: str, start_epoch: int, end_epoch: int, count_e
     return lottery_dto
 
 
-async def get_lottery(lottery_id: str, lottery_repo: AbstractLotteryRepository, detailed: bool) -> dto.LotteryDto:
-    lottery = lottery_repo.get(lottery_id=lottery_id)
-    lottery_dto = data_mappers.lottery_entity_to_dto(
-        lottery, detailed=detailed)
+def submit_lottery_job(lottery_input_dto: dto.LotteryInputDto,
+                       uow: unit_of_work.AbstractUnitOfWork) -> dto.LotteryJobDto:
+    """
+    Queue the creation of a lottery, run later by a LotteryJobWorkerPool
+    """
+    with uow:
+        count_queued = uow.jobs.count_queued()
+        if count_queued >= config.get_lottery_jobs_max_queued():
+            raise TooManyLotteryJobs(
+                "{} lotteries are already waiting to be created, retry later".format(count_queued))
+
+        job = models.LotteryJob(
+            uuid=models.generate_uuid(),
+            lottery_details=lottery_input_dto.json(),
+            created_at=datetime.utcnow(),
+        )
+        uow.jobs.add(job)
+        uow.commit()
+        logger.info("Lottery job queued : {} - {}".format(job.uuid, lottery_input_dto.pool_id))
+        return data_mappers.lottery_job_entity_to_dto(job)
+
+
+def get_lottery_job(job_id: str, uow: unit_of_work.AbstractUnitOfWork) -> dto.LotteryJobDto:
+    with uow:
+        job = uow.jobs.get(job_id)
+        if job is None:
+            raise LotteryJobNotFound("No lottery job {}".format(job_id))
+        return data_mappers.lottery_job_entity_to_dto(job)
+
+
+async def run_lottery_job(job_id: str, lottery_details: str, worker_id: str, uow: unit_of_work.AbstractUnitOfWork,
+                          jobs_uow: unit_of_work.AbstractUnitOfWork, cardano_service: AbstractCardanoService):
+    """
+    Create the lottery of a claimed job. Progress and result are written
+    with jobs_uow, create_lottery holds uow sessions while it runs.
+    The lottery takes the job uuid, so a job run again after its lottery
+    was saved (finish lost, job requeued) doesn't create it twice.
+    """
+    def progress(phase: models.LotteryJobPhase, done: int, total: Optional[int]):
+        # Best effort : the heartbeat may update the job row at the same time
+        try:
+            with jobs_uow:
+                jobs_uow.jobs.update_progress(job_id, worker_id, phase.value, done, total, datetime.utcnow())
+                jobs_uow.commit()
+        except SQLAlchemyError as e:
+            logger.warning("Lottery job {} progress not saved : {}".format(job_id, e))
+
+    lottery_id, error = job_id, None
+    status = models.LotteryJobStatus.SUCCEEDED
+    try:
+        with uow:
+            already_created = uow.lottery.exists(lottery_id)
+        if already_created:
+            logger.info("Lottery job {} - lottery already created".format(job_id))
+        else:
+            lottery_input_dto = dto.LotteryInputDto.parse_raw(lottery_details)
+            await create_lottery(
+                lottery_input_dto.pool_id, lottery_input_dto.start_epoch, lottery_input_dto.end_epoch,
+                lottery_input_dto.count_epochs, lottery_input_dto.draw_date, lottery_input_dto.lottery_strategy_name,
+                lottery_input_dto.owners_allowed, lottery_input_dto.min_live_stake, lottery_input_dto.lottery_name,
+                uow, cardano_service, winners_count=lottery_input_dto.winners_count, progress=progress,
+                lottery_id=lottery_id)
+    except Exception as e:
+        logger.exception(e)
+        lottery_id, error = None, str(e)
+        status = models.LotteryJobStatus.FAILED
+
+    for attempt in range(config.lottery_job_finish_retries + 1):
+        try:
+            with jobs_uow:
+                jobs_uow.jobs.finish(job_id, worker_id, status.value, datetime.utcnow(),
+                                     lottery_id=lottery_id, error=error)
+                jobs_uow.commit()
+            break
+        except OperationalError as e:
+            # Serialization failure against the heartbeat, or connection lost
+            if attempt == config.lottery_job_finish_retries:
+                raise
+            logger.warning("Lottery job {} not finished, retrying : {}".format(job_id, e))
+            await asyncio.sleep(backoff_delay(attempt, base=0.1, cap=2.0))
+    logger.info("Lottery job {} {} - lottery : {}".format(job_id, status.value, lottery_id))
+
+
+def attach_stored_histories(delegators: List[models.Delegator], uow: unit_of_work.AbstractUnitOfWork,
+                            since_epochs: Dict[str, int], history_window: Optional[models.HistoryWindow] = None):
+    """
+    Attach the stored delegation histories, since_epochs gets the last epoch stored for each address.
+    Histories stored only from an epoch too recent for history_window (the whole history
+    without window) are left out : they are fetched again entirely.
+    """
+    with uow:
+        stored_histories = uow.delegations.get_histories(
+            [delegator.address_id for delegator in delegators])
+
+    count_attached = 0
+    for delegator in delegators:
+        stored_history = stored_histories.get(delegator.address_id)
+        if stored_history is None:
+            continue
+        if stored_history.covered_from is not None and (
+                history_window is None or not history_window.is_answered_by(stored_history)):
+            continue
+        delegator.delegation_history = stored_history
+        since_epochs[delegator.address_id] = stored_history.last_epoch
+        count_attached += 1
+    logger.info("{} delegators history already stored - {} stored in part only".format(
+        count_attached, len(stored_histories) - count_attached))
+
+
+def store_new_delegations(delegators: List[models.Delegator], uow: unit_of_work.AbstractUnitOfWork,
+                          since_epochs: Dict[str, int]):
+    """
+    Store the delegations newer than since_epochs, and from which epoch each history is complete
+    """
+    with uow:
+        uow.delegations.add_multiple({
+            delegator.address_id: delegator.delegation_history.since(
+                since_epochs.get(delegator.address_id))
+            for delegator in delegators
+        })
+        uow.delegations.add_coverages({
+            delegator.address_id: delegator.delegation_history.covered_from
+            for delegator in delegators if len(delegator.delegation_history)
+        })
+        uow.commit()
+
+
+async def refresh_delegators_history(delegators: List[models.Delegator], uow: unit_of_work.AbstractUnitOfWork,
+                                     cardano_service: AbstractCardanoService,
+                                     history_window: Optional[models.HistoryWindow] = None) -> List[models.Delegator]:
+    """
+    Attach the stored delegation histories, only fetch the epochs newer than the last one
+    stored for each address, then store them
+    """
+    since_epochs = {}
+    attach_stored_histories(delegators, uow, since_epochs, history_window)
+    delegators = await cardano_service.get_delegators_history(delegators, since_epochs, history_window)
+    store_new_delegations(delegators, uow, since_epochs)
+
+    return delegators
+
+
+async def iter_delegators_with_history(pool_id: str, uow: unit_of_work.AbstractUnitOfWork,
+                                       cardano_service: AbstractCardanoService,
+                                       history_window: Optional[models.HistoryWindow],
+                                       batch_size: int) -> AsyncIterator[List[models.Delegator]]:
+    """
+    Stream the pool delegators by batches, with their refreshed histories when
+    a history window is given (stake lotteries) and without history otherwise
+    """
+    delegators_batches = cardano_service.iter_pool_delegators(pool_id, batch_size)
+    if history_window is None:
+        async for delegators in delegators_batches:
+            yield delegators
+        return
+
+    since_epochs = {}
+
+    async def with_stored_histories():
+        async for delegators in delegators_batches:
+            attach_stored_histories(delegators, uow, since_epochs, history_window)
+            yield delegators
+
+    async for delegators in cardano_service.iter_delegators_history(with_stored_histories(), since_epochs,
+                                                                    history_window):
+        store_new_delegations(delegators, uow, since_epochs)
+        # Only the batches in flight are kept
+        for delegator in delegators:
+            since_epochs.pop(delegator.address_id, None)
+        yield delegators
+
+
+def get_lottery(lottery_id: str, uow: unit_of_work.AbstractUnitOfWork, detailed: bool) -> dto.LotteryDto:
+    with uow:
+        lottery = uow.lottery.get(lottery_id=lottery_id)
+        lottery_tickets = uow.lottery.get_ticket_columns(lottery_id) if detailed else None
+        lottery_dto = data_mappers.lottery_entity_to_dto(
+            lottery, detailed=detailed, lottery_tickets=lottery_tickets)
     return lottery_dto
+
+
+def get_lottery_tickets(lottery_id: str, uow: unit_of_work.AbstractUnitOfWork, after: Optional[int],
+                        limit: int) -> dto.LotteryTicketsPageDto:
+    """
+    Page of "limit" tickets of a lottery following the ticket "after"
+    """
+    if limit < 1:
+        raise InvalidLottery("The page size should be >= 1 : {}".format(limit))
+    with uow:
+        uow.lottery.get(lottery_id)
+        # One row more tells if there is a next page
+        rows = uow.lottery.list_tickets(lottery_id, after, limit + 1)
+    next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+    return dto.LotteryTicketsPageDto(
+        tickets=[dto.LotteryTicketDto(
+            delegator_id=delegator_id,
+            winning_likelyhood=winning_likelyhood,
+            pool_owner=pool_owner,
+            delegator_lottery_stake=delegator_lottery_stake if delegator_lottery_stake else None,
+        ) for _, delegator_id, winning_likelyhood, pool_owner, delegator_lottery_stake in rows[:limit]],
+        next_cursor=next_cursor)
+
+
+def get_lottery_winners(lottery_id: str, uow: unit_of_work.AbstractUnitOfWork, after: Optional[int],
+                        limit: int) -> dto.LotteryWinnersPageDto:
+    """
+    Page of "limit" winners of a lottery ranked after "after", none before the draw date
+    """
+    if limit < 1:
+        raise InvalidLottery("The page size should be >= 1 : {}".format(limit))
+    with uow:
+        lottery = uow.lottery.get(lottery_id)
+        rows = []
+        if lottery.is_lottery_result_available():
+            rows = uow.lottery.list_winners(lottery_id, after, limit + 1)
+    next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+    return dto.LotteryWinnersPageDto(
+        winners=[dto.LotteryWinnerDto(delegator_address_id=delegator_address_id, rank=rank)
+                 for rank, delegator_address_id in rows[:limit]],
+        next_cursor=next_cursor)
+
+
+def audit_lottery(lottery_id: str, uow: unit_of_work.AbstractUnitOfWork, trials: int,
+                  batch_size: int = 1_000_000, max_workers: Optional[int] = None) -> dto.LotteryAuditDto:
+    """
+    Replay "trials" draws of a stored lottery and compare the observed first
+    place frequencies with the tickets winning likelyhoods
+    """
+    if trials < 1:
+        raise InvalidLottery(
+            "The number of trials should be >= 1 : {}".format(trials))
+
+    with uow:
+        lottery = uow.lottery.get(lottery_id)
+        lottery_tickets = uow.lottery.get_ticket_columns(lottery_id)
+        delegator_ids = lottery_tickets.delegator_ids
+        winning_likelyhoods = lottery_tickets.winning_likelyhoods
+        seed = lottery.draw_seed()
+        # Lotteries without winners count are drawn as a full weighted permutation
+        full_permutation = lottery.winners_count is None
+
+    if len(delegator_ids) == 0:
+        raise InvalidLottery(
+            "The lottery {} has no ticket".format(lottery_id))
+
+    expected_frequencies = winning_likelyhoods / winning_likelyhoods.sum()
+    observed = lottery_audit.simulate_first_places(
+        expected_frequencies, trials, seed, batch_size=batch_size, max_workers=max_workers,
+        full_permutation=full_permutation)
+    chi_square, degrees_of_freedom, p_value = lottery_audit.chi_square_test(
+        observed, expected_frequencies)
+
+    logger.info("Audit of lottery {} : {} trials, chi2 {} - p-value {}".format(
+        lottery_id, trials, chi_square, p_value))
+
+    return dto.LotteryAuditDto(
+        uuid=lottery_id,
+        trials=trials,
+        chi_square=chi_square,
+        degrees_of_freedom=degrees_of_freedom,
+        p_value=p_value,
+        tickets=[dto.LotteryAuditTicketDto(
+            delegator_id=delegator_id,
+            expected_frequency=expected_frequency,
+            observed_frequency=observed_count / trials,
+        ) for delegator_id, expected_frequency, observed_count
+            in zip(delegator_ids, expected_frequencies.tolist(), observed.tolist())]
+    )
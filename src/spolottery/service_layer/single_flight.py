@@ -0,0 +1,70 @@
+import asyncio
+import concurrent.futures
+import threading
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlightMetrics:
+    def __init__(self):
+        self.misses = 0  # calls which ran the fetch
+        self.hits = 0  # calls coalesced with a fetch already in flight
+
+    def serialize(self, in_flight: int) -> dict:
+        calls = self.misses + self.hits
+        return {
+            'calls': calls,
+            'misses': self.misses,
+            'hits': self.hits,
+            'hit_ratio': self.hits / calls if calls else 0.0,
+            'in_flight': in_flight,
+        }
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls sharing a key : the first caller runs the fetch,
+    the callers arriving while it is in flight await the same result.
+
+    Calls are tracked with concurrent futures so callers running in other
+    event loops (one by Flask request thread) are coalesced too. Results are
+    shared, callers must not mutate them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight: Dict[Hashable, concurrent.futures.Future] = {}
+        self.metrics = SingleFlightMetrics()
+
+    async def do(self, key: Hashable, fetch: Callable[[], Awaitable[T]]) -> T:
+        with self._lock:
+            future = self._in_flight.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = concurrent.futures.Future()
+                self._in_flight[key] = future
+                self.metrics.misses += 1
+            else:
+                self.metrics.hits += 1
+
+        if not is_leader:
+            # Shielded : a cancelled follower mustn't cancel the shared fetch
+            return await asyncio.shield(asyncio.wrap_future(future))
+
+        try:
+            result = await fetch()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def serialize_metrics(self) -> dict:
+        with self._lock:
+            in_flight = len(self._in_flight)
+        return self.metrics.serialize(in_flight)
@@ -0,0 +1,370 @@
+"""
+Cardano service reading a stake snapshot file instead of Blockfrost.
+
+Supported snapshots, optionally gzip compressed (".gz") :
+- CSV of stake_address,pool_id,epoch,amount rows (header optional)
+- JSON Lines of {"stake_address", "pool_id", "epoch", "amount"} objects
+- cardano-cli "query ledger-state" JSON, streamed with the optional ijson
+  package : its mark, set and go stake snapshots give the three last epochs
+
+Files are streamed twice and never loaded : a first pass keeps the delegators
+of the lottery pool, a second one keeps the history of those delegators only.
+Memory is bounded by the pool size, not by the snapshot size.
+"""
+import asyncio
+import csv
+import gzip
+import io
+import json
+import logging
+from typing import AsyncIterator, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from spolottery.domain import models
+from spolottery.service_layer.cardano_service import AbstractCardanoService
+
+log = logging.getLogger(__name__)
+
+
+class SnapshotFormatError(Exception):
+    pass
+
+
+class StakeRecord(NamedTuple):
+    address_id: str
+    pool_id: str
+    epoch_no: int
+    amount: int
+
+
+BECH32_CHARSET = "qpzry9x8gf2tvdw0s3jn54khce6mua7l"
+CSV_COLUMNS = {
+    "address_id": ("stake_address", "address", "address_id"),
+    "pool_id": ("pool_id", "pool"),
+    "epoch_no": ("epoch", "epoch_no", "active_epoch"),
+    "amount": ("amount", "stake"),
+}
+# Ledger state stake snapshots, and the epoch they are active in relative to "lastEpoch"
+LEDGER_SNAPSHOTS = (("pstakeGo", -1), ("pstakeSet", 0), ("pstakeMark", 1))
+
+
+def _bech32_polymod(values: Iterable[int]) -> int:
+    generator = (0x3b6a57b2, 0x26508e6d, 0x1ea119fa, 0x3d4233dd, 0x2a1462b3)
+    checksum = 1
+    for value in values:
+        top = checksum >> 25
+        checksum = (checksum & 0x1ffffff) << 5 ^ value
+        for i in range(5):
+            checksum ^= generator[i] if ((top >> i) & 1) else 0
+    return checksum
+
+
+def _bech32_hrp_expand(hrp: str) -> List[int]:
+    return [ord(x) >> 5 for x in hrp] + [0] + [ord(x) & 31 for x in hrp]
+
+
+def _convert_bits(data: Iterable[int], from_bits: int, to_bits: int, pad: bool) -> List[int]:
+    accumulator, bits, result = 0, 0, []
+    max_value = (1 << to_bits) - 1
+    for value in data:
+        accumulator = (accumulator << from_bits) | value
+        bits += from_bits
+        while bits >= to_bits:
+            bits -= to_bits
+            result.append((accumulator >> bits) & max_value)
+    if pad and bits:
+        result.append((accumulator << (to_bits - bits)) & max_value)
+    elif not pad and (bits >= from_bits or ((accumulator << (to_bits - bits)) & max_value)):
+        raise ValueError("Invalid bech32 padding")
+    return result
+
+
+def bech32_encode(hrp: str, payload: bytes) -> str:
+    data = _convert_bits(payload, 8, 5, True)
+    polymod = _bech32_polymod(_bech32_hrp_expand(hrp) + data + [0] * 6) ^ 1
+    checksum = [(polymod >> 5 * (5 - i)) & 31 for i in range(6)]
+    return hrp + "1" + "".join(BECH32_CHARSET[d] for d in data + checksum)
+
+
+def bech32_decode(value: str) -> Tuple[str, bytes]:
+    hrp, _, data = value.lower().rpartition("1")
+    if not hrp or len(data) < 6 or any(c not in BECH32_CHARSET for c in data):
+        raise ValueError("Invalid bech32 string : {}".format(value))
+    data = [BECH32_CHARSET.index(c) for c in data]
+    if _bech32_polymod(_bech32_hrp_expand(hrp) + data) != 1:
+        raise ValueError("Invalid bech32 checksum : {}".format(value))
+    return hrp, bytes(_convert_bits(data[:-6], 5, 8, False))
+
+
+def stake_address_id(credential: str, mainnet: bool = True) -> str:
+    """
+    Bech32 stake address of a ledger state credential ("keyHash-<hex>" or "scriptHash-<hex>")
+    """
+    kind, _, credential_hash = credential.partition("-")
+    header = (0xf0 if kind == "scriptHash" else 0xe0) | (1 if mainnet else 0)
+    return bech32_encode("stake" if mainnet else "stake_test", bytes([header]) + bytes.fromhex(credential_hash))
+
+
+def pool_hex(pool_id: str) -> str:
+    return bech32_decode(pool_id)[1].hex()
+
+
+def _open_text(path: str) -> io.TextIOBase:
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", newline="")
+    return open(path, newline="")
+
+
+def _open_binary(path: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def iter_csv_records(path: str) -> Iterator[StakeRecord]:
+    with _open_text(path) as snapshot_file:
+        reader = csv.reader(snapshot_file)
+        first_row = next(reader, None)
+        if first_row is None:
+            return
+        positions = (0, 1, 2, 3)
+        if len(first_row) < 4 or not first_row[2].strip().isdigit():
+            header = [column.strip().lower() for column in first_row]
+            try:
+                positions = tuple(next(header.index(name) for name in names if name in header)
+                                  for names in CSV_COLUMNS.values())
+            except StopIteration:
+                raise SnapshotFormatError("CSV snapshot header should name the columns {} : {}".format(
+                    ", ".join(names[0] for names in CSV_COLUMNS.values()), first_row))
+            first_row = None
+
+        rows = reader if first_row is None else _chain_row(first_row, reader)
+        address_position, pool_position, epoch_position, amount_position = positions
+        for row in rows:
+            if row:
+                yield StakeRecord(row[address_position], row[pool_position], int(row[epoch_position]),
+                                  int(row[amount_position]))
+
+
+def _chain_row(first_row: list, rows: Iterator[list]) -> Iterator[list]:
+    yield first_row
+    yield from rows
+
+
+def iter_jsonl_records(path: str) -> Iterator[StakeRecord]:
+    with _open_text(path) as snapshot_file:
+        for line in snapshot_file:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            values = [next((record[name] for name in names if name in record), None)
+                      for names in CSV_COLUMNS.values()]
+            if None in values:
+                raise SnapshotFormatError("JSON Lines snapshot record should have the keys {} : {}".format(
+                    ", ".join(names[0] for names in CSV_COLUMNS.values()), line.strip()))
+            address_id, pool_id, epoch_no, amount = values
+            yield StakeRecord(address_id, pool_id, int(epoch_no), int(amount))
+
+
+class StakeSnapshotFile:
+    """
+    Records of a CSV or JSON Lines snapshot, read again for each pass
+    """
+
+    def __init__(self, path: str, reader: Callable[[str], Iterator[StakeRecord]]):
+        self.path = path
+        self.reader = reader
+
+    def pool_ids(self) -> Set[str]:
+        return {record.pool_id for record in self.reader(self.path)}
+
+    def pool_delegators(self, pool_id: str) -> Tuple[int, List[models.Delegator]]:
+        """
+        Latest epoch of the snapshot and the delegators of the pool at this epoch
+        """
+        latest_epoch = None
+        # Latest (epoch, amount) of each address delegated to the pool at some point
+        pool_stakes: Dict[str, Tuple[int, int]] = {}
+        for record in self.reader(self.path):
+            if latest_epoch is None or record.epoch_no > latest_epoch:
+                latest_epoch = record.epoch_no
+            if record.pool_id == pool_id:
+                pool_stake = pool_stakes.get(record.address_id)
+                if pool_stake is None or record.epoch_no > pool_stake[0]:
+                    pool_stakes[record.address_id] = (record.epoch_no, record.amount)
+
+        return latest_epoch, [models.Delegator(address_id=address_id, live_stake=amount)
+                              for address_id, (epoch_no, amount) in pool_stakes.items()
+                              if epoch_no == latest_epoch]
+
+    def delegations(self, address_ids: Set[str]) -> Iterator[Tuple[str, models.Delegation]]:
+        for record in self.reader(self.path):
+            if record.address_id in address_ids:
+                yield record.address_id, models.Delegation(pool_id=record.pool_id, amount=record.amount,
+                                                           epoch_no=record.epoch_no)
+
+    def latest_epoch(self) -> Optional[int]:
+        return max((record.epoch_no for record in self.reader(self.path)), default=None)
+
+
+class LedgerStateFile:
+    """
+    cardano-cli "query ledger-state" JSON : stake and delegations maps of
+    the mark, set and go snapshots, keyed by "keyHash-<hex>" credentials,
+    pools by hex id. Streamed with ijson, one snapshot map at a time.
+    """
+
+    def __init__(self, path: str, mainnet: bool = True):
+        self.path = path
+        self.mainnet = mainnet
+        self._last_epoch = None
+
+    @staticmethod
+    def _ijson():
+        try:
+            import ijson
+        except ImportError:
+            raise SnapshotFormatError("Reading a ledger state needs the ijson package : pip install ijson")
+        return ijson
+
+    def _snapshot(self, name: str, field: str) -> Iterator[Tuple[str, object]]:
+        ijson = self._ijson()
+        with _open_binary(self.path) as snapshot_file:
+            yield from ijson.kvitems(snapshot_file, "stateBefore.esSnapshots.{}.{}".format(name, field),
+                                     use_float=True)
+
+    def _epoch_no(self, epoch_offset: int) -> int:
+        if self._last_epoch is None:
+            ijson = self._ijson()
+            with _open_binary(self.path) as snapshot_file:
+                self._last_epoch = next((int(value) for prefix, event, value in ijson.parse(snapshot_file)
+                                         if prefix == "lastEpoch" and event == "number"), None)
+            if self._last_epoch is None:
+                raise SnapshotFormatError("No lastEpoch in the ledger state {}".format(self.path))
+        return self._last_epoch + epoch_offset
+
+    def _credentials(self, address_ids: Set[str]) -> Dict[str, str]:
+        """
+        Ledger state credential of each stake address
+        """
+        credentials = {}
+        for address_id in address_ids:
+            payload = bech32_decode(address_id)[1]
+            kind = "scriptHash" if payload[0] & 0x10 else "keyHash"
+            credentials["{}-{}".format(kind, payload[1:].hex())] = address_id
+        return credentials
+
+    def latest_epoch(self) -> int:
+        return self._epoch_no(LEDGER_SNAPSHOTS[-1][1])
+
+    def pool_ids(self) -> Set[str]:
+        pools = {pool for _, pool in self._snapshot("pstakeMark", "delegations")}
+        return {bech32_encode("pool", bytes.fromhex(pool)) for pool in pools}
+
+    def pool_delegators(self, pool_id: str) -> Tuple[int, List[models.Delegator]]:
+        target_pool = pool_hex(pool_id)
+        credentials = {credential for credential, pool in self._snapshot("pstakeMark", "delegations")
+                       if pool == target_pool}
+        delegators = [models.Delegator(address_id=stake_address_id(credential, self.mainnet), live_stake=int(amount))
+                      for credential, amount in self._snapshot("pstakeMark", "stake") if credential in credentials]
+        return self.latest_epoch(), delegators
+
+    def delegations(self, address_ids: Set[str]) -> Iterator[Tuple[str, models.Delegation]]:
+        credentials = self._credentials(address_ids)
+        for name, epoch_offset in LEDGER_SNAPSHOTS:
+            epoch_no = self._epoch_no(epoch_offset)
+            pools = {credential: pool for credential, pool in self._snapshot(name, "delegations")
+                     if credential in credentials}
+            for credential, amount in self._snapshot(name, "stake"):
+                pool = pools.get(credential)
+                if pool is not None:
+                    yield credentials[credential], models.Delegation(
+                        pool_id=bech32_encode("pool", bytes.fromhex(pool)), amount=int(amount), epoch_no=epoch_no)
+
+
+def open_snapshot(path: str, snapshot_format: Optional[str] = None, mainnet: bool = True):
+    """
+    Snapshot reader of a "csv", "jsonl" or "ledger-state" file, guessed from
+    the file extension when snapshot_format isn't given
+    """
+    if snapshot_format is None:
+        name = path[:-3] if path.endswith(".gz") else path
+        if name.endswith(".csv"):
+            snapshot_format = "csv"
+        elif name.endswith((".jsonl", ".ndjson")):
+            snapshot_format = "jsonl"
+        elif name.endswith(".json"):
+            snapshot_format = "ledger-state"
+
+    if snapshot_format == "csv":
+        return StakeSnapshotFile(path, iter_csv_records)
+    if snapshot_format == "jsonl":
+        return StakeSnapshotFile(path, iter_jsonl_records)
+    if snapshot_format == "ledger-state":
+        return LedgerStateFile(path, mainnet)
+    raise SnapshotFormatError("Unknown snapshot format for {} : {}".format(path, snapshot_format))
+
+
+class SnapshotCardanoService(AbstractCardanoService):
+    """
+    Cardano service answering from a stake snapshot file, see open_snapshot.
+    Pools have no metadata, delegator histories only hold the epochs of the
+    snapshot. Files are read in a thread to keep the event loop free.
+    """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self._latest_epoch = None
+
+    @classmethod
+    def from_file(cls, path: str, snapshot_format: Optional[str] = None,
+                  mainnet: bool = True) -> "SnapshotCardanoService":
+        return cls(open_snapshot(path, snapshot_format, mainnet))
+
+    async def get_current_epoch(self) -> int:
+        if self._latest_epoch is None:
+            self._latest_epoch = await asyncio.to_thread(self.snapshot.latest_epoch)
+        return self._latest_epoch
+
+    async def get_all_pools(self, pool_ids_stored: Set[str], progress=None) -> List[models.Pool]:
+        pool_ids = await asyncio.to_thread(self.snapshot.pool_ids)
+        pools = [models.Pool(pool_id=pool_id, hex=pool_hex(pool_id), url=None, ticker=None, name=None,
+                             description=None, updated_at=None)
+                 for pool_id in sorted(pool_ids - pool_ids_stored)]
+        if progress is not None:
+            progress(len(pools), len(pools))
+        log.info("{} pools found in the snapshot".format(len(pools)))
+        return pools
+
+    async def get_pool_delegators(self, pool_id: str) -> List[models.Delegator]:
+        latest_epoch, delegators = await asyncio.to_thread(self.snapshot.pool_delegators, pool_id)
+        self._latest_epoch = latest_epoch
+        log.info("{} delegators of {} in the snapshot at epoch {}".format(len(delegators), pool_id, latest_epoch))
+        return delegators
+
+    def _delegators_history(self, delegators: List[models.Delegator],
+                            since_epochs: Dict[str, int]) -> List[models.Delegator]:
+        delegators_by_address = {delegator.address_id: delegator for delegator in delegators}
+        for address_id, delegation in self.snapshot.delegations(set(delegators_by_address)):
+            since_epoch = since_epochs.get(address_id)
+            if since_epoch is None or delegation.epoch_no > since_epoch:
+                delegators_by_address[address_id].add_delegation_history(delegation)
+        return delegators
+
+    async def get_delegators_history(self, delegators: List[models.Delegator],
+                                     since_epochs: Optional[Dict[str, int]] = None,
+                                     window: Optional[models.HistoryWindow] = None) -> List[models.Delegator]:
+        return await asyncio.to_thread(self._delegators_history, delegators, since_epochs or {})
+
+    async def iter_delegators_history(self, delegators_batches: AsyncIterator[List[models.Delegator]],
+                                      since_epochs: Optional[Dict[str, int]] = None,
+                                      window: Optional[models.HistoryWindow] = None
+                                      ) -> AsyncIterator[List[models.Delegator]]:
+        """
+        All the batches share the second pass over the file : batches are
+        only yielded once every history is read
+        """
+        batches = [delegators async for delegators in delegators_batches]
+        delegators = [delegator for batch in batches for delegator in batch]
+        await self.get_delegators_history(delegators, since_epochs, window)
+        for batch in batches:
+            yield batch
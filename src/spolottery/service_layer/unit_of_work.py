@@ -1,16 +1,16 @@
 from __future__ import annotations
 import abc
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm.session import Session
 
 import spolottery.config as config
-from spolottery.adapters import repository
+from spolottery.adapters import engines, repository
 
 
 class AbstractUnitOfWork(abc.ABC):
     pools: repository.AbstractPoolRepository
     lottery: repository.AbstractLotteryRepository
+    delegations: repository.AbstractDelegationRepository
+    jobs: repository.AbstractLotteryJobRepository
 
     def __enter__(self) -> AbstractUnitOfWork:
         return self
@@ -27,27 +27,26 @@ class AbstractUnitOfWork(abc.ABC):
         raise NotImplementedError
 
 
-DEFAULT_SESSION_FACTORY = sessionmaker(
-    bind=create_engine(
-        config.get_postgres_uri(),
-        isolation_level="REPEATABLE READ",
-    )
-)
-
-
 class SqlAlchemyUnitOfWork(AbstractUnitOfWork):
-    def __init__(self, session_factory=DEFAULT_SESSION_FACTORY):
-        self.session_factory = session_factory
+    def __init__(self, session_factory=None):
+        # Shared engine of the lotteries database by default
+        self.session_factory = session_factory if session_factory else engines.get_session_factory()
 
     def __enter__(self):
         self.session = self.session_factory()  # type: Session
         self.pools = repository.SqlAlchemyPoolRepository(self.session)
-        self.lottery = repository.SqlAlchemyLotteryRepository(self.session)
+        self.lottery = repository.SqlAlchemyLotteryRepository(
+            self.session, config.get_lottery_tickets_storage())
+        self.delegations = repository.SqlAlchemyDelegationRepository(
+            self.session)
+        self.jobs = repository.SqlAlchemyLotteryJobRepository(self.session)
         return super().__enter__()
 
     def __exit__(self, *args):
-        super().__exit__(*args)
-        self.session.close()
+        try:
+            super().__exit__(*args)
+        finally:
+            self.session.close()
 
     def commit(self):
         self.session.commit()
@@ -0,0 +1,82 @@
+import time
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import clear_mappers, sessionmaker
+from sqlalchemy.pool import StaticPool
+from starlette.testclient import TestClient
+
+from tests.conftest import make_pool, make_pool_block
+from tests.test_lottery_jobs import make_lottery_input
+from tests.test_services import FakeCardanoService
+from spolottery.adapters import orm
+from spolottery.domain import models
+from spolottery.entrypoints.asgiapp import create_asgi_app
+
+
+@pytest.fixture
+def client():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    orm.metadata.create_all(engine)
+    orm.start_mappers()
+    session_factory = sessionmaker(bind=engine)
+    with session_factory() as session:
+        session.add_all([make_pool(), make_pool_block()])
+        session.commit()
+    app = create_asgi_app(session_factory, FakeCardanoService([make_pool()]))
+    with TestClient(app) as test_client:
+        yield test_client
+    clear_mappers()
+
+
+def test_asgi_pool_filter(client):
+    # Act
+    res = client.post("/pool/filter", json={"pool_filter": "hippo"})
+
+    # Assert
+    assert res.status_code == 200
+    assert [pool["pool_id"] for pool in res.json()["pools"]] == [make_pool().pool_id]
+
+
+def test_asgi_lottery_job_then_lottery(client):
+    # Act
+    res = client.post("/lottery", json={"lottery_details": make_lottery_input().dict()})
+    job_url = res.headers["Location"]
+    deadline = time.monotonic() + 10
+    job = client.get(job_url).json()
+    while job["status"] in (models.LotteryJobStatus.QUEUED.value, models.LotteryJobStatus.RUNNING.value):
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+        job = client.get(job_url).json()
+    lottery_res = client.get("/lottery/{}".format(job["lottery_id"]))
+    tickets_res = client.get("/lottery/{}/tickets".format(job["lottery_id"]), params={"limit": 2})
+    next_tickets_res = client.get("/lottery/{}/tickets".format(job["lottery_id"]),
+                                  params={"after": tickets_res.json()["next_cursor"]})
+    winners_res = client.get("/lottery/{}/winners".format(job["lottery_id"]))
+
+    # Assert
+    assert res.status_code == 202
+    assert job["status"] == models.LotteryJobStatus.SUCCEEDED.value
+    assert lottery_res.status_code == 200
+    assert lottery_res.json()["pool_id"] == make_pool().pool_id
+    assert lottery_res.json()["tickets"] == []
+    assert len(tickets_res.json()["tickets"]) == 2
+    assert len(next_tickets_res.json()["tickets"]) == 1
+    assert next_tickets_res.json()["next_cursor"] is None
+    assert [winner["rank"] for winner in winners_res.json()["winners"]] == [0, 1]
+
+
+def test_asgi_invalid_lottery_and_unknown_job(client):
+    # Act
+    invalid_res = client.post("/lottery", json={"lottery_details": {"pool_id": make_pool().pool_id}})
+    job_res = client.get("/lottery/jobs/unknown")
+    tickets_res = client.get("/lottery/unknown/tickets")
+    metrics_res = client.get("/metrics/http")
+    db_pool_res = client.get("/metrics/db_pool")
+
+    # Assert
+    assert invalid_res.status_code == 400
+    assert job_res.status_code == 404
+    assert tickets_res.json() == {"message": "No Lottery found"}
+    assert metrics_res.status_code == 404
+    assert db_pool_res.status_code == 200
@@ -0,0 +1,228 @@
+import asyncio
+
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+import spolottery.config as config
+from spolottery.domain import models
+from spolottery.service_layer.cardano_service import BlockFrostCardanoService, MaxPoolDelegators
+from spolottery.service_layer.rate_limiter import TokenBucket
+
+POOL_ID = "pool1wx83tmlwtxw5nzn4stz02655pnltllq5apgx2mdc6557zw0r78g"
+ANOTHER_POOL_ID = "pool1cc76kmtcpf6vht32ya5ke9er74dnpy4jh5qpy4klqwp87ygdsu6"
+ADDRESSES = [f"stake1u{i:052d}" for i in range(3)]
+REGISTERED_POOL_IDS = [f"pool1{i:054d}" for i in range(305)]
+POOL_DELEGATORS = [{"address": f"stake1u{i:052d}", "live_stake": str(1000 + i)} for i in range(250)]
+
+
+def account_history(address_id):
+    # 250 epochs, delegated to another pool before epoch 300
+    return [{"active_epoch": epoch, "amount": str(1000 * epoch),
+             "pool_id": POOL_ID if epoch >= 300 else ANOTHER_POOL_ID}
+            for epoch in range(400, 150, -1)]
+
+
+@pytest_asyncio.fixture
+async def fake_blockfrost():
+    pages_served = []
+    delegators_pages_served = []
+
+    async def history(request):
+        address_id = request.match_info["address_id"]
+        count = int(request.query["count"])
+        page = int(request.query["page"])
+        assert request.query["order"] == "desc"
+        pages_served.append((address_id, page))
+        return web.json_response(account_history(address_id)[(page - 1) * count:page * count])
+
+    async def pools(request):
+        count = int(request.query["count"])
+        page = int(request.query["page"])
+        return web.json_response(REGISTERED_POOL_IDS[(page - 1) * count:page * count])
+
+    async def pool_metadata(request):
+        pool_id = request.match_info["pool_id"]
+        # One pool out of ten never registered its metadata
+        if int(pool_id[-2:]) % 10 == 0:
+            return web.json_response({})
+        return web.json_response({"pool_id": pool_id, "hex": "00", "url": None, "hash": None,
+                                  "ticker": pool_id[-4:], "name": f"Pool {pool_id[-4:]}",
+                                  "description": None, "homepage": None})
+
+    async def pool(request):
+        pool_id = request.match_info["pool_id"]
+        if pool_id == REGISTERED_POOL_IDS[7]:
+            return web.json_response({"error": "Internal Server Error"}, status=500)
+        return web.json_response({"pool_id": pool_id, "owners": [f"stake1_{pool_id}"]})
+
+    async def pool_delegators(request):
+        count = int(request.query["count"])
+        page = int(request.query["page"])
+        delegators_pages_served.append(page)
+        return web.json_response(POOL_DELEGATORS[(page - 1) * count:page * count])
+
+    app = web.Application()
+    app.router.add_get("/pools/{pool_id}/delegators", pool_delegators)
+    app.router.add_get("/accounts/{address_id}/history", history)
+    app.router.add_get("/pools", pools)
+    app.router.add_get("/pools/{pool_id}/metadata", pool_metadata)
+    app.router.add_get("/pools/{pool_id}", pool)
+    server = TestServer(app)
+    await server.start_server()
+    server.pages_served = pages_served
+    server.delegators_pages_served = delegators_pages_served
+    yield server
+    await server.close()
+
+
+def make_service(fake_blockfrost):
+    cardano_service = BlockFrostCardanoService(
+        config, rate_limiter=TokenBucket(rate=1000, burst=1000))
+    cardano_service.api_url = str(fake_blockfrost.make_url(""))
+    cardano_service.api_account_url = str(
+        fake_blockfrost.make_url("/accounts/"))
+    return cardano_service
+
+
+@pytest.mark.asyncio
+async def test_get_delegators_history_pages_every_delegator(fake_blockfrost):
+    cardano_service = make_service(fake_blockfrost)
+    delegators = [models.Delegator(address_id) for address_id in ADDRESSES]
+
+    delegators = await cardano_service.get_delegators_history(delegators)
+
+    for delegator in delegators:
+        assert len(delegator.delegation_history) == 250
+    assert len(fake_blockfrost.pages_served) == 3 * 3
+    await cardano_service.aclose()
+
+
+@pytest.mark.asyncio
+async def test_get_delegators_history_stops_once_window_is_covered(fake_blockfrost):
+    cardano_service = make_service(fake_blockfrost)
+    delegators = [models.Delegator(address_id) for address_id in ADDRESSES]
+    window = models.HistoryWindow.for_lottery(POOL_ID, 320, 60)
+
+    delegators = await cardano_service.get_delegators_history(delegators, window=window)
+
+    # Epochs 400 -> 201 cover epochs 260 -> 320 and the 61th delegation to the pool
+    assert sorted(page for _, page in fake_blockfrost.pages_served) == [
+        1, 1, 1, 2, 2, 2]
+    for delegator in delegators:
+        assert len(delegator.delegation_history) == 200
+        assert delegator.delegation_history.covered_from == 201
+        assert models.is_eligible(delegator, POOL_ID, 400, 100)
+    await cardano_service.aclose()
+
+
+@pytest.mark.asyncio
+async def test_get_delegators_history_reads_every_epoch_newer_than_stored(fake_blockfrost):
+    cardano_service = make_service(fake_blockfrost)
+    delegators = [models.Delegator(ADDRESSES[0])]
+    window = models.HistoryWindow.for_lottery(POOL_ID, 320, 60)
+
+    delegators = await cardano_service.get_delegators_history(delegators, {ADDRESSES[0]: 160}, window)
+
+    # No early stop once the window is covered : the stored history would miss epochs 161 -> 200
+    assert len(delegators[0].delegation_history) == 240
+    assert delegators[0].delegation_history.covered_from is None
+    await cardano_service.aclose()
+
+
+@pytest.mark.asyncio
+async def test_get_delegators_history_stops_at_stored_epoch(fake_blockfrost, monkeypatch):
+    cardano_service = make_service(fake_blockfrost)
+
+    async def current_epoch():
+        return 400
+    monkeypatch.setattr(cardano_service, "get_current_epoch", current_epoch)
+    delegators = [models.Delegator(address_id) for address_id in ADDRESSES]
+    since_epochs = {ADDRESSES[0]: 395, ADDRESSES[1]: 400}
+
+    delegators = await cardano_service.get_delegators_history(delegators, since_epochs)
+
+    assert [len(delegator.delegation_history) for delegator in delegators] == [
+        5, 0, 250]
+    assert {address_id for address_id, _ in fake_blockfrost.pages_served} == {
+        ADDRESSES[0], ADDRESSES[2]}
+    await cardano_service.aclose()
+
+
+@pytest.mark.asyncio
+async def test_get_all_pools_synchronizes_pools_not_stored(fake_blockfrost):
+    cardano_service = make_service(fake_blockfrost)
+    pool_ids_stored = set(REGISTERED_POOL_IDS[:5])
+    progress = []
+
+    pools = await cardano_service.get_all_pools(pool_ids_stored, progress=lambda done, total: progress.append((done, total)))
+
+    # 300 pools to fetch, 30 without metadata, 1 failing on its owners
+    expected_pool_ids = {pool_id for pool_id in REGISTERED_POOL_IDS[5:]
+                         if int(pool_id[-2:]) % 10 != 0 and pool_id != REGISTERED_POOL_IDS[7]}
+    assert {pool.pool_id for pool in pools} == expected_pool_ids
+    for pool in pools:
+        assert pool.owner_addresses == {f"stake1_{pool.pool_id}"}
+    assert progress[-1] == (300, 300)
+    assert len(progress) == 300
+    assert cardano_service.http_metrics()["peak_in_flight"] <= cardano_service.http_client.max_connections
+    await cardano_service.aclose()
+
+
+@pytest.mark.asyncio
+async def test_iter_pool_delegators_yields_batches(fake_blockfrost):
+    cardano_service = make_service(fake_blockfrost)
+
+    batches = [batch async for batch in cardano_service.iter_pool_delegators(POOL_ID, 120)]
+
+    assert [len(batch) for batch in batches] == [120, 120, 10]
+    assert [delegator.live_stake for batch in batches for delegator in batch] == [
+        int(delegator["live_stake"]) for delegator in POOL_DELEGATORS]
+    await cardano_service.aclose()
+
+
+@pytest.mark.asyncio
+async def test_get_pool_delegators_keeps_the_cap(fake_blockfrost):
+    cardano_service = make_service(fake_blockfrost)
+
+    assert len(await cardano_service.get_pool_delegators(POOL_ID)) == 250
+
+    cardano_service.max_delegators_allowed = 200
+    with pytest.raises(MaxPoolDelegators):
+        await cardano_service.get_pool_delegators(POOL_ID)
+    await cardano_service.aclose()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_lotteries_share_delegators_and_histories_requests(fake_blockfrost):
+    cardano_service = make_service(fake_blockfrost)
+    window = models.HistoryWindow.for_lottery(POOL_ID, 320, 60)
+
+    async def fetch_delegators_with_history():
+        delegators = [delegator async for batch in cardano_service.iter_pool_delegators(POOL_ID, 1000)
+                      for delegator in batch]
+        return await cardano_service.get_delegators_history(delegators[:3], window=window)
+
+    first, second = await asyncio.gather(fetch_delegators_with_history(), fetch_delegators_with_history())
+
+    # Same requests as a single lottery : 3 histories of 2 pages
+    assert len(fake_blockfrost.pages_served) == 6
+    assert [len(d.delegation_history) for d in first] == [len(d.delegation_history) for d in second]
+    metrics = cardano_service.single_flight_metrics()
+    assert metrics['hits'] == metrics['misses']
+    await cardano_service.aclose()
+
+
+@pytest.mark.asyncio
+async def test_iter_pool_delegators_reads_the_epoch_snapshot_once(fake_blockfrost):
+    cardano_service = make_service(fake_blockfrost)
+
+    first = [d.address_id async for batch in cardano_service.iter_pool_delegators(POOL_ID, 100) for d in batch]
+    count_pages_served = len(fake_blockfrost.delegators_pages_served)
+    second = [d.address_id async for batch in cardano_service.iter_pool_delegators(POOL_ID, 100) for d in batch]
+
+    assert first == second == [delegator["address"] for delegator in POOL_DELEGATORS]
+    assert len(fake_blockfrost.delegators_pages_served) == count_pages_served
+    assert cardano_service.delegators_cache_metrics()['hits'] == 1
+    await cardano_service.aclose()
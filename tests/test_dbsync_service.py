@@ -0,0 +1,111 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.pool import StaticPool
+
+from spolottery.devtools import dbsync_fixture
+from spolottery.domain import models
+from spolottery.service_layer.dbsync_service import DbSyncCardanoService
+
+POOL_ID = "pool1fake00000000000000000000000000000000000000000000000"
+ANOTHER_POOL_ID = "pool1fake00000000000000000000000000000000000000000000001"
+CURRENT_EPOCH = 400
+
+
+@pytest.fixture
+def dbsync_engine():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    dbsync_fixture.metadata.create_all(engine)
+    with engine.begin() as connection:
+        dbsync_fixture.populate_synthetic(connection, count_pools=2, count_delegators=30,
+                                          history_epochs=50, current_epoch=CURRENT_EPOCH)
+    return engine
+
+
+def make_address_id(pool_index, delegator_index):
+    return f"stake1ufake{pool_index:06d}{delegator_index:042d}"
+
+
+@pytest.mark.asyncio
+async def test_get_pool_delegators_with_live_stake(dbsync_engine):
+    first_address_id = make_address_id(0, 0)
+    with dbsync_engine.begin() as connection:
+        # Part of the first delegator outputs spent, rewards partly withdrawn
+        connection.execute(dbsync_fixture.tx_out.insert(), [
+            {"tx_id": 999, "index": 0, "stake_address_id": 1, "value": 5_000_000},
+            {"tx_id": 999, "index": 1, "stake_address_id": 1, "value": 7_000_000}])
+        connection.execute(dbsync_fixture.tx_in.insert(), [{"tx_in_id": 1000, "tx_out_id": 999, "tx_out_index": 1}])
+        connection.execute(dbsync_fixture.reward.insert(), [
+            {"addr_id": 1, "type": "member", "amount": 3_000_000, "spendable_epoch": CURRENT_EPOCH, "pool_id": 1},
+            {"addr_id": 1, "type": "member", "amount": 1_000_000, "spendable_epoch": CURRENT_EPOCH + 1,
+             "pool_id": 1}])
+        connection.execute(dbsync_fixture.withdrawal.insert(), [{"addr_id": 1, "amount": 2_000_000, "tx_id": 1001}])
+        # Second delegator left the pool, third one deregistered its stake key
+        connection.execute(dbsync_fixture.delegation.insert(), [
+            {"addr_id": 2, "pool_hash_id": 2, "active_epoch_no": CURRENT_EPOCH, "tx_id": 2 * 10 ** 7}])
+        connection.execute(dbsync_fixture.stake_deregistration.insert(), [
+            {"addr_id": 3, "tx_id": 2 * 10 ** 7, "epoch_no": CURRENT_EPOCH}])
+        utxo = connection.execute(
+            dbsync_fixture.tx_out.select().where(dbsync_fixture.tx_out.c.tx_id == 1)).fetchone().value
+    cardano_service = DbSyncCardanoService(dbsync_engine)
+
+    delegators = await cardano_service.get_pool_delegators(POOL_ID)
+
+    address_ids = [delegator.address_id for delegator in delegators]
+    assert len(delegators) == 28
+    assert make_address_id(0, 1) not in address_ids and make_address_id(0, 2) not in address_ids
+    first_delegator = next(d for d in delegators if d.address_id == first_address_id)
+    assert first_delegator.live_stake == utxo + 5_000_000 + 3_000_000 - 2_000_000
+
+
+@pytest.mark.asyncio
+async def test_get_delegators_history_matches_epoch_stake(dbsync_engine):
+    cardano_service = DbSyncCardanoService(dbsync_engine)
+    delegators = await cardano_service.get_pool_delegators(POOL_ID)
+
+    delegators = await cardano_service.get_delegators_history(delegators)
+
+    assert await cardano_service.get_current_epoch() == CURRENT_EPOCH
+    for delegator in delegators:
+        assert len(delegator.delegation_history) == 50
+        assert delegator.delegation_history.last_epoch == CURRENT_EPOCH
+
+
+@pytest.mark.asyncio
+async def test_get_delegators_history_window_and_stored_epochs(dbsync_engine):
+    cardano_service = DbSyncCardanoService(dbsync_engine)
+    full_histories = await cardano_service.get_delegators_history(
+        await cardano_service.get_pool_delegators(POOL_ID))
+    window = models.HistoryWindow.for_lottery(POOL_ID, CURRENT_EPOCH, 5)
+
+    delegators = await cardano_service.get_pool_delegators(POOL_ID)
+    stored_address_id = delegators[0].address_id
+    delegators = await cardano_service.get_delegators_history(
+        delegators, since_epochs={stored_address_id: CURRENT_EPOCH - 1}, window=window)
+
+    assert len(delegators[0].delegation_history) == 1
+    assert delegators[0].delegation_history.covered_from is None
+    for delegator, full_history in zip(delegators[1:], full_histories[1:]):
+        if len(delegator.delegation_history) < len(full_history.delegation_history):
+            # Read from the window only : stored as such
+            assert delegator.delegation_history.covered_from == window.min_epoch - 1
+        # Same lottery inputs as the whole history
+        assert models.is_eligible(delegator, POOL_ID, CURRENT_EPOCH, 5) == \
+            models.is_eligible(full_history, POOL_ID, CURRENT_EPOCH, 5)
+        assert models.first_delegation_amount(delegator, POOL_ID, 5) == \
+            models.first_delegation_amount(full_history, POOL_ID, 5)
+    assert any(delegator.delegation_history.covered_from is not None for delegator in delegators)
+
+
+@pytest.mark.asyncio
+async def test_get_all_pools_with_owners(dbsync_engine):
+    with dbsync_engine.begin() as connection:
+        connection.execute(dbsync_fixture.pool_owner.insert(), [{"addr_id": 1, "pool_update_id": 1}])
+    cardano_service = DbSyncCardanoService(dbsync_engine)
+
+    pools = await cardano_service.get_all_pools({ANOTHER_POOL_ID})
+
+    assert [pool.pool_id for pool in pools] == [POOL_ID]
+    assert pools[0].name == "Fake Pool 0"
+    assert pools[0].ticker == "F0000"
+    assert pools[0].hex == bytes(28).hex()
+    assert pools[0].owner_addresses == {make_address_id(0, 0)}
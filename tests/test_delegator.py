@@ -1,5 +1,9 @@
-from spolottery.domain.models import Pool, Delegator, Delegation, first_delegation_amount, is_eligible
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
+from spolottery.domain.models import Pool, Delegator, Delegation, DelegationHistory, first_delegation_amount, is_eligible
+
+from spolottery.domain.delegations import intern_pool_id, interned_pool_ids
 from tests.conftest import make_pool, make_delegator_with_delegation_history
 
 
@@ -70,3 +74,59 @@ def test_delegator_first_delegation_amount_another_pool_id():
         )
         == 300000
     )
+
+
+def test_delegation_history_stays_sorted_by_epoch():
+    # Arrange
+    pool = make_pool()
+    stake_address = "stake1uyfy0mj0n57wl87tj6anj2mhge40n3tjhwx0exj9r7k97egvjq0z4"
+    delegator = make_delegator_with_delegation_history(pool, stake_address)
+
+    # Act
+    delegator.add_delegation_history(
+        Delegation(pool_id=pool.pool_id, amount=5000, epoch_no=302))
+    delegator.add_delegation_history(
+        Delegation(pool_id=pool.pool_id, amount=5000, epoch_no=302))
+
+    # Assert
+    assert [d.epoch_no for d in delegator.delegation_history] == [
+        300, 302, 305, 307, 308]
+    assert [d.epoch_no for d in reversed(delegator.delegation_history)] == [
+        308, 307, 305, 302, 300]
+    assert [d.epoch_no for d in delegator.delegation_history.window(302, 307)] == [
+        302, 305, 307]
+    assert [d.epoch_no for d in delegator.delegation_history.since(305)] == [
+        307, 308]
+    assert delegator.delegation_history.last_epoch == 308
+    assert Delegation(pool_id=pool.pool_id, amount=5000,
+                      epoch_no=302) in delegator.delegation_history
+
+
+def test_delegator_and_delegation_use_slots():
+    # Arrange
+    pool = make_pool()
+    stake_address = "stake1uyfy0mj0n57wl87tj6anj2mhge40n3tjhwx0exj9r7k97egvjq0z4"
+    delegator = make_delegator_with_delegation_history(pool, stake_address)
+
+    # Act / Assert
+    assert not hasattr(delegator, "__dict__")
+    assert not hasattr(next(iter(delegator.delegation_history)), "__dict__")
+    assert isinstance(delegator.delegation_history, DelegationHistory)
+
+
+def test_pool_ids_interned_once_across_threads():
+    # Arrange
+    pool_ids = ["pool1concurrent{:04d}".format(i) for i in range(200)]
+    barrier = threading.Barrier(8)
+
+    def intern_all():
+        barrier.wait()
+        return [intern_pool_id(pool_id) for pool_id in pool_ids]
+
+    # Act
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda _: intern_all(), range(8)))
+
+    # Assert
+    assert all(indexes == results[0] for indexes in results)
+    assert [interned_pool_ids()[index] for index in results[0]] == pool_ids
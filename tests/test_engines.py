@@ -0,0 +1,86 @@
+import pytest
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from spolottery.adapters import engines
+from spolottery.service_layer import unit_of_work
+
+
+@pytest.fixture
+def db_uri(tmp_path, monkeypatch):
+    monkeypatch.setattr(engines, "_engines", {})
+    monkeypatch.setattr(engines, "_session_factories", {})
+    yield "sqlite:///{}".format(tmp_path / "lottery.db")
+    engines.dispose_engines()
+
+
+def test_engine_shared_by_url(db_uri):
+    # Act
+    engine = engines.get_engine(db_uri)
+
+    # Assert
+    assert engines.get_engine(db_uri) is engine
+    assert engines.get_session_factory(db_uri).kw["bind"] is engine
+    assert engines.get_engine("sqlite://") is not engine
+
+
+def test_engine_pool_from_config(db_uri, monkeypatch):
+    # Arrange
+    monkeypatch.setenv("DB_POOL_SIZE", "2")
+    monkeypatch.setenv("DB_MAX_OVERFLOW", "3")
+    monkeypatch.setenv("DB_POOL_RECYCLE", "60")
+
+    # Act
+    engine = engines.get_engine(db_uri)
+
+    # Assert
+    assert isinstance(engine.pool, engines.InstrumentedQueuePool)
+    assert engine.pool.size() == 2
+    assert engine.pool._max_overflow == 3
+    assert engine.pool._recycle == 60
+    assert engine.pool._pre_ping
+
+
+def test_pool_metrics_checkouts_and_timeouts(db_uri, monkeypatch):
+    # Arrange
+    monkeypatch.setenv("DB_POOL_SIZE", "1")
+    monkeypatch.setenv("DB_MAX_OVERFLOW", "0")
+    monkeypatch.setenv("DB_POOL_TIMEOUT", "0.05")
+    engine = engines.get_engine(db_uri)
+
+    # Act
+    with engine.connect():
+        with pytest.raises(PoolTimeoutError):
+            engine.connect()
+    with engine.connect():
+        pass
+    metrics = engines.pool_metrics()[repr(engine.url)]
+
+    # Assert
+    assert metrics["checkouts"] == 2
+    assert metrics["checkout_timeouts"] == 1
+    assert metrics["saturated_checkouts"] == 1
+    assert metrics["checked_out"] == 0
+    assert metrics["pool_saturation"] == 0.0
+
+
+def test_uow_closes_session_when_rollback_fails():
+    # Arrange
+    class FailingSession:
+        closed = False
+
+        def rollback(self):
+            raise RuntimeError("connection lost")
+
+        def close(self):
+            self.closed = True
+
+    session = FailingSession()
+    uow = unit_of_work.SqlAlchemyUnitOfWork(lambda: session)
+
+    # Act
+    with pytest.raises(RuntimeError):
+        with uow:
+            pass
+
+    # Assert
+    assert session.closed
@@ -0,0 +1,81 @@
+from datetime import datetime, timezone
+
+import spolottery.config as config
+from spolottery.service_layer.delegators_cache import DelegatorsSnapshot, DelegatorsSnapshotCache
+from spolottery.service_layer.epoch_clock import EpochClock
+from spolottery.domain import models
+
+SHELLEY_START = datetime(2020, 7, 29, 21, 44, 51, tzinfo=timezone.utc).timestamp()
+
+
+class FakeClock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def make_epoch_clock(now):
+    epoch_clock = EpochClock.from_config(config)
+    epoch_clock.clock = FakeClock(now)
+    return epoch_clock
+
+
+def make_snapshot(count_delegators):
+    snapshot = DelegatorsSnapshot()
+    snapshot.extend(models.Delegator(f"stake1u{i:052d}", live_stake=i)
+                    for i in range(count_delegators))
+    return snapshot
+
+
+def test_epoch_clock_follows_shelley_epochs():
+    epoch_clock = make_epoch_clock(SHELLEY_START)
+
+    assert epoch_clock.current_epoch() == 208
+
+    epoch_clock.clock.now = SHELLEY_START + 432000 - 1
+    assert epoch_clock.current_epoch() == 208
+    assert epoch_clock.seconds_to_next_epoch() == 1
+
+    # Epoch 400 started on 2023-03-16 21:44:51 UTC
+    epoch_clock.clock.now = datetime(2023, 3, 17, tzinfo=timezone.utc).timestamp()
+    assert epoch_clock.current_epoch() == 400
+    assert epoch_clock.epoch_start(400) == datetime(2023, 3, 16, 21, 44, 51, tzinfo=timezone.utc).timestamp()
+
+
+def test_delegators_cache_invalidated_when_epoch_advances():
+    epoch_clock = make_epoch_clock(SHELLEY_START)
+    cache = DelegatorsSnapshotCache(epoch_clock, max_bytes=10 ** 6)
+    cache.put("pool1", 208, make_snapshot(3))
+
+    assert [d.address_id for batch in cache.get("pool1").batches(2) for d in batch] == [
+        f"stake1u{i:052d}" for i in range(3)]
+
+    epoch_clock.clock.now += 432000
+    assert cache.get("pool1") is None
+    # Snapshot read during the last epoch isn't stored anymore
+    cache.put("pool1", 208, make_snapshot(3))
+    assert cache.get("pool1") is None
+    assert cache.serialize_metrics()['invalidations'] == 1
+    assert cache.serialize_metrics()['bytes'] == 0
+
+
+def test_delegators_cache_evicts_least_recently_used_under_budget():
+    epoch_clock = make_epoch_clock(SHELLEY_START)
+    snapshot_size = make_snapshot(100).size
+    cache = DelegatorsSnapshotCache(epoch_clock, max_bytes=2 * snapshot_size)
+
+    cache.put("pool1", 208, make_snapshot(100))
+    cache.put("pool2", 208, make_snapshot(100))
+    cache.get("pool1")
+    cache.put("pool3", 208, make_snapshot(100))
+    # Over the budget on its own
+    cache.put("pool4", 208, make_snapshot(300))
+
+    assert cache.get("pool2") is None
+    assert cache.get("pool1") is not None
+    assert cache.get("pool3") is not None
+    assert cache.get("pool4") is None
+    assert cache.serialize_metrics()['evictions'] == 1
+    assert cache.serialize_metrics()['bytes'] <= 2 * snapshot_size
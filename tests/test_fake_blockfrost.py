@@ -0,0 +1,74 @@
+import pytest
+import pytest_asyncio
+from aiohttp.test_utils import TestServer
+
+import spolottery.config as config
+from spolottery.devtools.fake_blockfrost import FaultInjection, RecordedData, SyntheticData, create_app
+from spolottery.service_layer import cardano_service as cardano_service_module
+from spolottery.service_layer.cardano_service import BlockFrostCardanoService
+from spolottery.service_layer.rate_limiter import TokenBucket
+
+CURRENT_EPOCH = 400
+
+
+async def start_fake_blockfrost(data, faults=None):
+    server = TestServer(create_app(data, faults))
+    await server.start_server()
+    return server
+
+
+def make_service(server, monkeypatch):
+    monkeypatch.setenv("BLOCKFROST_API_URL", str(server.make_url("")))
+    return BlockFrostCardanoService(config, rate_limiter=TokenBucket(rate=1000, burst=1000))
+
+
+@pytest_asyncio.fixture
+async def synthetic_blockfrost():
+    server = await start_fake_blockfrost(SyntheticData(
+        count_pools=25, count_delegators=230, history_epochs=30, current_epoch=CURRENT_EPOCH))
+    yield server
+    await server.close()
+
+
+def test_blockfrost_api_url_setting(monkeypatch):
+    monkeypatch.setenv("BLOCKFROST_API_URL", "http://localhost:8081/")
+
+    cardano_service = BlockFrostCardanoService(config)
+
+    assert cardano_service.api_url == "http://localhost:8081/v0"
+    assert cardano_service.api_account_url == "http://localhost:8081/v0/accounts/"
+
+
+@pytest.mark.asyncio
+async def test_service_reads_synthetic_registry(synthetic_blockfrost, monkeypatch):
+    cardano_service = make_service(synthetic_blockfrost, monkeypatch)
+    data = synthetic_blockfrost.app["data"]
+
+    pools = await cardano_service.get_all_pools(set())
+    delegators = await cardano_service.get_pool_delegators(data.pool_ids()[0])
+    delegators = await cardano_service.get_delegators_history(delegators[:10])
+
+    # Pool 19 has no metadata
+    assert len(pools) == 24
+    assert len(delegators) == 10
+    assert all(len(delegator.delegation_history) == 30 for delegator in delegators)
+    assert all(delegator.delegation_history.last_epoch == CURRENT_EPOCH for delegator in delegators)
+    await cardano_service.aclose()
+
+
+@pytest.mark.asyncio
+async def test_service_recovers_from_injected_rate_limiting(monkeypatch):
+    monkeypatch.setattr(cardano_service_module, "backoff_delay", lambda attempt, retry_after: 0)
+    data = RecordedData(SyntheticData(count_pools=3, count_delegators=150, history_epochs=5,
+                                      current_epoch=CURRENT_EPOCH).to_fixture())
+    server = await start_fake_blockfrost(data, FaultInjection(rate_limited_rate=0.1, retry_after=0, seed=1))
+    cardano_service = make_service(server, monkeypatch)
+
+    delegators = await cardano_service.get_pool_delegators(data.pool_ids()[1])
+    delegators = await cardano_service.get_delegators_history(delegators)
+
+    assert len(delegators) == 150
+    assert all(len(delegator.delegation_history) == 5 for delegator in delegators)
+    assert server.app["stats"]["rate_limited_count"] > 0
+    await cardano_service.aclose()
+    await server.close()
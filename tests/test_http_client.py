@@ -0,0 +1,64 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from spolottery.service_layer.http_client import HttpClientManager
+
+
+@pytest_asyncio.fixture
+async def local_server():
+    async def ok(request):
+        await asyncio.sleep(0.01)
+        return web.json_response({"ok": True})
+
+    app = web.Application()
+    app.router.add_get("/ok", ok)
+    server = TestServer(app)
+    await server.start_server()
+    yield server
+    await server.close()
+
+
+@pytest.mark.asyncio
+async def test_http_client_reuses_connections(local_server):
+    http_client = HttpClientManager(max_connections=2)
+
+    for _ in range(5):
+        r = await http_client.get(str(local_server.make_url("/ok")))
+        assert r.status_code == 200
+    await asyncio.gather(*[http_client.get(str(local_server.make_url("/ok"))) for _ in range(6)])
+
+    metrics = http_client.serialize_metrics()
+    assert metrics["requests"] == 11
+    assert metrics["connections_opened"] == 2
+    assert metrics["peak_in_flight"] == 6
+    assert metrics["pool_saturated_requests"] == 4
+    assert metrics["clients_created"] == 1
+
+    await http_client.aclose()
+    assert http_client.serialize_metrics()["clients"] == 0
+
+
+def test_http_client_one_client_by_loop_across_threads():
+    http_client = HttpClientManager()
+    barrier = threading.Barrier(8)
+
+    async def get_clients():
+        return {id(http_client.get_client()) for _ in range(50)}
+
+    def run_loop():
+        barrier.wait()
+        return asyncio.run(get_clients())
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        clients = list(executor.map(lambda _: run_loop(), range(8)))
+
+    assert all(len(loop_clients) == 1 for loop_clients in clients)
+    assert http_client.serialize_metrics()["clients_created"] == 8
+    http_client.close()
+    assert http_client.serialize_metrics()["clients"] == 0
@@ -0,0 +1,92 @@
+import numpy as np
+
+from spolottery.domain import models
+from spolottery.service_layer import services
+from spolottery.service_layer.lottery_audit import simulate_first_places, chi_square_test, chi_square_survival
+from tests.conftest import make_lottery
+from tests.test_services import FakeUnitOfWork
+
+
+def test_simulate_first_places_is_reproducible():
+    winning_likelyhoods = np.array([0.5, 0.25, 0.25])
+
+    observed = simulate_first_places(
+        winning_likelyhoods, 10_000, seed=42, batch_size=3_000, max_workers=1)
+    same_observed = simulate_first_places(
+        winning_likelyhoods, 10_000, seed=42, batch_size=3_000, max_workers=1)
+
+    assert observed.sum() == 10_000
+    assert observed.tolist() == same_observed.tolist()
+
+
+def test_simulate_first_places_with_process_pool():
+    winning_likelyhoods = np.array([0.5, 0.25, 0.25])
+
+    observed = simulate_first_places(
+        winning_likelyhoods, 10_000, seed=42, batch_size=3_000, max_workers=1)
+    pooled_observed = simulate_first_places(
+        winning_likelyhoods, 10_000, seed=42, batch_size=3_000, max_workers=2)
+
+    assert observed.tolist() == pooled_observed.tolist()
+
+
+def test_chi_square_test_detects_unfair_draws():
+    expected_frequencies = np.array([0.5, 0.25, 0.25])
+
+    _, degrees_of_freedom, fair_p_value = chi_square_test(
+        np.array([5020, 2490, 2490]), expected_frequencies)
+    _, _, unfair_p_value = chi_square_test(
+        np.array([3400, 3300, 3300]), expected_frequencies)
+
+    assert degrees_of_freedom == 2
+    assert fair_p_value > 0.5
+    assert unfair_p_value < 1e-10
+
+
+def test_chi_square_survival_known_values():
+    assert abs(chi_square_survival(3.841458820694124, 1) - 0.05) < 1e-9
+    assert abs(chi_square_survival(10, 10) - 0.4404932850652124) < 1e-9
+    assert chi_square_survival(0, 3) == 1.0
+
+
+def test_audit_lottery():
+    lottery = make_lottery(with_tickets=True)
+    uow = FakeUnitOfWork([], [lottery])
+
+    lottery_audit_dto = services.audit_lottery(
+        lottery.uuid, uow, 20_000, max_workers=1)
+
+    assert lottery_audit_dto.trials == 20_000
+    assert lottery_audit_dto.p_value > 1e-4
+    for ticket, lottery_ticket in zip(lottery_audit_dto.tickets, lottery.lottery_tickets):
+        assert ticket.delegator_id == lottery_ticket.delegator_id
+        assert abs(ticket.observed_frequency - ticket.expected_frequency) < 0.02
+
+
+def test_simulate_first_places_replays_winners_draw():
+    winning_likelyhoods = np.array([0.5, 0.25, 0.25])
+    seed_sequence = np.random.SeedSequence(42).spawn(1)[0]
+
+    observed = simulate_first_places(winning_likelyhoods, 1, seed=42, max_workers=1)
+    first_place = models.weighted_sample_without_replacement(
+        np.random.default_rng(seed_sequence), winning_likelyhoods, 1)
+
+    assert observed.tolist() == np.bincount(first_place, minlength=3).tolist()
+
+
+def test_audit_lottery_flags_biased_draw(monkeypatch):
+    lottery = make_lottery(with_tickets=True)
+    lottery.winners_count = 2
+    uow = FakeUnitOfWork([], [lottery])
+    efraimidis_spirakis_keys = models.efraimidis_spirakis_keys
+
+    def biased_keys(rng, weights, trials=None):
+        # Planted bug : heavier tickets win more often than their likelyhood
+        return efraimidis_spirakis_keys(rng, weights ** 2, trials)
+
+    fair_audit_dto = services.audit_lottery(lottery.uuid, uow, 20_000, max_workers=1)
+    monkeypatch.setattr(models, "efraimidis_spirakis_keys", biased_keys)
+    biased_audit_dto = services.audit_lottery(lottery.uuid, uow, 20_000, max_workers=1)
+
+    assert fair_audit_dto.p_value > 1e-4
+    assert biased_audit_dto.p_value < 1e-10
@@ -0,0 +1,206 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import clear_mappers, sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from tests.conftest import make_pool
+from tests.test_services import FakeCardanoService
+from spolottery.adapters import dto, orm, repository
+from spolottery.domain import models
+from spolottery.service_layer import services, unit_of_work
+from spolottery.service_layer.lottery_jobs import LotteryJobWorkerPool
+
+
+@pytest.fixture
+def uow_factory():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    orm.metadata.create_all(engine)
+    orm.start_mappers()
+    session_factory = sessionmaker(bind=engine)
+    with session_factory() as session:
+        session.add(make_pool())
+        session.commit()
+    yield lambda: unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    clear_mappers()
+
+
+def make_lottery_input(pool_id=None):
+    draw_date = (datetime.now(timezone.utc) - timedelta(days=1)).isoformat()
+    return dto.LotteryInputDto(
+        pool_id=pool_id if pool_id else make_pool().pool_id, start_epoch=306, end_epoch=308, count_epochs=2,
+        min_live_stake=0, draw_date=draw_date, lottery_strategy_name=models.LotteryStrategyType.FIXED.value,
+        owners_allowed=True, lottery_name="Job lottery", winners_count=2)
+
+
+def make_worker_pool(uow_factory, **kwargs):
+    return LotteryJobWorkerPool(uow_factory, FakeCardanoService([make_pool()]), workers=1, poll_interval=0.05,
+                                **kwargs)
+
+
+def test_lottery_job_created_by_worker(uow_factory):
+    # Arrange
+    job_dto = services.submit_lottery_job(make_lottery_input(), uow_factory())
+    worker_pool = make_worker_pool(uow_factory)
+    loop = asyncio.new_event_loop()
+
+    # Act
+    ran = worker_pool.run_next(loop)
+    loop.close()
+
+    # Assert
+    assert ran
+    assert job_dto.status == models.LotteryJobStatus.QUEUED.value
+    job_dto = services.get_lottery_job(job_dto.job_id, uow_factory())
+    assert job_dto.status == models.LotteryJobStatus.SUCCEEDED.value
+    assert job_dto.phase == models.LotteryJobPhase.DONE.value
+    assert job_dto.attempts == 1
+    assert job_dto.progress_done == 0 and job_dto.progress_total == 3
+    with uow_factory() as uow:
+        lottery = uow.lottery.get(job_dto.lottery_id)
+        assert len(lottery.lottery_tickets) == 3
+        assert len(lottery.winners) == 2
+
+
+def test_lottery_job_failure_is_reported(uow_factory):
+    # Arrange
+    job_dto = services.submit_lottery_job(make_lottery_input(pool_id="pool1unknown"), uow_factory())
+    loop = asyncio.new_event_loop()
+
+    # Act
+    make_worker_pool(uow_factory).run_next(loop)
+    loop.close()
+
+    # Assert
+    job_dto = services.get_lottery_job(job_dto.job_id, uow_factory())
+    assert job_dto.status == models.LotteryJobStatus.FAILED.value
+    assert job_dto.lottery_id is None
+    assert job_dto.error
+
+
+def serialization_failure(*args, **kwargs):
+    raise OperationalError("UPDATE lottery_jobs", {}, Exception("could not serialize access due to concurrent update"))
+
+
+def test_lottery_job_survives_job_updates_failures(uow_factory, monkeypatch):
+    # Arrange : progress never saved, finish rejected once
+    job_dto = services.submit_lottery_job(make_lottery_input(), uow_factory())
+    finish = repository.SqlAlchemyLotteryJobRepository.finish
+    finish_calls = []
+
+    def finish_after_failure(self, *args, **kwargs):
+        finish_calls.append(args)
+        if len(finish_calls) == 1:
+            serialization_failure()
+        return finish(self, *args, **kwargs)
+
+    monkeypatch.setattr(repository.SqlAlchemyLotteryJobRepository, "update_progress", serialization_failure)
+    monkeypatch.setattr(repository.SqlAlchemyLotteryJobRepository, "finish", finish_after_failure)
+    monkeypatch.setattr(services, "backoff_delay", lambda *args, **kwargs: 0)
+    loop = asyncio.new_event_loop()
+
+    # Act
+    make_worker_pool(uow_factory).run_next(loop)
+    loop.close()
+
+    # Assert
+    job_dto = services.get_lottery_job(job_dto.job_id, uow_factory())
+    assert len(finish_calls) == 2
+    assert job_dto.status == models.LotteryJobStatus.SUCCEEDED.value
+    assert job_dto.lottery_id == job_dto.job_id
+
+
+def test_lottery_job_run_again_after_lost_finish_creates_lottery_once(uow_factory, monkeypatch):
+    # Arrange : the lottery is saved but the job stays running, then is requeued
+    job_dto = services.submit_lottery_job(make_lottery_input(), uow_factory())
+    finish = repository.SqlAlchemyLotteryJobRepository.finish
+    monkeypatch.setattr(repository.SqlAlchemyLotteryJobRepository, "finish", serialization_failure)
+    monkeypatch.setattr(services, "backoff_delay", lambda *args, **kwargs: 0)
+    loop = asyncio.new_event_loop()
+    with pytest.raises(OperationalError):
+        make_worker_pool(uow_factory).run_next(loop)
+    monkeypatch.setattr(repository.SqlAlchemyLotteryJobRepository, "finish", finish)
+    with uow_factory() as uow:
+        requeued = uow.jobs.requeue_stale(datetime.utcnow() + timedelta(minutes=1), 3, datetime.utcnow())
+        uow.commit()
+
+    # Act
+    ran = make_worker_pool(uow_factory).run_next(loop)
+    loop.close()
+
+    # Assert
+    assert requeued == 1 and ran
+    job_dto = services.get_lottery_job(job_dto.job_id, uow_factory())
+    assert job_dto.status == models.LotteryJobStatus.SUCCEEDED.value
+    assert job_dto.attempts == 2
+    with uow_factory() as uow:
+        assert [lottery.uuid for lottery in uow.lottery.list()] == [job_dto.job_id]
+
+
+def test_lottery_job_workers_threads(uow_factory):
+    # Arrange
+    worker_pool = make_worker_pool(uow_factory)
+    worker_pool.start()
+
+    # Act
+    job_dto = services.submit_lottery_job(make_lottery_input(), uow_factory())
+    worker_pool.notify()
+    deadline = time.monotonic() + 10
+    while services.get_lottery_job(job_dto.job_id, uow_factory()).status in (
+            models.LotteryJobStatus.QUEUED.value, models.LotteryJobStatus.RUNNING.value):
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    worker_pool.stop()
+
+    # Assert
+    assert services.get_lottery_job(job_dto.job_id, uow_factory()).status == models.LotteryJobStatus.SUCCEEDED.value
+
+
+def test_lottery_job_claimed_once(uow_factory):
+    # Arrange
+    services.submit_lottery_job(make_lottery_input(), uow_factory())
+    now = datetime.utcnow()
+
+    # Act
+    with uow_factory() as uow:
+        job_id = uow.jobs.claim("worker-1", now).uuid
+        uow.commit()
+    with uow_factory() as uow:
+        other_job = uow.jobs.claim("worker-2", now)
+        updated_by_other = uow.jobs.update_progress(job_id, "worker-2", "saving", 1, 1, now)
+        uow.commit()
+
+    # Assert
+    assert other_job is None
+    assert not updated_by_other
+
+
+def test_stale_lottery_job_requeued_then_failed(uow_factory):
+    # Arrange
+    job_dto = services.submit_lottery_job(make_lottery_input(), uow_factory())
+    started_at = datetime.utcnow() - timedelta(hours=1)
+
+    # Act/Assert : the worker died twice
+    for attempt in range(1, 3):
+        with uow_factory() as uow:
+            assert uow.jobs.claim("dead-worker", started_at).attempts == attempt
+            uow.commit()
+        assert make_worker_pool(uow_factory, stale_after=60, max_attempts=2).keep_alive() == 1
+        job_dto = services.get_lottery_job(job_dto.job_id, uow_factory())
+        if attempt == 1:
+            assert job_dto.status == models.LotteryJobStatus.QUEUED.value
+    assert job_dto.status == models.LotteryJobStatus.FAILED.value
+
+
+def test_lottery_jobs_queue_bounded(uow_factory, monkeypatch):
+    # Arrange
+    monkeypatch.setenv("LOTTERY_JOBS_MAX_QUEUED", "1")
+    services.submit_lottery_job(make_lottery_input(), uow_factory())
+
+    # Act/Assert
+    with pytest.raises(services.TooManyLotteryJobs):
+        services.submit_lottery_job(make_lottery_input(), uow_factory())
@@ -1,6 +1,7 @@
 from datetime import datetime, timedelta, timezone
 from zoneinfo import ZoneInfo
 
+import numpy as np
 import pytest
 
 from tests.conftest import make_pool, make_delegator_with_delegation_history, make_lottery
@@ -9,8 +10,13 @@ from spolottery.domain.models import (
     LotteryTicket,
     LotteryStrategyFactory,
     prepare_lottery_tickets_list,
+    LotteryTicketsBuilder,
     OutOfDelegator,
     LotteryWinner,
+    weighted_sample_without_replacement,
+    is_delegator_pool_owner,
+    Delegator,
+    PoolOwner,
 )
 
 
@@ -31,6 +37,78 @@ def test_run_lottery_draw():
     }
 
 
+def test_run_lottery_draw_top_k_winners():
+    # Arrange
+    lottery = make_lottery(with_tickets=True)
+    lottery.winners_count = 2
+    same_lottery = make_lottery(with_tickets=True)
+    same_lottery.winners_count = 2
+
+    # Act
+    lottery.raffle_draw()
+    same_lottery.raffle_draw()
+
+    # Assert
+    assert len(lottery.winners) == 2
+    assert sorted(winner.rank for winner in lottery.winners) == [0, 1]
+    assert lottery.winners == same_lottery.winners
+
+
+def test_run_lottery_draw_winners_count_above_tickets_count():
+    # Arrange
+    lottery = make_lottery(with_tickets=True)
+    lottery.winners_count = 10
+
+    # Act
+    lottery.raffle_draw()
+
+    # Assert
+    assert len(lottery.winners) == len(lottery.lottery_tickets)
+
+
+def test_run_lottery_draw_winners_count_above_positive_tickets_count():
+    # Arrange
+    lottery = make_lottery(with_tickets=True)
+    lottery.winners_count = 10
+    zero_ticket = lottery.lottery_tickets[-1]
+    zero_ticket.winning_likelyhood = 0
+
+    # Act
+    lottery.raffle_draw()
+
+    # Assert
+    assert len(lottery.winners) == len(lottery.lottery_tickets) - 1
+    assert zero_ticket.delegator_id not in {winner.delegator_address_id for winner in lottery.winners}
+
+
+def test_weighted_sample_without_replacement_never_draws_zero_weights():
+    # Arrange
+    weights = np.array([0.5, 0.5, 0.0, 0.0])
+
+    # Act
+    ranked = weighted_sample_without_replacement(np.random.default_rng(0), weights, 3)
+
+    # Assert
+    assert sorted(ranked.tolist()) == [0, 1]
+
+
+def test_weighted_sample_without_replacement_follows_weights():
+    # Arrange
+    weights = np.array([0.5, 0.3, 0.2, 0.0])
+    first_places = np.zeros(len(weights))
+
+    # Act
+    for seed in range(4000):
+        ranked = weighted_sample_without_replacement(
+            np.random.default_rng(seed), weights, 3)
+        first_places[ranked[0]] += 1
+        assert len(set(ranked.tolist())) == 3
+        assert 3 not in ranked
+
+    # Assert
+    assert np.allclose(first_places / first_places.sum(), weights, atol=0.03)
+
+
 def test_lottery_lottery_result_not_available():
     # Arrange/ Act
     lottery = make_lottery(with_tickets=True)
@@ -224,6 +302,25 @@ def test_prepare_stake_lottery_tickets_1_delegator():
         assert lottery_ticket.winning_likelyhood == expected_probabilitlies
 
 
+def test_lottery_tickets_builder_batches_match_single_batch():
+    # Arrange
+    delegators, lottery, pool = create_lottery_tickets_x_delegator(2, "Stake")
+    expected_probabilitlies = [0.3003992015968064, 0.6996007984031936]
+    lottery_tickets_builder = LotteryTicketsBuilder(lottery)
+
+    # Act
+    for delegator in delegators:
+        lottery_tickets_builder.add_batch([delegator])
+    lottery_tickets = lottery_tickets_builder.build(pool)
+
+    # Assert
+    assert lottery_tickets_builder.count_delegators == 2
+    assert [lt.winning_likelyhood for lt in lottery_tickets] == expected_probabilitlies
+    # Histories are dropped once a batch is reduced
+    assert all(len(delegator.delegation_history) == 0
+               for delegator in lottery.lottery_strategy.delegators)
+
+
 def test_is_pool_a_match():
     pool = make_pool()
 
@@ -234,3 +331,21 @@ def test_is_pool_a_match():
         "pool1wx83tmlwtxw5nzn4stz02655pnltllq5apgx2mdc6557zw0r78g") == True
     assert pool.is_pool_a_match(
         "pool1wx83tmlwtxw5nzn4stz02655pnltllq5apgx2mdc6557zw0r781") == False
+
+
+def test_pool_owner_addresses_reset_on_add_pool_owner():
+    pool = make_pool()
+    delegator = Delegator(
+        "stake1u9yrn7z2g0ynx4wtpqfuv7fj3uuasavtzg6ulfv2f647jhcluzuur")
+
+    assert is_delegator_pool_owner(delegator, pool) == False
+
+    pool.add_pool_owner(PoolOwner(
+        address_id=delegator.address_id, pool_id=pool.pool_id))
+
+    assert is_delegator_pool_owner(delegator, pool) == True
+    assert pool.owner_addresses == {
+        "stake1uyfy0mj0n57wl87tj6anj2mhge40n3tjhwx0exj9r7k97egvjq0z4",
+        "stake1ux393u69v33gl9pumdaxdu9kpmresdnjc76gjnfphmj8uqq5jvh6c",
+        delegator.address_id,
+    }
@@ -0,0 +1,44 @@
+from spolottery.service_layer.pool_search import PoolSearchIndex
+from tests.conftest import make_pool, make_pool_block, make_fake_duplicate_hippo_pool
+
+
+def make_search_index():
+    search_index = PoolSearchIndex()
+    search_index.build(
+        [make_pool(), make_pool_block(), make_fake_duplicate_hippo_pool()])
+    return search_index
+
+
+def test_search_index_matches_is_pool_a_match():
+    pools = [make_pool(), make_pool_block(), make_fake_duplicate_hippo_pool()]
+    search_index = make_search_index()
+
+    for pool_filter in ["Hippo", "hippo", "HIPPO", "Hippo1", "ip", "k", "blocks", "fake",
+                        "pool1wx83tmlwtxw5nzn4stz02655pnltllq5apgx2mdc6557zw0r78g",
+                        "pool1wx83tmlwtxw5nzn4stz02655pnltllq5apgx2mdc6557zw0r781"]:
+        expected = {pool for pool in pools if pool.is_pool_a_match(pool_filter)}
+
+        assert set(search_index.search(pool_filter)) == expected
+
+
+def test_search_index_ranks_and_limits_results():
+    search_index = make_search_index()
+    hippo_pool = make_pool()
+
+    assert search_index.search("hippo") == [
+        hippo_pool, make_fake_duplicate_hippo_pool()]
+    assert search_index.search("hippo", limit=1) == [hippo_pool]
+    assert search_index.search(hippo_pool.pool_id) == [hippo_pool]
+    assert search_index.search("") == []
+
+
+def test_search_index_refreshes_added_pools():
+    search_index = make_search_index()
+    block_pool = make_pool_block()
+    block_pool.name = "Renamed"
+
+    search_index.add([block_pool])
+
+    assert search_index.search("kblocks") == []
+    assert search_index.search("renamed") == [block_pool]
+    assert len(search_index) == 3
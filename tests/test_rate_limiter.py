@@ -0,0 +1,98 @@
+import asyncio
+import time
+
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from spolottery.service_layer import cardano_service
+from spolottery.service_layer.http_client import HttpClientManager
+from spolottery.service_layer.rate_limiter import TokenBucket, backoff_delay
+
+
+@pytest_asyncio.fixture
+async def fake_server():
+    calls = {"ok": 0, "limited": 0}
+
+    async def ok(request):
+        calls["ok"] += 1
+        return web.json_response({"ok": True})
+
+    async def limited(request):
+        # Two 429 before answering
+        calls["limited"] += 1
+        if calls["limited"] <= 2:
+            return web.json_response({"status_code": 429}, status=429, headers={"Retry-After": "1"})
+        return web.json_response({"ok": True})
+
+    app = web.Application()
+    app.router.add_get("/ok", ok)
+    app.router.add_get("/limited", limited)
+    server = TestServer(app)
+    await server.start_server()
+    server.calls = calls
+    yield server
+    await server.close()
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_throughput_tracks_quota(fake_server):
+    rate_limiter = TokenBucket(rate=100, burst=10)
+    http_client = HttpClientManager()
+    url = str(fake_server.make_url("/ok"))
+
+    start = time.monotonic()
+    await asyncio.gather(*[
+        cardano_service.make_one_request(url, i, {}, {}, rate_limiter, i, http_client) for i in range(60)
+    ])
+    elapsed = time.monotonic() - start
+
+    # 10 requests of burst, then 50 requests at 100 requests per second
+    assert fake_server.calls["ok"] == 60
+    assert 0.45 <= elapsed < 1.0
+
+    await http_client.aclose()
+
+
+@pytest.mark.asyncio
+async def test_make_one_request_backs_off_on_429(fake_server, monkeypatch):
+    delays = []
+
+    def fast_backoff_delay(attempt, retry_after=None):
+        delays.append((attempt, retry_after))
+        return 0.01
+
+    monkeypatch.setattr(cardano_service, "backoff_delay", fast_backoff_delay)
+    rate_limiter = TokenBucket(rate=100, burst=10)
+    http_client = HttpClientManager()
+
+    result = await cardano_service.make_one_request(
+        str(fake_server.make_url("/limited")), 1, {}, {}, rate_limiter, "id", http_client)
+
+    assert result["id"] == "id"
+    assert result["result"].status_code == 200
+    assert delays == [(0, 1.0), (1, 1.0)]
+
+    await http_client.aclose()
+
+
+@pytest.mark.asyncio
+async def test_make_one_request_gives_up_after_max_retries(fake_server, monkeypatch):
+    monkeypatch.setattr(cardano_service, "backoff_delay",
+                        lambda attempt, retry_after=None: 0.01)
+    http_client = HttpClientManager()
+
+    with pytest.raises(ValueError, match="429"):
+        await cardano_service.make_one_request(
+            str(fake_server.make_url("/limited")), 1, {}, {}, TokenBucket(rate=100, burst=10), "id", http_client,
+            max_retries=1)
+
+    await http_client.aclose()
+
+
+def test_backoff_delay_respects_retry_after():
+    for attempt in range(6):
+        delay = backoff_delay(attempt, retry_after=5)
+        assert 5 <= delay <= 5 + min(30, 0.5 * 2 ** attempt) * 2
+    assert backoff_delay(10) <= 60
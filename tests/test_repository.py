@@ -1,5 +1,9 @@
+from datetime import timedelta
+
 from spolottery.adapters import repository
-from tests.conftest import make_pool, insert_pool, make_delegator_with_delegation_history, insert_delegator
+from spolottery.domain.models import Delegation, LotteryTicketColumns
+from tests.conftest import make_pool, make_pool_block, insert_pool, make_delegator_with_delegation_history, \
+    insert_delegator, make_lottery
 
 
 # POOL
@@ -29,6 +33,48 @@ def test_repository_retreive_a_pool(session):
     assert pool_id == pool.pool_id
 
 
+def test_repository_upsert_pools_inserts_and_updates_changed_metadata(session):
+
+    pool_repo = repository.SqlAlchemyPoolRepository(session)
+    pool_repo.chunk_size = 1
+
+    assert pool_repo.upsert_multiple([make_pool(), make_pool_block()]) == 2
+    session.commit()
+
+    # Same metadata : nothing written, owners not duplicated
+    assert pool_repo.upsert_multiple([make_pool()]) == 0
+
+    renamed_pool = make_pool_block()
+    renamed_pool.name = "Block Pool renamed"
+    assert pool_repo.upsert_multiple([renamed_pool, make_pool()]) == 1
+    session.commit()
+
+    rows = session.execute('SELECT pool_id, name from "pools" ORDER BY name')
+    assert list(rows) == [(renamed_pool.pool_id, "Block Pool renamed"),
+                          (make_pool().pool_id, make_pool().name)]
+    owners = session.execute('SELECT pool_id, address_id from "pool_owners"')
+    assert len(list(owners)) == len(make_pool().owners) + len(make_pool_block().owners)
+    assert pool_repo.list_ids() == {make_pool().pool_id, renamed_pool.pool_id}
+
+
+def test_repository_pools_revision_changes_with_pools(session):
+    pool_repo = repository.SqlAlchemyPoolRepository(session)
+    empty_revision = pool_repo.get_revision()
+    pool_repo.upsert_multiple([make_pool(), make_pool_block()])
+    session.commit()
+    revision = pool_repo.get_revision()
+
+    renamed_pool = make_pool_block()
+    renamed_pool.name = "Block Pool renamed"
+    renamed_pool.updated_at = renamed_pool.updated_at + timedelta(days=1)
+    pool_repo.upsert_multiple([renamed_pool])
+    session.commit()
+
+    assert empty_revision == (0, None)
+    assert revision[0] == 2
+    assert pool_repo.get_revision() == (2, renamed_pool.updated_at)
+
+
 # Delegator
 
 
@@ -60,3 +106,84 @@ def test_repository_retrieve_a_delegator(session):
     delegator = delegator_repo.get(delegator_id)
 
     assert delegator_id == delegator.address_id
+
+
+# Delegations
+
+
+def test_repository_can_save_and_retrieve_delegations(session):
+
+    pool = make_pool()
+
+    stake_address_delegator1 = "stake1ux393u69v33gl9pumdaxdu9kpmresdnjc76gjnfphmj8uqq5jvh6c"
+    delegator1 = make_delegator_with_delegation_history(
+        pool, stake_address_delegator1)
+
+    delegation_repo = repository.SqlAlchemyDelegationRepository(session)
+
+    delegation_repo.add_multiple(
+        {delegator1.address_id: delegator1.delegation_history})
+    # Already stored delegations are skipped
+    delegation_repo.add_multiple({delegator1.address_id: [
+        Delegation(pool_id=pool.pool_id, amount=1000, epoch_no=308),
+        Delegation(pool_id=pool.pool_id, amount=2000, epoch_no=309),
+    ]})
+    session.commit()
+
+    histories = delegation_repo.get_histories(
+        [stake_address_delegator1, "stake1unknown"])
+
+    assert list(histories) == [stake_address_delegator1]
+    assert [(d.epoch_no, d.amount) for d in histories[stake_address_delegator1]] == [
+        (300, 100000), (305, 200000), (307, 300000), (308, 1000), (309, 2000)]
+
+
+def test_repository_stores_delegation_histories_coverage(session):
+    pool = make_pool()
+    whole_address_id = "stake1ux393u69v33gl9pumdaxdu9kpmresdnjc76gjnfphmj8uqq5jvh6c"
+    partial_address_id = "stake1uyfy0mj0n57wl87tj6anj2mhge40n3tjhwx0exj9r7k97egvjq0z4"
+    legacy_address_id = "stake1u9yrn7z2g0ynx4wtpqfuv7fj3uuasavtzg6ulfv2f647jhcluzuur"
+    delegation_repo = repository.SqlAlchemyDelegationRepository(session)
+    delegation_repo.add_multiple({
+        address_id: make_delegator_with_delegation_history(pool, address_id).delegation_history
+        for address_id in (whole_address_id, partial_address_id, legacy_address_id)})
+    delegation_repo.add_coverages({whole_address_id: 305, partial_address_id: 305})
+    # Fetched again entirely
+    delegation_repo.add_coverages({whole_address_id: None})
+    session.commit()
+
+    histories = delegation_repo.get_histories([whole_address_id, partial_address_id, legacy_address_id])
+
+    assert histories[whole_address_id].covered_from is None
+    assert histories[partial_address_id].covered_from == 305
+    # Stored without coverage : nothing known before the first stored epoch
+    assert histories[legacy_address_id].covered_from == 300
+
+
+# Lottery
+
+
+def test_repository_bulk_saves_lottery_tickets_and_winners(session):
+
+    lottery = make_lottery(with_tickets=True)
+    lottery.winners_count = 2
+    lottery_tickets = LotteryTicketColumns.from_tickets(lottery.lottery_tickets)
+    lottery.lottery_tickets = []
+    winner_ids = lottery.draw_winners(lottery_tickets)
+
+    lottery_repo = repository.SqlAlchemyLotteryRepository(session)
+    lottery_repo.chunk_size = 2
+
+    lottery_repo.add_bulk(lottery, lottery_tickets, winner_ids)
+    session.commit()
+    session.expunge_all()
+
+    lottery_db = lottery_repo.get(lottery.uuid)
+
+    assert lottery_db.name == lottery.name
+    assert [(t.delegator_id, t.winning_likelyhood, t.pool_owner, t.delegator_lottery_stake)
+            for t in sorted(lottery_db.lottery_tickets, key=lambda t: t.id)] == [
+        (delegator_id, winning_likelyhood, True, 0)
+        for delegator_id, winning_likelyhood in zip(lottery_tickets.delegator_ids,
+                                                    lottery_tickets.winning_likelyhoods)]
+    assert [w.delegator_address_id for w in sorted(lottery_db.winners)] == winner_ids
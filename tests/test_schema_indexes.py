@@ -0,0 +1,204 @@
+import os
+from datetime import datetime
+
+from alembic import command
+from alembic.autogenerate import compare_metadata
+from alembic.config import Config
+from alembic.migration import MigrationContext
+from sqlalchemy import create_engine, event, inspect
+
+from spolottery.adapters import orm, repository
+from tests.conftest import make_pool
+
+ALEMBIC_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "alembic")
+MIGRATION_INDEXES = {"ix_lottery_tickets_lottery_id_id", "ix_lottery_winners_lottery_id_rank",
+                     "ix_lotteries_pool_id", "ix_lottery_jobs_status_created_at"}
+
+
+def query_plans(session, run):
+    """
+    SQLite EXPLAIN QUERY PLAN of each statement run by "run"
+    """
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append((statement, parameters))
+
+    engine = session.get_bind()
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        run()
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+
+    connection = session.connection()
+    return [" ".join(row[-1] for row in connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters))
+            for statement, parameters in statements]
+
+
+def test_lottery_pages_use_indexes(session):
+    lottery_repo = repository.SqlAlchemyLotteryRepository(session)
+
+    blob_plan, tickets_plan = query_plans(session, lambda: lottery_repo.list_tickets("lottery-1", 10, 100))
+    winners_plan, = query_plans(session, lambda: lottery_repo.list_winners("lottery-1", None, 100))
+
+    assert "lottery_ticket_blobs USING INDEX" in blob_plan
+    assert "ix_lottery_tickets_lottery_id_id" in tickets_plan
+    assert "ix_lottery_winners_lottery_id_rank" in winners_plan
+    # Rows come in index order, no sort step
+    assert "TEMP B-TREE" not in tickets_plan + winners_plan
+
+
+def test_lottery_job_claim_uses_index(session):
+    job_repo = repository.SqlAlchemyLotteryJobRepository(session)
+
+    plans = query_plans(session, lambda: job_repo.claim("worker-1", datetime.utcnow()))
+
+    assert "ix_lottery_jobs_status_created_at" in plans[0]
+    assert "TEMP B-TREE" not in plans[0]
+
+
+def test_pool_owners_lookup_uses_index(session):
+    session.add(make_pool())
+    session.commit()
+    session.expunge_all()
+    pool = repository.SqlAlchemyPoolRepository(session).get(make_pool().pool_id)
+
+    plans = query_plans(session, lambda: pool.owners)
+
+    # SQLite names the index of the unique constraint itself
+    assert "INDEX" in plans[0] and "(pool_id=?)" in plans[0]
+
+
+def make_migration_config(connection):
+    alembic_config = Config()
+    alembic_config.set_main_option("script_location", ALEMBIC_DIR)
+    alembic_config.attributes["connection"] = connection
+    return alembic_config
+
+
+def test_migration_adds_the_metadata_indexes(tmp_path):
+    engine = create_engine("sqlite:///{}".format(tmp_path / "lottery.db"))
+    orm.metadata.create_all(engine)
+    with engine.begin() as connection:
+        # Tables created before the indexes
+        for name in MIGRATION_INDEXES:
+            connection.exec_driver_sql("DROP INDEX {}".format(name))
+
+    with engine.begin() as connection:
+        command.upgrade(make_migration_config(connection), "head")
+    with engine.connect() as connection:
+        indexes = {index["name"] for table in ("lottery_tickets", "lottery_winners", "lotteries", "lottery_jobs")
+                   for index in inspect(connection).get_indexes(table)}
+        diffs = [diff for diff in compare_metadata(MigrationContext.configure(connection), orm.metadata)
+                 if diff[0] in ("add_index", "remove_index")]
+
+    assert MIGRATION_INDEXES <= indexes
+    assert diffs == []
+
+    with engine.begin() as connection:
+        # Down to the tables, before the lookup indexes
+        command.downgrade(make_migration_config(connection), "8b4daf6e2a53")
+    with engine.connect() as connection:
+        indexes = {index["name"] for index in inspect(connection).get_indexes("lottery_jobs")}
+
+    assert indexes == set()
+
+
+def test_migration_adds_lotteries_winners_count(tmp_path):
+    engine = create_engine("sqlite:///{}".format(tmp_path / "lottery.db"))
+    orm.metadata.create_all(engine)
+    with engine.begin() as connection:
+        # Lotteries table created before winners_count
+        connection.exec_driver_sql("ALTER TABLE lotteries DROP COLUMN winners_count")
+
+    with engine.begin() as connection:
+        command.upgrade(make_migration_config(connection), "head")
+    with engine.connect() as connection:
+        columns = {column["name"] for column in inspect(connection).get_columns("lotteries")}
+
+    assert "winners_count" in columns
+
+
+def test_migration_adds_delegations(tmp_path):
+    engine = create_engine("sqlite:///{}".format(tmp_path / "lottery.db"))
+    orm.metadata.create_all(engine)
+    orm.delegations.drop(engine)
+
+    with engine.begin() as connection:
+        command.upgrade(make_migration_config(connection), "head")
+    with engine.connect() as connection:
+        diffs = [diff for diff in compare_metadata(MigrationContext.configure(connection), orm.metadata)
+                 if diff[0] == "add_table"]
+
+    assert diffs == []
+
+
+def test_migration_adds_pool_owners_unique_constraint(tmp_path):
+    engine = create_engine("sqlite:///{}".format(tmp_path / "lottery.db"))
+    orm.metadata.create_all(engine)
+    with engine.begin() as connection:
+        # Owners table created before the constraint, with an owner stored twice
+        connection.exec_driver_sql("DROP TABLE pool_owners")
+        connection.exec_driver_sql("CREATE TABLE pool_owners (id INTEGER NOT NULL PRIMARY KEY, address_id VARCHAR, "
+                                   "pool_id VARCHAR REFERENCES pools (pool_id))")
+        connection.exec_driver_sql("INSERT INTO pool_owners (address_id, pool_id) "
+                                   "VALUES ('stake1u1', 'pool1'), ('stake1u1', 'pool1'), ('stake1u2', 'pool1')")
+
+    with engine.begin() as connection:
+        command.upgrade(make_migration_config(connection), "head")
+    with engine.connect() as connection:
+        constraints = {constraint["name"] for constraint in inspect(connection).get_unique_constraints("pool_owners")}
+        owners = connection.exec_driver_sql("SELECT id, address_id FROM pool_owners ORDER BY id").fetchall()
+
+    assert "uq_pool_owners_pool_id_address_id" in constraints
+    assert owners == [(1, "stake1u1"), (3, "stake1u2")]
+
+
+def test_migration_adds_lottery_jobs(tmp_path):
+    engine = create_engine("sqlite:///{}".format(tmp_path / "lottery.db"))
+    orm.metadata.create_all(engine)
+    orm.lottery_jobs.drop(engine)
+
+    with engine.begin() as connection:
+        command.upgrade(make_migration_config(connection), "head")
+    with engine.connect() as connection:
+        diffs = compare_metadata(MigrationContext.configure(connection), orm.metadata)
+        indexes = {index["name"] for index in inspect(connection).get_indexes("lottery_jobs")}
+
+    assert [diff for diff in diffs if diff[0] in ("add_table", "add_column", "add_index")] == []
+    assert indexes == {"ix_lottery_jobs_status_created_at"}
+
+
+def test_migrations_upgrade_a_database_created_before_them(tmp_path):
+    engine = create_engine("sqlite:///{}".format(tmp_path / "lottery.db"))
+    orm.metadata.create_all(engine)
+    with engine.begin() as connection:
+        # Schema before the migrations : no winners_count, owners constraint, indexes and newer tables
+        for table in (orm.delegations, orm.delegation_coverages, orm.lottery_jobs, orm.lottery_ticket_blobs):
+            table.drop(connection)
+        for name in MIGRATION_INDEXES - {"ix_lottery_jobs_status_created_at"}:
+            connection.exec_driver_sql("DROP INDEX {}".format(name))
+        connection.exec_driver_sql("ALTER TABLE lotteries DROP COLUMN winners_count")
+        connection.exec_driver_sql("DROP TABLE pool_owners")
+        connection.exec_driver_sql("CREATE TABLE pool_owners (id INTEGER NOT NULL PRIMARY KEY, address_id VARCHAR, "
+                                   "pool_id VARCHAR REFERENCES pools (pool_id))")
+
+    with engine.begin() as connection:
+        command.upgrade(make_migration_config(connection), "head")
+    with engine.connect() as connection:
+        diffs = compare_metadata(MigrationContext.configure(connection), orm.metadata)
+
+    assert diffs == []
+
+
+def test_pool_search_in_database(session):
+    session.add(make_pool())
+    session.commit()
+
+    pool_repo = repository.SqlAlchemyPoolRepository(session)
+
+    assert [pool.pool_id for pool in pool_repo.search("HIPP")] == [make_pool().pool_id]
+    assert pool_repo.search("hip%o") == []
+    assert [pool.pool_id for pool in pool_repo.search(make_pool().pool_id)] == [make_pool().pool_id]
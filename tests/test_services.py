@@ -4,8 +4,9 @@ import pytest
 from spolottery.domain import models
 from spolottery.service_layer import services, unit_of_work
 from tests.conftest import make_delegators, make_pool, make_pool_block, make_fake_duplicate_hippo_pool, make_lottery
-from spolottery.adapters.repository import AbstractPoolRepository, AbstractLotteryRepository
+from spolottery.adapters.repository import AbstractPoolRepository, AbstractLotteryRepository, AbstractDelegationRepository
 from spolottery.service_layer.cardano_service import AbstractCardanoService
+from spolottery.service_layer.pool_search import PoolSearchIndex
 
 
 class FakeSession:
@@ -25,12 +26,27 @@ class FakePoolRepository(AbstractPoolRepository):
     def add_multiple(self, pools: List[models.Pool]):
         self._pools.update(pools)
 
+    def upsert_multiple(self, pools: List[models.Pool]) -> int:
+        # Replace the stored pools by their fresh metadata
+        self._pools.difference_update(pools)
+        self._pools.update(pools)
+        return len(pools)
+
     def get(self, pool_id: str) -> models.Pool:
         return next(p for p in self._pools if p.pool_id == pool_id)
 
     def list(self):
         return self._pools
 
+    def list_ids(self):
+        return {pool.pool_id for pool in self._pools}
+
+    def search(self, pool_filter):
+        return [pool for pool in self._pools if pool.is_pool_a_match(pool_filter)]
+
+    def get_revision(self):
+        return len(self._pools), max((pool.updated_at for pool in self._pools), default=None)
+
 
 class FakeLotteryRepository(AbstractLotteryRepository):
     def __init__(self, lotteries):
@@ -42,14 +58,49 @@ class FakeLotteryRepository(AbstractLotteryRepository):
     def get(self, lottery_id: str) -> models.Lottery:
         return next(lot for lot in self._lotteries if lot.uuid == lottery_id)
 
+    def list_tickets(self, lottery_id, after_id, limit):
+        # Tickets ids are their positions
+        tickets = enumerate(self.get(lottery_id).lottery_tickets)
+        return [(i, t.delegator_id, t.winning_likelyhood, t.pool_owner, t.delegator_lottery_stake)
+                for i, t in tickets if after_id is None or i > after_id][:limit]
+
+    def list_winners(self, lottery_id, after_rank, limit):
+        return [(w.rank, w.delegator_address_id) for w in sorted(self.get(lottery_id).winners)
+                if after_rank is None or w.rank > after_rank][:limit]
+
     def list(self):
         return self._lotteries
 
 
+class FakeDelegationRepository(AbstractDelegationRepository):
+    def __init__(self, delegations, coverages=None):
+        self._delegations = dict(delegations)
+        # Whole histories by default
+        self.coverages = dict(coverages) if coverages else {}
+
+    def add_multiple(self, delegations):
+        for address_id, address_delegations in delegations.items():
+            self._delegations.setdefault(
+                address_id, set()).update(address_delegations)
+
+    def add_coverages(self, coverages):
+        self.coverages.update(coverages)
+
+    def get_histories(self, address_ids):
+        histories = {}
+        for address_id in address_ids:
+            if address_id in self._delegations:
+                histories[address_id] = models.DelegationHistory(self._delegations[address_id])
+                histories[address_id].covered_from = self.coverages.get(address_id)
+        return histories
+
+
 class FakeUnitOfWork(unit_of_work.AbstractUnitOfWork):
-    def __init__(self, pools, lottery):
+    def __init__(self, pools, lottery, delegations=None):
         self.pools = FakePoolRepository(pools)
         self.lottery = FakeLotteryRepository(lottery)
+        self.delegations = FakeDelegationRepository(
+            delegations if delegations else {})
         self.committed = False
 
     def commit(self):
@@ -63,14 +114,17 @@ class FakeCardanoService(AbstractCardanoService):
     def __init__(self, pools):
         self._pools = set(pools)
 
-    async def get_all_pools(self, pool_stored: List[models.Pool]) -> List[models.Pool]:
-        return self._pools
+    async def get_all_pools(self, pool_ids_stored, progress=None) -> List[models.Pool]:
+        self.pool_ids_stored = pool_ids_stored
+        return [pool for pool in self._pools if pool.pool_id not in pool_ids_stored]
 
     async def get_pool_delegators(self, pool_id: str) -> List[models.Delegator]:
         return make_delegators()
 
-    async def get_delegators_history(self, stake_address: str):
-        return make_delegators()
+    async def get_delegators_history(self, delegators, since_epochs=None, window=None):
+        self.since_epochs = since_epochs
+        address_ids = {delegator.address_id for delegator in delegators}
+        return [delegator for delegator in make_delegators() if delegator.address_id in address_ids]
 
 
 def test_return_pools():
@@ -95,6 +149,71 @@ def test_return_pools():
     assert set([hippo_pool, hippo_fake_pool]) == search_hippo_pools
 
 
+@pytest.mark.asyncio
+async def test_search_pool_index_refreshed_after_add_pools():
+    hippo_pool = make_pool()
+    block_pool = make_pool_block()
+
+    uow = FakeUnitOfWork([hippo_pool], [])
+    search_index = PoolSearchIndex()
+    services.build_pool_search_index(uow, search_index)
+
+    assert services.search_pool_index("block", search_index, 10) == []
+
+    await services.add_pools(uow, FakeCardanoService([block_pool]), search_index)
+
+    assert services.search_pool_index("block", search_index, 10) == [block_pool]
+    assert services.search_pool_index("hippo", search_index, 10) == [hippo_pool]
+
+
+def test_search_pool_index_refreshed_when_stored_pools_change():
+    hippo_pool = make_pool()
+    block_pool = make_pool_block()
+
+    uow = FakeUnitOfWork([hippo_pool], [])
+    search_index = PoolSearchIndex()
+    services.build_pool_search_index(uow, search_index)
+
+    # Pools stored by another process
+    uow.pools.upsert_multiple([block_pool])
+
+    assert not services.refresh_pool_search_index(uow, search_index, interval=3600)
+    assert services.search_pool_index("block", search_index, 10) == []
+    assert services.refresh_pool_search_index(uow, search_index, interval=0)
+    assert services.search_pool_index("block", search_index, 10) == [block_pool]
+    assert not services.refresh_pool_search_index(uow, search_index, interval=0)
+
+
+@pytest.mark.asyncio
+async def test_add_pools_fetches_only_pools_not_stored():
+    hippo_pool = make_pool()
+    block_pool = make_pool_block()
+
+    uow = FakeUnitOfWork([hippo_pool], [])
+    cardano_service = FakeCardanoService([hippo_pool, block_pool])
+
+    await services.add_pools(uow, cardano_service)
+
+    assert cardano_service.pool_ids_stored == {hippo_pool.pool_id}
+    assert uow.pools.list_ids() == {hippo_pool.pool_id, block_pool.pool_id}
+    assert uow.committed
+
+
+@pytest.mark.asyncio
+async def test_add_pools_refresh_updates_stored_pools():
+    hippo_pool = make_pool()
+    renamed_hippo_pool = make_pool()
+    renamed_hippo_pool.name = "Hippo Pool renamed"
+
+    uow = FakeUnitOfWork([hippo_pool], [])
+    cardano_service = FakeCardanoService([renamed_hippo_pool])
+
+    await services.add_pools(uow, cardano_service, refresh_stored=True)
+
+    assert cardano_service.pool_ids_stored == set()
+    assert uow.pools.get(hippo_pool.pool_id).name == "Hippo Pool renamed"
+
+
 @pytest.mark.asyncio
 async def test_return_create_lottery():
     hippo_pool = make_pool()
@@ -124,6 +243,31 @@ async def test_return_create_lottery():
     assert lottery_completed.uuid == expected_lottery.uuid
 
 
+@pytest.mark.asyncio
+async def test_create_stake_lottery_streams_delegators_by_batches(monkeypatch):
+    hippo_pool = make_pool()
+    lottery = make_lottery()
+    draw_date_str = lottery.draw_date.strftime(format="%Y-%m-%d %H:%M:%S")
+
+    async def create_lottery():
+        uow = FakeUnitOfWork([hippo_pool], [])
+        lottery_completed = await services.create_lottery(lottery.pool_id, lottery.start_epoch,
+                                                          lottery.end_epoch, lottery.count_epochs,
+                                                          draw_date_str, models.LotteryStrategyType.STAKE.value,
+                                                          True, 0, lottery.name, uow, FakeCardanoService([]))
+        return lottery_completed, uow
+
+    lottery_one_batch, _ = await create_lottery()
+    monkeypatch.setattr(services.config, "delegators_batch_size", 1)
+    lottery_batches, uow = await create_lottery()
+
+    assert [(t.delegator_id, t.winning_likelyhood) for t in lottery_batches.tickets] == \
+        [(t.delegator_id, t.winning_likelyhood) for t in lottery_one_batch.tickets]
+    # Every batch delegations are stored
+    assert set(uow.delegations.get_histories(
+        [d.address_id for d in make_delegators()])) == {d.address_id for d in make_delegators()}
+
+
 @pytest.mark.asyncio
 async def test_return_create_lottery_min_live_stake():
     hippo_pool = make_pool()
@@ -180,3 +324,68 @@ async def test_return_create_lottery_stake_strategy():
     expected_lottery = uow.lottery.get(lottery_completed.uuid)
 
     assert lottery_completed.uuid == expected_lottery.uuid
+
+
+@pytest.mark.asyncio
+async def test_refresh_delegators_history_only_asks_for_new_epochs():
+    stored_delegator = make_delegators()[0]
+    uow = FakeUnitOfWork([], [], {
+        stored_delegator.address_id: set(stored_delegator.delegation_history)})
+    cardano_service = FakeCardanoService([])
+    delegators = [models.Delegator(address_id=stored_delegator.address_id),
+                  models.Delegator(address_id="stake1u9yrn7z2g0ynx4wtpqfuv7fj3uuasavtzg6ulfv2f647jhcluzuur")]
+
+    delegators = await services.refresh_delegators_history(delegators, uow, cardano_service)
+
+    assert cardano_service.since_epochs == {stored_delegator.address_id: 308}
+    stored = uow.delegations.get_histories(
+        [delegator.address_id for delegator in delegators])
+    assert set(stored) == {delegator.address_id for delegator in delegators}
+
+
+@pytest.mark.asyncio
+async def test_refresh_delegators_history_refetches_histories_stored_in_part():
+    stored_delegator = make_delegators()[0]
+    address_id = stored_delegator.address_id
+    uow = FakeUnitOfWork([], [])
+    # Only epochs 305 -> 308 stored, a lottery window once stopped the fetch there
+    uow.delegations.add_multiple({address_id: set(stored_delegator.delegation_history.since(304))})
+    uow.delegations.add_coverages({address_id: 305})
+    cardano_service = FakeCardanoService([])
+    covered_window = models.HistoryWindow.for_lottery(make_pool().pool_id, 308, 1)
+    larger_window = models.HistoryWindow.for_lottery(make_pool().pool_id, 308, 5)
+
+    await services.refresh_delegators_history([models.Delegator(address_id)], uow, cardano_service, covered_window)
+    since_epochs_covered_window = cardano_service.since_epochs
+    uow.delegations.add_coverages({address_id: 305})
+    await services.refresh_delegators_history([models.Delegator(address_id)], uow, cardano_service, larger_window)
+
+    assert since_epochs_covered_window == {address_id: 308}
+    # Epochs older than 305 are needed : fetched again entirely
+    assert cardano_service.since_epochs == {}
+    assert uow.delegations.coverages == {address_id: None}
+    assert len(uow.delegations.get_histories([address_id])[address_id]) == len(stored_delegator.delegation_history)
+
+
+@pytest.mark.asyncio
+async def test_lottery_tickets_and_winners_pages():
+    uow = FakeUnitOfWork([make_pool()], [])
+    lottery = make_lottery()
+    draw_date_str = lottery.draw_date.strftime(format="%Y-%m-%d %H:%M:%S")
+    lottery_completed = await services.create_lottery(lottery.pool_id, lottery.start_epoch,
+                                                      lottery.end_epoch, lottery.count_epochs,
+                                                      draw_date_str, models.LotteryStrategyType.FIXED.value,
+                                                      True, 0, lottery.name, uow, FakeCardanoService([]),
+                                                      winners_count=3)
+
+    first_page = services.get_lottery_tickets(lottery_completed.uuid, uow, None, 2)
+    last_page = services.get_lottery_tickets(lottery_completed.uuid, uow, first_page.next_cursor, 2)
+    winners_page = services.get_lottery_winners(lottery_completed.uuid, uow, 0, 5)
+
+    assert first_page.next_cursor == 1 and last_page.next_cursor is None
+    assert first_page.tickets + last_page.tickets == lottery_completed.tickets
+    assert winners_page.winners == lottery_completed.winners[1:]
+    assert winners_page.next_cursor is None
+    assert services.get_lottery(lottery_completed.uuid, uow, False).tickets == []
+    with pytest.raises(services.InvalidLottery):
+        services.get_lottery_tickets(lottery_completed.uuid, uow, None, 0)
@@ -0,0 +1,82 @@
+import asyncio
+import threading
+
+import pytest
+
+from spolottery.service_layer.single_flight import SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_share_one_fetch():
+    single_flight = SingleFlight()
+    fetches = []
+
+    async def fetch():
+        fetches.append(1)
+        await asyncio.sleep(0.01)
+        return ["delegator"]
+
+    results = await asyncio.gather(*[single_flight.do(("pool", 400), fetch) for _ in range(5)])
+
+    assert fetches == [1]
+    assert all(result is results[0] for result in results)
+    assert single_flight.serialize_metrics() == {
+        'calls': 5, 'misses': 1, 'hits': 4, 'hit_ratio': 0.8, 'in_flight': 0}
+
+
+@pytest.mark.asyncio
+async def test_calls_are_not_shared_once_completed_or_across_keys():
+    single_flight = SingleFlight()
+    fetches = []
+
+    async def fetch():
+        fetches.append(1)
+        return len(fetches)
+
+    assert await single_flight.do(("pool", 400), fetch) == 1
+    assert await single_flight.do(("pool", 400), fetch) == 2
+    assert await single_flight.do(("pool", 401), fetch) == 3
+    assert single_flight.metrics.hits == 0
+
+
+@pytest.mark.asyncio
+async def test_fetch_error_is_raised_to_every_caller():
+    single_flight = SingleFlight()
+
+    async def fetch():
+        await asyncio.sleep(0.01)
+        raise ValueError("Unexpected Status")
+
+    results = await asyncio.gather(*[single_flight.do("key", fetch) for _ in range(3)], return_exceptions=True)
+
+    assert all(isinstance(result, ValueError) for result in results)
+    assert single_flight.serialize_metrics()['in_flight'] == 0
+
+
+def test_calls_from_other_event_loops_are_coalesced():
+    single_flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    fetches = []
+    results = []
+
+    async def fetch():
+        fetches.append(1)
+        started.set()
+        while not release.is_set():
+            await asyncio.sleep(0.001)
+        return "epoch 400"
+
+    leader = threading.Thread(target=lambda: results.append(asyncio.run(single_flight.do("key", fetch))))
+    leader.start()
+    started.wait(timeout=5)
+    follower = threading.Thread(target=lambda: results.append(asyncio.run(single_flight.do("key", fetch))))
+    follower.start()
+    while single_flight.metrics.hits == 0:
+        pass
+    release.set()
+    leader.join(timeout=5)
+    follower.join(timeout=5)
+
+    assert fetches == [1]
+    assert results == ["epoch 400", "epoch 400"]
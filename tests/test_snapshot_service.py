@@ -0,0 +1,193 @@
+import argparse
+import csv
+import gzip
+import json
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from tests.conftest import make_lottery, make_pool, make_pool_block
+from spolottery.domain import models
+from spolottery.entrypoints import cli
+from spolottery.service_layer import unit_of_work
+from spolottery.service_layer.snapshot_service import (
+    SnapshotCardanoService,
+    SnapshotFormatError,
+    bech32_decode,
+    bech32_encode,
+    pool_hex,
+    stake_address_id,
+)
+
+POOL_ID = make_pool().pool_id
+ANOTHER_POOL_ID = make_pool_block().pool_id
+ADDRESS_IDS = [
+    "stake1ux393u69v33gl9pumdaxdu9kpmresdnjc76gjnfphmj8uqq5jvh6c",
+    "stake1uyfy0mj0n57wl87tj6anj2mhge40n3tjhwx0exj9r7k97egvjq0z4",
+    "stake1u9yrn7z2g0ynx4wtpqfuv7fj3uuasavtzg6ulfv2f647jhcluzuur",
+]
+LEFT_ADDRESS_ID = "stake1ux46h2at4w46h2at4w46h2at4w46h2at4w46h2at4w46h2cfk870n"
+
+
+def make_records():
+    """
+    Epochs 300 to 308 : three delegators of the pool (the last one joined at
+    epoch 305) and one delegator who left for another pool at epoch 308
+    """
+    records = []
+    for epoch_no in range(300, 309):
+        for i, address_id in enumerate(ADDRESS_IDS):
+            pool_id = POOL_ID if i < 2 or epoch_no >= 305 else ANOTHER_POOL_ID
+            records.append((address_id, pool_id, epoch_no, (i + 1) * 1_000_000 + epoch_no))
+        records.append((LEFT_ADDRESS_ID, POOL_ID if epoch_no < 308 else ANOTHER_POOL_ID, epoch_no, 5_000_000))
+    return records
+
+
+def write_csv(path, header=True):
+    with open(path, "w", newline="") as snapshot_file:
+        writer = csv.writer(snapshot_file)
+        if header:
+            writer.writerow(["epoch", "amount", "pool_id", "stake_address"])
+            writer.writerows((epoch_no, amount, pool_id, address_id)
+                             for address_id, pool_id, epoch_no, amount in make_records())
+        else:
+            writer.writerows(make_records())
+    return str(path)
+
+
+def write_jsonl_gz(path):
+    with gzip.open(path, "wt") as snapshot_file:
+        for address_id, pool_id, epoch_no, amount in make_records():
+            snapshot_file.write(json.dumps({"stake_address": address_id, "pool_id": pool_id,
+                                            "epoch": epoch_no, "amount": amount}) + "\n")
+    return str(path)
+
+
+def test_bech32_round_trip():
+    # Arrange
+    hrp, payload = bech32_decode(POOL_ID)
+
+    # Act/Assert
+    assert hrp == "pool"
+    assert payload.hex() == make_pool().hex
+    assert bech32_encode("pool", payload) == POOL_ID
+    assert pool_hex(ANOTHER_POOL_ID) == make_pool_block().hex
+    with pytest.raises(ValueError):
+        bech32_decode(POOL_ID[:-1] + "q")
+
+
+def test_stake_address_id_from_ledger_credential():
+    # Arrange
+    credential_hash = bech32_decode(ADDRESS_IDS[0])[1][1:].hex()
+
+    # Act/Assert
+    assert stake_address_id("keyHash-" + credential_hash) == ADDRESS_IDS[0]
+
+
+@pytest.mark.asyncio
+async def test_snapshot_pool_delegators_at_latest_epoch(tmp_path):
+    # Arrange
+    cardano_service = SnapshotCardanoService.from_file(write_csv(tmp_path / "snapshot.csv"))
+
+    # Act
+    delegators = await cardano_service.get_pool_delegators(POOL_ID)
+
+    # Assert
+    assert await cardano_service.get_current_epoch() == 308
+    assert sorted(delegator.address_id for delegator in delegators) == sorted(ADDRESS_IDS)
+    assert {delegator.address_id: delegator.live_stake for delegator in delegators} == {
+        address_id: (i + 1) * 1_000_000 + 308 for i, address_id in enumerate(ADDRESS_IDS)}
+
+
+@pytest.mark.asyncio
+async def test_snapshot_delegators_history_since_stored_epochs(tmp_path):
+    # Arrange
+    cardano_service = SnapshotCardanoService.from_file(write_csv(tmp_path / "snapshot.csv", header=False),
+                                                       snapshot_format="csv")
+    delegators = await cardano_service.get_pool_delegators(POOL_ID)
+
+    # Act
+    delegators = await cardano_service.get_delegators_history(delegators, since_epochs={ADDRESS_IDS[0]: 306})
+
+    # Assert
+    histories = {delegator.address_id: list(delegator.delegation_history) for delegator in delegators}
+    assert [delegation.epoch_no for delegation in histories[ADDRESS_IDS[0]]] == [307, 308]
+    assert len(histories[ADDRESS_IDS[2]]) == 9
+    assert histories[ADDRESS_IDS[2]][0].pool_id == ANOTHER_POOL_ID
+    assert histories[ADDRESS_IDS[2]][-1].pool_id == POOL_ID
+
+
+@pytest.mark.asyncio
+async def test_snapshot_jsonl_gz_lottery_tickets(tmp_path):
+    # Arrange
+    cardano_service = SnapshotCardanoService.from_file(write_jsonl_gz(tmp_path / "snapshot.jsonl.gz"))
+    lottery = make_lottery(models.LotteryStrategyType.STAKE.value)
+
+    async def delegators_batches():
+        delegators = await cardano_service.get_pool_delegators(POOL_ID)
+        yield delegators[:2]
+        yield delegators[2:]
+
+    # Act
+    delegators = [delegator async for batch in cardano_service.iter_delegators_history(delegators_batches())
+                  for delegator in batch]
+    lottery_tickets = models.prepare_lottery_tickets_list(delegators, lottery, make_pool())
+
+    # Assert
+    assert all(len(delegator.delegation_history) == 9 for delegator in delegators)
+    # The last delegator joined the pool inside the lottery window
+    assert sorted(ticket.delegator_id for ticket in lottery_tickets) == sorted(ADDRESS_IDS[:2])
+
+
+def test_snapshot_unknown_format(tmp_path):
+    # Act/Assert
+    with pytest.raises(SnapshotFormatError, match="Unknown snapshot format"):
+        SnapshotCardanoService.from_file(str(tmp_path / "snapshot.parquet"))
+
+
+@pytest.mark.asyncio
+async def test_snapshot_ledger_state(tmp_path):
+    # Arrange
+    pytest.importorskip("ijson")
+
+    def credential(address_id):
+        return "keyHash-" + bech32_decode(address_id)[1][1:].hex()
+
+    def stake_snapshot(epoch_no):
+        records = [record for record in make_records() if record[2] == epoch_no]
+        return {"stake": {credential(address_id): amount for address_id, _, _, amount in records},
+                "delegations": {credential(address_id): pool_hex(pool_id) for address_id, pool_id, _, _ in records}}
+
+    path = tmp_path / "ledger-state.json"
+    path.write_text(json.dumps({"lastEpoch": 307, "stateBefore": {"esSnapshots": {
+        "pstakeMark": stake_snapshot(308), "pstakeSet": stake_snapshot(307), "pstakeGo": stake_snapshot(306)}}}))
+    cardano_service = SnapshotCardanoService.from_file(str(path))
+
+    # Act
+    delegators = await cardano_service.get_delegators_history(await cardano_service.get_pool_delegators(POOL_ID))
+
+    # Assert
+    assert await cardano_service.get_current_epoch() == 308
+    assert sorted(delegator.address_id for delegator in delegators) == sorted(ADDRESS_IDS)
+    for delegator in delegators:
+        assert [delegation.epoch_no for delegation in delegator.delegation_history] == [306, 307, 308]
+
+
+@pytest.mark.asyncio
+async def test_snapshot_lottery_on_empty_database(tmp_path, session):
+    # Arrange : no pool stored, the snapshot is the only source
+    session_factory = sessionmaker(bind=session.get_bind())
+    args = argparse.Namespace(
+        snapshot=write_csv(tmp_path / "snapshot.csv"), format=None, testnet=False, pool_id=POOL_ID,
+        name="Snapshot lottery", strategy=models.LotteryStrategyType.FIXED.value, start_epoch=None,
+        count_epochs=1, draw_date=None, winners=2, min_live_stake=0, owners_allowed=True)
+
+    # Act
+    lottery_dto = await cli._snapshot_lottery(args, lambda: unit_of_work.SqlAlchemyUnitOfWork(session_factory))
+
+    # Assert
+    assert lottery_dto.pool_id == POOL_ID
+    assert lottery_dto.start_epoch == 308
+    assert sorted(ticket.delegator_id for ticket in lottery_dto.tickets) == sorted(ADDRESS_IDS)
+    with unit_of_work.SqlAlchemyUnitOfWork(session_factory) as uow:
+        assert uow.pools.list_ids() == {POOL_ID, ANOTHER_POOL_ID}
@@ -0,0 +1,132 @@
+import random
+
+import numpy as np
+
+from spolottery.domain.models import (
+    Delegation,
+    Delegator,
+    first_delegation_amount,
+    is_eligible,
+    is_live_stake_enough,
+    prepare_lottery_tickets_list,
+)
+from spolottery.domain.stake_engine import DelegationColumns
+from tests.conftest import make_pool, make_lottery, make_delegators
+
+
+ANOTHER_POOL_ID = "ea90b56d9c4d04c583ec728c8b415948b310d4653d12bd281aaff9df"
+
+
+def make_random_delegators(pool_id, count_delegators, seed=42):
+    rand = random.Random(seed)
+    delegators = []
+    for i in range(count_delegators):
+        history = set()
+        for epoch_no in rand.sample(range(290, 312), rand.randint(0, 12)):
+            history.add(Delegation(
+                pool_id=pool_id if rand.random() < 0.8 else ANOTHER_POOL_ID,
+                amount=rand.randint(0, 10_000_000_000),
+                epoch_no=epoch_no,
+            ))
+        delegators.append(Delegator(
+            address_id=f"stake1u{i:052d}",
+            live_stake=rand.randint(0, 10_000_000_000),
+            delegation_history=history,
+        ))
+    return delegators
+
+
+def test_eligibility_mask_matches_is_eligible():
+    pool = make_pool()
+    delegators = make_random_delegators(pool.pool_id, 500)
+    columns = DelegationColumns.from_delegators(delegators)
+
+    for current_epoch, count_epochs in [(306, 2), (311, 6), (300, 0), (320, 3)]:
+        expected = [is_eligible(d, pool.pool_id, current_epoch, count_epochs)
+                    for d in delegators]
+        mask = columns.eligibility_mask(
+            pool.pool_id, current_epoch, count_epochs)
+
+        assert mask.tolist() == expected
+
+
+def test_live_stake_mask_matches_is_live_stake_enough():
+    pool = make_pool()
+    delegators = make_random_delegators(pool.pool_id, 200)
+    columns = DelegationColumns.from_delegators(delegators)
+
+    expected = [is_live_stake_enough(d, pool.pool_id, 5_000_000_000)
+                for d in delegators]
+
+    assert columns.live_stake_mask(5_000_000_000).tolist() == expected
+
+
+def test_first_delegation_amounts_matches_first_delegation_amount():
+    pool = make_pool()
+    delegators = make_random_delegators(pool.pool_id, 500)
+    columns = DelegationColumns.from_delegators(delegators)
+
+    for target_pool_id in [pool.pool_id, ANOTHER_POOL_ID, "unknown"]:
+        for count_epochs in [1, 2, 5]:
+            expected = [first_delegation_amount(d, target_pool_id, count_epochs)
+                        for d in delegators]
+            amounts = columns.first_delegation_amounts(
+                target_pool_id, count_epochs)
+
+            assert amounts.tolist() == expected
+
+
+def test_take_keeps_selected_delegators():
+    pool = make_pool()
+    delegators = make_random_delegators(pool.pool_id, 50)
+    columns = DelegationColumns.from_delegators(delegators)
+    mask = np.arange(len(delegators)) % 3 == 0
+
+    subset = columns.take(mask)
+    expected = DelegationColumns.from_delegators(
+        [d for d, keep in zip(delegators, mask) if keep])
+
+    assert subset.first_delegation_amounts(pool.pool_id, 2).tolist() == \
+        expected.first_delegation_amounts(pool.pool_id, 2).tolist()
+    assert subset.live_stake.tolist() == expected.live_stake.tolist()
+
+
+def test_mean_stakes_matches_stake_strategy():
+    pool = make_pool()
+    delegators = make_random_delegators(pool.pool_id, 300)
+    columns = DelegationColumns.from_delegators(delegators)
+
+    expected = [
+        round(abs(int(first_delegation_amount(d, pool.pool_id, 3)) + int(d.live_stake)) / 3, 2)
+        for d in delegators
+    ]
+
+    assert columns.mean_stakes(pool.pool_id, 3).tolist() == expected
+
+
+def test_prepare_stake_lottery_tickets_matches_per_delegator_computation():
+    pool = make_pool()
+    delegators = make_random_delegators(pool.pool_id, 1000) + make_delegators()
+    lottery = make_lottery(strategy_type="Stake")
+    lottery.start_epoch = 311
+    lottery.count_epochs = 4
+
+    eligible = [d for d in delegators
+                if is_eligible(d, pool.pool_id, lottery.start_epoch, lottery.count_epochs) and
+                is_live_stake_enough(d, pool.pool_id, 0)]
+    mean_stakes = [
+        round(abs(int(first_delegation_amount(d, pool.pool_id, lottery.count_epochs)) +
+                  int(d.live_stake)) / lottery.count_epochs, 2)
+        for d in eligible
+    ]
+    total_mean_stake = 0
+    for mean_stake in mean_stakes:
+        total_mean_stake += mean_stake
+
+    lottery_tickets = prepare_lottery_tickets_list(delegators, lottery, pool)
+
+    assert [lt.delegator_id for lt in lottery_tickets] == [
+        d.address_id for d in eligible]
+    assert [lt.delegator_lottery_stake for lt in lottery_tickets] == mean_stakes
+    assert [lt.winning_likelyhood for lt in lottery_tickets] == [
+        mean_stake / total_mean_stake for mean_stake in mean_stakes]
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from spolottery.adapters import repository
+from spolottery.adapters.ticket_blob import LotteryTicketBlob, TicketBlobError, encode_tickets
+from spolottery.domain import models
+from tests.conftest import make_lottery
+
+
+def make_ticket_columns():
+    return models.LotteryTicketColumns(
+        delegator_ids=["stake1u9yrn7z2g0ynx4wtpqfuv7fj3uuasavtzg6ulfv2f647jhcluzuur",
+                       "stake1ux393u69v33gl9pumdaxdu9kpmresdnjc76gjnfphmj8uqq5jvh6c",
+                       "stake1uyfy0mj0n57wl87tj6anj2mhge40n3tjhwx0exj9r7k97egvjq0z4"],
+        winning_likelyhoods=np.array([0.5, 0.25, 0.25]),
+        pool_owners=np.array([False, True, False]),
+        delegator_lottery_stakes=np.array([2000.5, 1000.0, 0.0]),
+    )
+
+
+def test_ticket_blob_round_trip():
+    # Arrange
+    lottery_tickets = make_ticket_columns()
+
+    # Act
+    ticket_blob = LotteryTicketBlob(encode_tickets(lottery_tickets))
+    decoded = ticket_blob.columns()
+
+    # Assert
+    assert len(ticket_blob) == 3
+    assert decoded.delegator_ids == lottery_tickets.delegator_ids
+    assert decoded.winning_likelyhoods.tolist() == lottery_tickets.winning_likelyhoods.tolist()
+    assert decoded.pool_owners.tolist() == lottery_tickets.pool_owners.tolist()
+    assert decoded.delegator_lottery_stakes.tolist() == lottery_tickets.delegator_lottery_stakes.tolist()
+    assert ticket_blob.delegator_ids(1, 2) == lottery_tickets.delegator_ids[1:2]
+
+
+def test_ticket_blob_unknown_format():
+    # Act/Assert
+    with pytest.raises(TicketBlobError):
+        LotteryTicketBlob(b"PARQ" + encode_tickets(make_ticket_columns())[4:])
+
+
+def test_repository_reads_blob_and_rows_lotteries(session):
+    # Arrange
+    lottery_tickets = make_ticket_columns()
+    blob_lottery = make_lottery()
+    rows_lottery = make_lottery()
+    rows_lottery.uuid = "0b3a4c9e-6f55-4d0e-9a8f-2f6c1f0e7d21"
+    repository.SqlAlchemyLotteryRepository(session, "blob").add_bulk(blob_lottery, lottery_tickets, ["stake1w"])
+    repository.SqlAlchemyLotteryRepository(session, "rows").add_bulk(rows_lottery, lottery_tickets, ["stake1w"])
+    session.commit()
+    lottery_repo = repository.SqlAlchemyLotteryRepository(session)
+
+    # Act
+    blob_columns = lottery_repo.get_ticket_columns(blob_lottery.uuid)
+    rows_columns = lottery_repo.get_ticket_columns(rows_lottery.uuid)
+    first_page = lottery_repo.list_tickets(blob_lottery.uuid, None, 2)
+    last_page = lottery_repo.list_tickets(blob_lottery.uuid, first_page[-1][0], 2)
+
+    # Assert
+    assert session.execute("SELECT count(*) FROM lottery_tickets").scalar() == 3
+    assert blob_columns.delegator_ids == rows_columns.delegator_ids == lottery_tickets.delegator_ids
+    assert blob_columns.winning_likelyhoods.tolist() == rows_columns.winning_likelyhoods.tolist()
+    assert [row[0] for row in first_page + last_page] == [0, 1, 2]
+    assert [row[1] for row in first_page + last_page] == lottery_tickets.delegator_ids
+    assert blob_lottery.draw_winners(blob_columns) == blob_lottery.draw_winners(lottery_tickets)
+
+
+def test_repository_unknown_tickets_storage(session):
+    # Act/Assert
+    with pytest.raises(ValueError):
+        repository.SqlAlchemyLotteryRepository(session, "parquet")